@@ -0,0 +1,436 @@
+# benchmarks/bench_pipeline.py
+"""
+Reproducible per-stage benchmarks on synthetic claims.
+
+    python benchmarks/bench_pipeline.py                          # 1k, 100k, 1M claims
+    python benchmarks/bench_pipeline.py --scales 1000 --stages classify_issue,export_powerbi_csvs
+    python benchmarks/bench_pipeline.py --compare old.json new.json
+
+Everything runs against a throwaway SQLite DB, export dir, metrics dir and a local OpenAI-compatible
+stub, so nothing under app/data is touched and no API key is needed. Results (seconds and rows/sec per
+stage and scale, plus git commit and machine info) are written as JSON to benchmarks/results/.
+"""
+from __future__ import annotations
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+RESULTS_DIR = ROOT / "benchmarks" / "results"
+
+DEFAULT_SCALES = [1_000, 100_000, 1_000_000]
+IMAGE_SIZES = [(640, 480), (1280, 720), (1920, 1080), (4032, 3024)]
+REGRESSION_THRESHOLD = 0.10  # --compare flags stages whose rows/sec dropped by more than this
+
+# ---- Synthetic data ----
+_PRODUCTS = ["wireless headphones", "4K monitor", "laptop stand", "running shoes", "power bank",
+             "smartwatch", "bluetooth speaker", "winter jacket", "phone case", "mechanical keyboard"]
+_TEMPLATES = [
+    "The {p} has a constant crackle and noise from the left side.",
+    "Mic on my {p} stopped working after a week, sound cuts out.",
+    "There is a dead pixel in the middle of the {p} screen and the display flickers.",
+    "Stitching came off and the {p} looks broken, very poor build.",
+    "My {p} won't turn on, battery drains overnight even when not charging.",
+    "The {p} arrived damaged, box damaged and a dent on the side. Courier was careless.",
+    "Ordered a size M {p} but it is too small and tight around the shoulders.",
+    "Package was delivered {d} days late, needed the {p} for a gift.",
+    "Everything arrived on time and the {p} works perfectly, thanks!",
+    "I didn't receive my {p}. This is frustrating and nobody answers.",
+    "Honestly not sure what is wrong, the {p} just feels off compared to the photos.",
+]
+_TAILS = ["", " Please help.", " I want a refund.", " Can you send a replacement?",
+          " Really disappointed.", " Second time this happened!", " Thanks in advance."]
+_STATUSES = ["new", "in_review", "approved", "rejected", "refunded"]
+
+def synthetic_descriptions(n: int, seed: int = 7) -> List[str]:
+    """`n` claim descriptions mixing every issue category, neutral/positive text and noise."""
+    rng = random.Random(seed)
+    return [
+        rng.choice(_TEMPLATES).format(p=rng.choice(_PRODUCTS), d=rng.randint(2, 12)) + rng.choice(_TAILS)
+        for _ in range(n)
+    ]
+
+def synthetic_feature_rows(n: int, seed: int = 7) -> List[SimpleNamespace]:
+    """Rows shaped like the ANN feature query (FEATURE_COLUMNS attributes)."""
+    from app.ann.refund_predictor import ISSUE_MAP
+    rng = random.Random(seed)
+    labels = list(ISSUE_MAP) + [None]
+    return [
+        SimpleNamespace(
+            sentiment_score=rng.uniform(-1, 1), is_photo_attached=rng.random() < 0.3,
+            damage_score=rng.random() if rng.random() < 0.3 else None, issue_label=rng.choice(labels),
+        )
+        for _ in range(n)
+    ]
+
+def synthetic_image(width: int, height: int, seed: int = 7) -> bytes:
+    """JPEG with gradients, noise and a few hard edges, so blur/edge measures do real work."""
+    import numpy as np
+    from PIL import Image, ImageDraw
+    rng = np.random.default_rng(seed)
+    base = np.linspace(40, 220, width, dtype=np.float32)[None, :, None].repeat(height, 0).repeat(3, 2)
+    base += rng.normal(0, 12, size=base.shape).astype(np.float32)
+    img = Image.fromarray(np.clip(base, 0, 255).astype(np.uint8))
+    draw = ImageDraw.Draw(img)
+    for _ in range(12):
+        x0, y0 = int(rng.integers(0, width)), int(rng.integers(0, height))
+        draw.line([x0, y0, x0 + int(rng.integers(-width // 3, width // 3)), y0 + int(rng.integers(-height // 3, height // 3))],
+                  fill=(20, 20, 20), width=max(2, width // 300))
+    buf = BytesIO()
+    img.save(buf, format="JPEG", quality=90)
+    return buf.getvalue()
+
+def populate_db(n: int, seed: int = 7, chunk: int = 50_000) -> None:
+    """Fill the (benchmark) DB with `n` claims with NLP/ANN outputs set, then rebuild claims_facts."""
+    from sqlalchemy import text
+    from app.db.facts import refresh_claims_facts
+    from app.db.session import get_write_engine
+    rng = random.Random(seed)
+    n_cust, n_prod = max(10, n // 20), max(10, n // 200)
+    labels = ["Audio Issue", "Display Defect", "Build Quality", "Battery/Power", "Shipping Damage", "Size/Fit", "Other"]
+    now = datetime.utcnow()
+    eng = get_write_engine()
+    with eng.begin() as conn:
+        for t in ("claims_facts", "claims", "products", "customers"):
+            conn.execute(text(f"DELETE FROM {t}"))
+        conn.execute(text("INSERT INTO customers(id, name, email, created_at) VALUES (:i, :n, :e, :t)"),
+                     [{"i": i, "n": f"Customer {i}", "e": f"c{i}@example.com", "t": now} for i in range(1, n_cust + 1)])
+        conn.execute(text("INSERT INTO products(id, sku, name, category, price, created_at) VALUES (:i, :s, :n, :c, :p, :t)"),
+                     [{"i": i, "s": f"SKU-{i}", "n": f"{_PRODUCTS[i % len(_PRODUCTS)]} {i}", "c": "Electronics",
+                       "p": round(rng.uniform(5, 500), 2), "t": now} for i in range(1, n_prod + 1)])
+    insert = text(
+        "INSERT INTO claims(id, customer_id, product_id, description, status, issue_label, sentiment_score,"
+        " is_photo_attached, damage_score, predicted_refund_prob, created_at, updated_at)"
+        " VALUES (:id, :cu, :pr, :d, :st, :lb, :se, :ph, :dm, :rp, :t, :t)"
+    )
+    for lo in range(0, n, chunk):
+        descs = synthetic_descriptions(min(chunk, n - lo), seed=seed + lo)
+        with eng.begin() as conn:
+            conn.execute(insert, [{
+                "id": lo + i + 1, "cu": rng.randint(1, n_cust), "pr": rng.randint(1, n_prod), "d": d,
+                "st": rng.choice(_STATUSES), "lb": rng.choice(labels), "se": rng.uniform(-1, 1),
+                "ph": int(rng.random() < 0.3), "dm": rng.random(), "rp": rng.random(), "t": now,
+            } for i, d in enumerate(descs)])
+    with eng.begin() as conn:
+        refresh_claims_facts(conn)
+
+# ---- OpenAI-compatible stub ----
+class _StubChatCompletions(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, like the real API
+    latency_s = 0.0
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        if self.latency_s:
+            time.sleep(self.latency_s)
+        content = json.dumps({"summary": "- Customer reports an issue\n- Wants a resolution",
+                              "reply": "Hi, sorry about that. We are on it."})
+        raw = json.dumps({
+            "id": "stub", "object": "chat.completion", "created": 0, "model": body["model"],
+            "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": content}}],
+            "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2},
+        }).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(raw)))
+        self.end_headers()
+        self.wfile.write(raw)
+
+    def log_message(self, *args):
+        pass
+
+def start_stub(latency_s: float = 0.0) -> ThreadingHTTPServer:
+    handler = type("_Stub", (_StubChatCompletions,), {"latency_s": latency_s})
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+# ---- Stages ----
+# Each stage gets (scale, ctx) and returns (rows processed, extra info). Inputs are built by the
+# untimed setup functions below and shared through ctx, so only the stage itself is measured.
+StageFn = Callable[[int, Dict[str, Any]], Tuple[int, Dict[str, Any]]]
+
+def setup_descs(scale: int, ctx: Dict[str, Any]) -> None:
+    if ctx.get("descs_scale") != scale:
+        ctx["descs"], ctx["descs_scale"] = synthetic_descriptions(scale, seed=ctx["seed"]), scale
+    if not ctx.get("nlp_warm"):
+        # first calls compile the keyword regex and load the VADER lexicon; keep that out of the numbers
+        from app.nlp.text_models import classify_issue, classify_issues, sentiment_compound
+        classify_issue(ctx["descs"][0]), classify_issues(ctx["descs"][:2]), sentiment_compound(ctx["descs"][0])
+        ctx["nlp_warm"] = True
+
+def setup_feature_rows(scale: int, ctx: Dict[str, Any]) -> None:
+    if ctx.get("rows_scale") != scale:
+        ctx["feature_rows"], ctx["rows_scale"] = synthetic_feature_rows(scale, seed=ctx["seed"]), scale
+
+def setup_ann(scale: int, ctx: Dict[str, Any]) -> None:
+    from sklearn.neural_network import MLPRegressor
+    from app.ann.refund_predictor import _extract_features_batch, _synthetic_training_data
+    setup_feature_rows(scale, ctx)
+    if ctx.get("ann_model") is None:
+        X, y = _synthetic_training_data()  # same architecture as train_model, without touching the registry
+        ctx["ann_model"] = MLPRegressor(hidden_layer_sizes=(16, 8), activation="relu", random_state=42, max_iter=600).fit(X, y)
+    if ctx.get("ann_X_scale") != scale:
+        ctx["ann_X"], ctx["ann_X_scale"] = _extract_features_batch(ctx["feature_rows"]), scale
+
+def setup_images(scale: int, ctx: Dict[str, Any]) -> None:
+    if "images_bytes" not in ctx:
+        ctx["images_bytes"] = {(w, h): synthetic_image(w, h, seed=ctx["seed"]) for w, h in IMAGE_SIZES}
+
+def setup_db(scale: int, ctx: Dict[str, Any]) -> None:
+    if ctx.get("db_scale") != scale:
+        t = time.perf_counter()
+        populate_db(scale, seed=ctx["seed"])
+        ctx["db_scale"], ctx["db_populate_s"] = scale, time.perf_counter() - t
+
+def bench_classify_issue(scale, ctx):
+    from app.nlp.text_models import classify_issue
+    descs = ctx["descs"]
+    for d in descs:
+        classify_issue(d)
+    return len(descs), {}
+
+def bench_classify_issues_batch(scale, ctx):
+    from app.nlp.text_models import classify_issues
+    descs = ctx["descs"]
+    classify_issues(descs)
+    return len(descs), {}
+
+def bench_sentiment_compound(scale, ctx):
+    from app.nlp.text_models import sentiment_compound
+    descs = ctx["descs"]
+    for d in descs:
+        sentiment_compound(d)
+    return len(descs), {}
+
+def bench_sentiment_compounds_batch(scale, ctx):
+    from app.nlp import text_models
+    text_models._sent_cache.clear()  # measure dedup + pool, not a warm memo from an earlier repeat
+    text_models.sentiment_compounds(ctx["descs"])
+    return len(ctx["descs"]), {}
+
+def bench_extract_keywords_tfidf(scale, ctx):
+    from app.nlp.text_models import extract_keywords_tfidf, fit_tfidf
+    descs = ctx["descs"]
+    t = time.perf_counter()
+    vec = fit_tfidf(descs)
+    fit_s = time.perf_counter() - t
+    extract_keywords_tfidf(descs, top_k=5, vectorizer=vec)
+    return len(descs), {"fit_seconds": round(fit_s, 4)}
+
+def bench_ann_features(scale, ctx):
+    from app.ann.refund_predictor import _extract_features_batch
+    _extract_features_batch(ctx["feature_rows"])
+    return len(ctx["feature_rows"]), {}
+
+def bench_ann_inference(scale, ctx):
+    import numpy as np
+    np.clip(ctx["ann_model"].predict(ctx["ann_X"]), 0.0, 1.0)
+    return len(ctx["ann_X"]), {}
+
+def bench_draft_summary_and_reply(scale, ctx):
+    from app.genai import summarizer
+    n = min(scale, ctx["llm_max"])
+    descs = ctx["descs"][:n]
+    for d in descs:
+        summarizer.draft_summary_and_reply(d, "Alex", "Headphones", "new", use_cache=False)
+    return n, {"capped_at": ctx["llm_max"], "stub_latency_ms": ctx["llm_latency_ms"]}
+
+def bench_draft_many_async(scale, ctx):
+    import asyncio
+    from openai import AsyncOpenAI
+    from app.genai.summarizer import draft_many_async
+    n = min(scale, ctx["llm_max"])
+    items = [{"claim_text": d, "customer_name": "Alex", "product_name": "Headphones", "claim_status": "new"}
+             for d in ctx["descs"][:n]]
+
+    async def go():
+        async with AsyncOpenAI(api_key="bench", base_url=ctx["stub_url"]) as client:
+            return await draft_many_async(items, concurrency=ctx["llm_concurrency"], rpm=None, tpm=None,
+                                          client=client, use_cache=False)
+    asyncio.run(go())
+    return n, {"capped_at": ctx["llm_max"], "concurrency": ctx["llm_concurrency"]}
+
+def bench_export_powerbi_csvs(scale, ctx):
+    from app.utils import powerbi_export
+    for p in powerbi_export.EXPORT_DIR.glob("*"):
+        p.unlink()  # always a full export
+    out = powerbi_export.export_powerbi_csvs()
+    sizes = {k: p.stat().st_size for k, p in out.items()}
+    return scale, {"tables": sorted(out), "bytes": sum(sizes.values()), "populate_seconds": round(ctx["db_populate_s"], 2)}
+
+def bench_analyze_image(scale, ctx):
+    """Scale-independent: decodes/measures each resolution, full-size decode and reduced decode."""
+    from app.cnn.image_checks import analyze_image
+    per_size = {}
+    total = 0
+    for (w, h), img in ctx["images_bytes"].items():
+        for mode, reduced in (("full", False), ("reduced", True)):
+            t = time.perf_counter()
+            for _ in range(ctx["images"]):
+                analyze_image(img, reduced=reduced)
+            dt = time.perf_counter() - t
+            per_size[f"{w}x{h}/{mode}"] = {"seconds": round(dt, 4), "images_per_sec": round(ctx["images"] / dt, 2)}
+            total += ctx["images"]
+    return total, {"per_resolution": per_size}
+
+STAGES: Dict[str, StageFn] = {
+    "classify_issue": bench_classify_issue,
+    "classify_issues_batch": bench_classify_issues_batch,
+    "sentiment_compound": bench_sentiment_compound,
+    "sentiment_compounds_batch": bench_sentiment_compounds_batch,
+    "extract_keywords_tfidf": bench_extract_keywords_tfidf,
+    "ann_features": bench_ann_features,
+    "ann_inference": bench_ann_inference,
+    "analyze_image": bench_analyze_image,
+    "draft_summary_and_reply": bench_draft_summary_and_reply,
+    "draft_many_async": bench_draft_many_async,
+    "export_powerbi_csvs": bench_export_powerbi_csvs,
+}
+SETUPS: Dict[str, Callable[[int, Dict[str, Any]], None]] = {
+    "classify_issue": setup_descs,
+    "classify_issues_batch": setup_descs,
+    "sentiment_compound": setup_descs,
+    "sentiment_compounds_batch": setup_descs,
+    "extract_keywords_tfidf": setup_descs,
+    "ann_features": setup_feature_rows,
+    "ann_inference": setup_ann,
+    "analyze_image": setup_images,
+    "draft_summary_and_reply": setup_descs,
+    "draft_many_async": setup_descs,
+    "export_powerbi_csvs": setup_db,
+}
+SCALE_INDEPENDENT = {"analyze_image"}
+
+# ---- Runner ----
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip() or None
+    except Exception:
+        return None
+
+def _isolate(workdir: Path, stub_url: str) -> None:
+    """Point the app at a scratch DB and the stub before any app module is imported."""
+    os.environ["DATABASE_URL"] = f"sqlite:///{workdir / 'bench.db'}"
+    os.environ["OPENAI_API_KEY"] = "bench"
+    os.environ["OPENAI_BASE_URL"] = stub_url
+    from app import config
+    if config.DATABASE_URL != os.environ["DATABASE_URL"]:
+        raise SystemExit("app.config.DATABASE_URL does not follow the DATABASE_URL env var; refusing to benchmark the real DB")
+    # via the environment so pool workers (fresh interpreters) write their timings there too
+    os.environ["CLAIMS_METRICS_DIR"] = str(workdir / "metrics")
+    from app.utils import metrics
+    if metrics.METRICS_DIR != workdir / "metrics":
+        raise SystemExit("app.utils.metrics was imported before isolation; refusing to write into app/data/metrics")
+    from app.utils import powerbi_export
+    powerbi_export.EXPORT_DIR = workdir / "exports"
+    powerbi_export.EXPORT_DIR.mkdir(parents=True, exist_ok=True)
+    powerbi_export.MANIFEST_PATH = powerbi_export.EXPORT_DIR / "manifest.json"
+    from app.db.migrations import ensure_schema
+    ensure_schema()
+
+def run(scales: Sequence[int], stages: Sequence[str], repeat: int = 1, seed: int = 7, images: int = 5,
+        llm_max: int = 500, llm_latency_ms: float = 50.0, llm_concurrency: int = 16) -> Dict[str, Any]:
+    server = start_stub(llm_latency_ms / 1000)
+    stub_url = f"http://127.0.0.1:{server.server_address[1]}/v1"
+    results: List[Dict[str, Any]] = []
+    with tempfile.TemporaryDirectory(prefix="claims-bench-") as tmp:
+        _isolate(Path(tmp), stub_url)
+        ctx: Dict[str, Any] = {"seed": seed, "images": images, "llm_max": llm_max, "stub_url": stub_url,
+                               "llm_latency_ms": llm_latency_ms, "llm_concurrency": llm_concurrency}
+        for scale in scales:
+            for name in stages:
+                if name in SCALE_INDEPENDENT and scale != scales[0]:
+                    continue
+                if name in SETUPS:
+                    SETUPS[name](scale, ctx)
+                times, rows, extra = [], 0, {}
+                for _ in range(repeat):
+                    t = time.perf_counter()
+                    rows, extra = STAGES[name](scale, ctx)
+                    times.append(time.perf_counter() - t)
+                best = min(times)
+                rec = {
+                    "stage": name, "scale": None if name in SCALE_INDEPENDENT else scale, "rows": rows,
+                    "seconds": round(best, 6), "seconds_all": [round(x, 6) for x in times],
+                    "rows_per_sec": round(rows / best, 2) if best > 0 else None, "extra": extra,
+                }
+                results.append(rec)
+                print(f"{name:<26} scale={str(rec['scale']):>8} rows={rows:>8} "
+                      f"{best:>9.3f}s {rec['rows_per_sec'] or 0:>12,.0f} rows/s", flush=True)
+    server.shutdown()
+    return {
+        "meta": {
+            "commit": _git_commit(),
+            "timestamp": datetime.utcnow().isoformat(timespec="seconds"),
+            "python": platform.python_version(), "platform": platform.platform(),
+            "cpu_count": os.cpu_count(), "seed": seed, "repeat": repeat, "scales": list(scales),
+        },
+        "results": results,
+    }
+
+def compare(old_path: Path, new_path: Path, threshold: float = REGRESSION_THRESHOLD) -> int:
+    """Print rows/sec per (stage, scale) side by side; returns the number of regressions."""
+    def index(path: Path) -> Dict[tuple, Dict[str, Any]]:
+        return {(r["stage"], r["scale"]): r for r in json.loads(path.read_text(encoding="utf-8"))["results"]}
+    old, new = index(old_path), index(new_path)
+    regressions = 0
+    for key in sorted(set(old) & set(new), key=lambda k: (k[0], k[1] or 0)):
+        a, b = old[key]["rows_per_sec"], new[key]["rows_per_sec"]
+        if not a or not b:
+            continue
+        change = b / a - 1
+        flag = "  REGRESSION" if change < -threshold else ""
+        regressions += bool(flag)
+        print(f"{key[0]:<26} scale={str(key[1]):>8} {a:>12,.0f} -> {b:>12,.0f} rows/s ({change:+.1%}){flag}")
+    return regressions
+
+def _iter_csv(value: str) -> Iterator[str]:
+    return (v.strip() for v in value.split(",") if v.strip())
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Benchmark every pipeline stage on synthetic claims.")
+    ap.add_argument("--scales", type=int, nargs="+", default=DEFAULT_SCALES)
+    ap.add_argument("--stages", default=",".join(STAGES), help=f"comma-separated subset of: {', '.join(STAGES)}")
+    ap.add_argument("--repeat", type=int, default=1, help="runs per stage; the fastest is reported")
+    ap.add_argument("--seed", type=int, default=7)
+    ap.add_argument("--images", type=int, default=5, help="analyze_image calls per resolution and mode")
+    ap.add_argument("--llm-max", type=int, default=500, help="cap on stub LLM calls per scale")
+    ap.add_argument("--llm-latency-ms", type=float, default=50.0, help="simulated server latency per completion")
+    ap.add_argument("--llm-concurrency", type=int, default=16)
+    ap.add_argument("--out", type=Path, default=None, help="result JSON path (default benchmarks/results/<time>-<commit>.json)")
+    ap.add_argument("--compare", type=Path, nargs=2, metavar=("OLD", "NEW"), help="compare two result files and exit")
+    args = ap.parse_args()
+
+    if args.compare:
+        sys.exit(1 if compare(*args.compare) else 0)
+
+    stages = list(_iter_csv(args.stages))
+    unknown = [s for s in stages if s not in STAGES]
+    if unknown:
+        ap.error(f"unknown stage(s): {', '.join(unknown)}")
+    report = run(args.scales, stages, repeat=args.repeat, seed=args.seed, images=args.images,
+                 llm_max=args.llm_max, llm_latency_ms=args.llm_latency_ms, llm_concurrency=args.llm_concurrency)
+    out = args.out or RESULTS_DIR / f"{datetime.utcnow():%Y%m%dT%H%M%S}-{report['meta']['commit'] or 'nogit'}.json"
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_text(json.dumps(report, indent=2), encoding="utf-8")
+    print(f"wrote {out}")
+
+if __name__ == "__main__":
+    main()
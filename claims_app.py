@@ -1,5 +1,12 @@
 # app/web/claims_app.py
+import time
+_T0 = time.perf_counter()
+
 from pathlib import Path
+from typing import Dict, Optional
+import importlib
+import json
+import os
 import sys
 ROOT = Path(__file__).resolve().parents[2]
 if str(ROOT) not in sys.path:
@@ -10,95 +17,204 @@ import streamlit as st
 from sqlalchemy import text
 
 from app.config import DATABASE_URL
-from app.db.session import get_engine, get_session
+from app.db.session import get_engine, get_session, get_write_engine
 from app.db.create_db import main as create_tables
 from app.db.seed_data import main as seed_sample_data
+from app.db.facts import refresh_claims_facts
+from app.db.migrations import ensure_schema as ensure_db_schema, migrate, reset_schema_check
+from app.db import jobs
+from app.utils import metrics
 
-# ---- Optional modules (safe fallbacks) ----
-try:
-    from app.nlp.run_pipeline import run_nlp_on_claims
-except Exception:
-    def run_nlp_on_claims() -> int: return 0
+_T_IMPORTS = time.perf_counter()
 
-try:
-    from app.cnn.image_checks import analyze_image
-except Exception:
-    analyze_image = None
+st.set_page_config(page_title="AI Returns & Claims Hub", layout="wide")
+st.title("AI Returns & Claims Hub")
 
-try:
-    from app.ann.refund_predictor import run_ann_predictor_on_claims
-except Exception:
-    def run_ann_predictor_on_claims() -> int: return 0
+# Startup profile: APP_PROFILE_STARTUP=1 or ?profile=1 shows per-module import/init cost
+PROFILE = os.getenv("APP_PROFILE_STARTUP") == "1" or st.query_params.get("profile") == "1"
 
-try:
-    from app.genai.summarizer import draft_summary_and_reply
-except Exception:
-    draft_summary_and_reply = None
+@st.cache_resource(show_spinner=False)
+def startup_profile() -> Dict[str, float]:
+    """Milliseconds spent importing/initializing each subsystem, recorded once per server process."""
+    return {}
 
-st.set_page_config(page_title="AI Returns & Claims Hub", layout="wide")
-st.title("AI Returns & Claims Hub")
+startup_profile().setdefault("core imports (pandas, streamlit, sqlalchemy, app.db)", (_T_IMPORTS - _T0) * 1000)
 
-engine = get_engine()
+# ---- Optional modules (loaded on first use, safe fallbacks) ----
+# OpenCV, scikit-learn/joblib, VADER and the OpenAI SDK are only imported when an action needs
+# them, and held for the life of the server process, so first paint and reruns don't pay for them.
+@st.cache_resource(show_spinner=False)
+def load_optional(module: str):
+    t = time.perf_counter()
+    try:
+        mod = importlib.import_module(module)
+    except Exception:
+        mod = None
+    startup_profile()[f"import {module}"] = (time.perf_counter() - t) * 1000
+    return mod
 
-# --- Quick DB ping ---
-try:
-    with engine.connect() as conn:
-        conn.execute(text("SELECT 1"))
+def get_ingest_photo():
+    mod = load_optional("app.cnn.photo_store")
+    return mod.ingest_photo if mod is not None else None
+
+def get_summarizer():
+    return load_optional("app.genai.summarizer")
+
+def get_find_similar():
+    mod = load_optional("app.nlp.dedup")
+    return mod.find_similar if mod is not None else None
+
+@st.cache_resource(show_spinner=False)
+def get_cached_engine():
+    t = time.perf_counter()
+    eng = get_engine()
+    startup_profile()["engine init"] = (time.perf_counter() - t) * 1000
+    return eng
+
+engine = get_cached_engine()
+
+# --- Quick DB ping (re-checked at most once a minute) ---
+@st.cache_data(ttl=60, show_spinner=False)
+def db_ping() -> Optional[str]:
+    try:
+        with engine.connect() as conn:
+            conn.execute(text("SELECT 1"))
+        return None
+    except Exception as e:
+        return str(e)
+
+_ping_error = db_ping()
+if _ping_error is None:
     st.success("DB connectivity OK ✅")
-except Exception as e:
-    st.error(f"DB connection failed: {e}")
-
-# --- Inline migrations (idempotent) ---
-def ensure_claims_all_columns() -> None:
-    with engine.begin() as conn:
-        rows = conn.execute(text("PRAGMA table_info(claims)")).fetchall()
-        cols = {r[1] for r in rows}
-        def add(col, ddl):
-            if col not in cols:
-                conn.execute(text(f"ALTER TABLE claims ADD COLUMN {ddl}"))
-                cols.add(col)
-        # Previously added
-        add("sentiment_score", "sentiment_score REAL")
-        add("predicted_refund_prob", "predicted_refund_prob REAL")
-        add("is_photo_attached", "is_photo_attached INTEGER DEFAULT 0")
-        add("issue_label", "issue_label TEXT")
-        add("key_phrases", "key_phrases TEXT")
-        add("photo_path", "photo_path TEXT")
-        add("photo_blur", "photo_blur REAL")
-        add("photo_brightness", "photo_brightness REAL")
-        add("photo_contrast", "photo_contrast REAL")
-        add("damage_score", "damage_score REAL")
-        # NEW — GenAI outputs
-        add("ai_summary", "ai_summary TEXT")
-        add("ai_reply",   "ai_reply TEXT")
-        add("ai_model",   "ai_model TEXT")
+else:
+    st.error(f"DB connection failed: {_ping_error}")
+
+# --- Migrations (versioned, recorded in schema_migrations) ---
+@st.cache_resource(show_spinner=False)
+def ensure_schema() -> bool:
+    """Version check + pending DDL once per server process (the Fix / Migrate button forces a re-run)."""
+    t = time.perf_counter()
+    ensure_db_schema()
+    startup_profile()["schema check"] = (time.perf_counter() - t) * 1000
+    return True
+
+def force_migrate() -> list:
+    reset_schema_check()
+    ensure_schema.clear()
+    applied = migrate()
+    ensure_schema()
+    return applied
+
+# ---- Helpers ----
+# Query results and schema lookups are cached across reruns/sessions and cleared whenever a
+# pipeline stage or action writes (see invalidate_query_cache), so a rerun costs no DB round trips.
+@st.cache_data(show_spinner=False)
+def read_df(sql: str, params: Optional[dict] = None) -> pd.DataFrame:
+    with metrics.timer("db_read", stage="ui") as t, engine.connect() as conn:
+        df = pd.read_sql_query(text(sql), conn, params=params or {})
+        t.rows = len(df)
+    return df
+
+@st.cache_data(show_spinner=False)
+def table_exists(name: str) -> bool:
+    with engine.connect() as conn:
+        return bool(conn.execute(text(
+            "SELECT 1 FROM sqlite_master WHERE type='table' AND name=:n"
+        ), {"n": name}).fetchone())
+
+@st.cache_data(show_spinner=False)
+def get_columns(table: str):
+    with engine.connect() as conn:
+        return [r[1] for r in conn.execute(text(f"PRAGMA table_info({table})")).fetchall()]
+
+@st.cache_data(show_spinner=False)
+def distinct_values(table: str, col: str):
+    with engine.connect() as conn:
+        return [r[0] for r in conn.execute(text(
+            f"SELECT DISTINCT {col} FROM {table} WHERE {col} IS NOT NULL ORDER BY {col}"
+        )).fetchall()]
+
+@st.cache_data(show_spinner=False)
+def table_counts() -> dict:
+    with engine.connect() as conn:
+        tables = [r[0] for r in conn.execute(text(
+            "SELECT name FROM sqlite_master WHERE type='table' ORDER BY name"
+        )).fetchall()]
+        counts = {}
+        for t in tables:
+            try:
+                counts[t] = conn.execute(text(f"SELECT COUNT(*) FROM {t}")).scalar()
+            except Exception:
+                counts[t] = "n/a"
+    return counts
+
+def invalidate_query_cache() -> None:
+    for fn in (read_df, table_exists, get_columns, distinct_values, table_counts):
+        fn.clear()
+
+def enqueue_job(stage: str, **params) -> int:
+    """Queue a pipeline run for the background worker (started on demand) and return the job id."""
+    ensure_schema()
+    job_id = jobs.enqueue(stage, **params)
+    jobs.ensure_worker()
+    return job_id
+
+def _in_clause(col: str, values, prefix: str, params: dict) -> str:
+    names = []
+    for i, v in enumerate(values):
+        params[f"{prefix}{i}"] = v
+        names.append(f":{prefix}{i}")
+    return f"{col} IN ({', '.join(names)})"
+
+# Claims paging runs in on_click callbacks: they see the cursor of the page the click was made on
+def _prev_claims_page() -> None:
+    cursors = st.session_state["claims_cursors"]
+    if len(cursors) > 1:
+        cursors.pop()
+
+def _next_claims_page() -> None:
+    if st.session_state.get("claims_next_cursor") is not None:
+        st.session_state["claims_cursors"].append(st.session_state["claims_next_cursor"])
 
 # ---- Controls/top buttons ----
 c1,c2,c3,c4,c5,c6,c7 = st.columns(7)
 with c1:
     if st.button("Create tables"):
-        try: create_tables(); st.success("Tables created.")
+        try: create_tables(); force_migrate(); invalidate_query_cache(); st.success("Tables created.")
         except Exception as e: st.error(f"Create tables failed: {e}")
 with c2:
     if st.button("Fix / Migrate DB"):
-        try: ensure_claims_all_columns(); st.success("DB migrated.")
+        try:
+            applied = force_migrate(); invalidate_query_cache()
+            st.success(f"DB migrated (applied {applied})." if applied else "DB already up to date.")
         except Exception as e: st.error(f"Migration failed: {e}")
 with c3:
     if st.button("Seed sample data"):
-        try: seed_sample_data(); st.success("Sample data seeded.")
+        try:
+            ensure_schema(); seed_sample_data()
+            with get_write_engine().begin() as conn:
+                refresh_claims_facts(conn)  # full rebuild: also covers tables recreated outside the migrations
+            invalidate_query_cache(); st.success("Sample data seeded.")
         except Exception as e: st.error(f"Seeding failed: {e}")
 with c4:
     if st.button("Run NLP"):
-        try: ensure_claims_all_columns(); n = run_nlp_on_claims(); st.success(f"NLP updated {n} claims.")
+        try: st.success(f"NLP queued as job #{enqueue_job('nlp')} (see Jobs tab).")
         except Exception as e: st.error(f"NLP failed: {e}")
 with c5:
     if st.button("Run ANN Predictor"):
-        try: ensure_claims_all_columns(); n = run_ann_predictor_on_claims(); st.success(f"ANN predicted for {n} claims.")
+        try: st.success(f"ANN queued as job #{enqueue_job('ann')} (see Jobs tab).")
         except Exception as e: st.error(f"ANN failed: {e}")
+    if st.button("Retrain ANN"):
+        # warm-start on claims labeled since the last training; promoted only if the holdout does not regress
+        try: st.success(f"Retrain queued as job #{enqueue_job('retrain')} (see Jobs tab).")
+        except Exception as e: st.error(f"Retrain failed: {e}")
 with c6:
-    refresh = st.button("Refresh")
+    if st.button("Run Full Pipeline"):
+        # one streaming pass: NLP -> ANN -> GenAI per chunk, each chunk committed once
+        try: st.success(f"Pipeline queued as job #{enqueue_job('stream', genai=True)} (see Jobs tab).")
+        except Exception as e: st.error(f"Pipeline failed: {e}")
 with c7:
-    st.write("")  # spacer
+    refresh = st.button("Refresh")
 
 st.divider()
 
@@ -108,34 +224,39 @@ with st.sidebar:
     claim_id = st.number_input("Claim ID", min_value=1, step=1, value=1)
     photo = st.file_uploader("Photo (jpg/png)", type=["jpg","jpeg","png"])
     if st.button("Analyze & Save Photo"):
+        ingest_photo = get_ingest_photo() if photo else None
         if not photo:
             st.warning("Please upload a photo.")
-        elif analyze_image is None:
+        elif ingest_photo is None:
             st.error("Vision module not installed (Step 4).")
         else:
             try:
-                ensure_claims_all_columns()
-                stats = analyze_image(photo.read())
-                updir = ROOT / "app" / "data" / "uploads"
-                updir.mkdir(parents=True, exist_ok=True)
-                save_path = updir / f"claim_{int(claim_id)}_{photo.name}"
-                with open(save_path,"wb") as f: f.write(photo.getbuffer())
-
-                from app.db.session import get_session
+                ensure_schema()
+                # stored once by content hash; re-uploads and near-identical photos reuse the cached checks
+                stats = ingest_photo(photo)
+
                 from app.models.schema import Claim
-                s = get_session()
+                # read-then-write: take the write lock up front (BEGIN IMMEDIATE) so a pipeline commit
+                # between the read and the UPDATE can't fail the upgrade with SQLITE_BUSY_SNAPSHOT
+                s = get_session(write=True)
                 try:
                     c = s.query(Claim).filter(Claim.id==int(claim_id)).one_or_none()
                     if not c: st.error(f"No claim with id={int(claim_id)}")
                     else:
                         c.is_photo_attached = True
-                        c.photo_path = str(save_path)
+                        c.photo_path = stats["path"]
+                        c.photo_sha256 = stats["sha256"]
                         c.photo_blur = stats["blur"]
                         c.photo_brightness = stats["brightness"]
                         c.photo_contrast = stats["contrast"]
                         c.damage_score = stats["damage_score"]
+                        s.flush()
+                        refresh_claims_facts(s, [c.id])
                         s.commit()
-                        st.success(f"Saved. damage_score={stats['damage_score']:.2f}")
+                        invalidate_query_cache()
+                        st.success(f"Saved. damage_score={stats['damage_score']:.2f} (analysis cache: {stats['cache']})")
+                        if stats.get("thumb_path"):
+                            st.image(stats["thumb_path"])
                 finally: s.close()
             except Exception as e:
                 st.error(f"Photo analysis failed: {e}")
@@ -144,59 +265,46 @@ with st.sidebar:
     st.header("GenAI: Summary + Reply")
     claim_id_ai = st.number_input("Claim ID for GenAI", min_value=1, step=1, value=1, key="genai_id")
     if st.button("Generate for Claim"):
-        if draft_summary_and_reply is None:
-            st.error("GenAI module not available.")
+        try:
+            job_id = enqueue_job("genai", only_missing=False, claim_ids=[int(claim_id_ai)])
+            st.success(f"GenAI for claim {int(claim_id_ai)} queued as job #{job_id}; the draft shows in the Claims tab when done.")
+        except Exception as e:
+            st.error(f"GenAI failed: {e}")
+
+    genai_concurrency = st.slider("Concurrent requests", min_value=1, max_value=32, value=8)
+    if st.button("Generate for all claims missing a summary"):
+        try:
+            job_id = enqueue_job("genai", only_missing=True, concurrency=int(genai_concurrency))
+            st.success(f"GenAI batch queued as job #{job_id} (see Jobs tab).")
+        except Exception as e:
+            st.error(f"GenAI batch failed: {e}")
+
+    st.divider()
+    st.header("Near-duplicate Claims")
+    claim_id_dup = st.number_input("Claim ID to compare", min_value=1, step=1, value=1, key="dup_id")
+    if st.button("Find near-duplicates"):
+        find_similar = get_find_similar()
+        if find_similar is None:
+            st.error("Dedup module not installed.")
         else:
             try:
-                ensure_claims_all_columns()
-                from app.models.schema import Claim, Customer, Product
-                s = get_session()
-                try:
-                    c = s.query(Claim).filter(Claim.id==int(claim_id_ai)).one_or_none()
-                    if not c:
-                        st.error(f"No claim with id={int(claim_id_ai)}")
-                    else:
-                        cust = s.query(Customer).filter(Customer.id==c.customer_id).one()
-                        prod = s.query(Product).filter(Product.id==c.product_id).one()
-                        summary, reply, used_model = draft_summary_and_reply(
-                            claim_text=c.description,
-                            customer_name=cust.name,
-                            product_name=prod.name,
-                            claim_status=c.status,
-                        )
-                        c.ai_summary = summary
-                        c.ai_reply   = reply
-                        c.ai_model   = used_model
-                        s.commit()
-                        st.success(f"GenAI updated claim {c.id} (model={used_model}).")
-                        with st.expander("Preview Summary"):
-                            st.write(summary or "(empty)")
-                        with st.expander("Preview Reply"):
-                            st.write(reply or "(empty)")
-                finally:
-                    s.close()
+                ensure_schema()
+                similar = find_similar(int(claim_id_dup))
+                if similar:
+                    st.dataframe(pd.DataFrame(similar, columns=["claim_id", "similarity"]),
+                                 use_container_width=True, hide_index=True)
+                else:
+                    st.info("No near-duplicates found (claims are indexed by the NLP pipeline).")
             except Exception as e:
-                st.error(f"GenAI failed: {e}")
+                st.error(f"Lookup failed: {e}")
 
 st.divider()
 
-# ---- Helpers ----
-def read_df(sql: str) -> pd.DataFrame:
-    with engine.connect() as conn:
-        return pd.read_sql_query(text(sql), conn)
-
-def table_exists(name: str) -> bool:
-    with engine.connect() as conn:
-        return bool(conn.execute(text(
-            "SELECT 1 FROM sqlite_master WHERE type='table' AND name=:n"
-        ), {"n": name}).fetchone())
-
-def get_columns(table: str):
-    with engine.connect() as conn:
-        return [r[1] for r in conn.execute(text(f"PRAGMA table_info({table})")).fetchall()]
+if refresh:
+    invalidate_query_cache()
 
 # ---- Tabs ----
-tabs = st.tabs(["Customers", "Products", "Claims", "DB Status"])
+tabs = st.tabs(["Customers", "Products", "Claims", "Jobs", "Performance", "DB Status"])
 
 with tabs[0]:
     if table_exists("customers"):
@@ -224,41 +332,182 @@ with tabs[2]:
         if "photo_blur" in cols:            select_cols.append("c.photo_blur")
         if "photo_brightness" in cols:      select_cols.append("c.photo_brightness")
         if "photo_contrast" in cols:        select_cols.append("c.photo_contrast")
+        if "duplicate_of" in cols:          select_cols.append("c.duplicate_of")
         if "ai_model" in cols:              select_cols.append("c.ai_model")
         if "ai_summary" in cols:            select_cols.append("c.ai_summary")
         if "ai_reply" in cols:              select_cols.append("c.ai_reply")
 
+        # Filters and page size are pushed into SQL; paging is keyset on c.id (no OFFSET scans)
+        f1, f2, f3, f4 = st.columns([2, 2, 2, 1])
+        with f1:
+            statuses = st.multiselect("Status", distinct_values("claims", "status"))
+        with f2:
+            labels = st.multiselect("Issue label", distinct_values("claims", "issue_label")) if "issue_label" in cols else []
+        with f3:
+            date_range = st.date_input("Created between", value=(), key="claims_dates")
+        with f4:
+            page_size = st.selectbox("Page size", [25, 50, 100, 250, 500], index=1)
+
+        params: dict = {}
+        where = []
+        if statuses:
+            where.append(_in_clause("c.status", statuses, "st", params))
+        if labels:
+            where.append(_in_clause("c.issue_label", labels, "lb", params))
+        if len(date_range) == 2:
+            where.append("c.created_at >= :d0 AND c.created_at < date(:d1, '+1 day')")
+            params["d0"], params["d1"] = str(date_range[0]), str(date_range[1])
+
+        # Reset paging whenever the filter set changes
+        filter_key = (tuple(statuses), tuple(labels), tuple(map(str, date_range)), page_size)
+        if st.session_state.get("claims_filter_key") != filter_key:
+            st.session_state["claims_filter_key"] = filter_key
+            st.session_state["claims_cursors"] = [None]
+            st.session_state["claims_next_cursor"] = None
+        cursors = st.session_state["claims_cursors"]
+
+        p1, p2, p3 = st.columns([1, 1, 6])  # filled after the query, so Prev/Next state matches this page
+
+        if cursors[-1] is not None:
+            where.append("c.id < :cursor")
+            params["cursor"] = cursors[-1]
+        params["lim"] = page_size + 1  # one extra row tells us whether a next page exists
+
         sql = f"""
         SELECT {', '.join(select_cols)}
         FROM claims c
         JOIN customers cu ON cu.id=c.customer_id
         JOIN products  p  ON p.id=c.product_id
+        {"WHERE " + " AND ".join(where) if where else ""}
         ORDER BY c.id DESC
+        LIMIT :lim
         """
-        df = read_df(sql)
-        if df.empty:
+        df = read_df(sql, params)
+        has_next = len(df) > page_size
+        df = df.iloc[:page_size]
+        st.session_state["claims_next_cursor"] = int(df["id"].iloc[-1]) if has_next else None
+        with p1:
+            st.button("◀ Prev", disabled=len(cursors) <= 1, on_click=_prev_claims_page)
+        with p2:
+            st.button("Next ▶", disabled=not has_next, on_click=_next_claims_page)
+        with p3:
+            st.caption(f"Page {len(cursors)} · {len(df)} rows")
+        if df.empty and len(cursors) == 1 and not where:
             st.warning("Claims table is empty. Click **Seed sample data**.")
         st.dataframe(df, use_container_width=True)
     else:
         st.info("Click **Create tables**, then **Seed sample data**.")
 
+def _jobs_panel() -> None:
+    try:
+        recent = jobs.list_jobs(limit=20) if table_exists("jobs") else []
+    except Exception as e:
+        st.error(f"Job status failed: {e}")
+        return
+    if not recent:
+        st.info("No jobs yet. **Run NLP**, **Run ANN Predictor** or the GenAI buttons queue one.")
+        return
+    # a job finishing means pipeline output changed: drop cached query results once
+    last_finished = max((j["id"] for j in recent if j["status"] not in jobs.ACTIVE), default=0)
+    if last_finished > st.session_state.get("jobs_last_finished", 0):
+        st.session_state["jobs_last_finished"] = last_finished
+        invalidate_query_cache()
+
+    for j in (j for j in recent if j["status"] in jobs.ACTIVE):
+        total, done = j["rows_total"] or 0, j["rows_done"] or 0
+        rate = f" · {j['rows_per_sec']:.0f} rows/s" if j["rows_per_sec"] else ""
+        stopping = " · cancelling…" if j["cancel_requested"] else ""
+        a, b = st.columns([6, 1])
+        with a:
+            st.progress(min(done / total, 1.0) if total else 0.0,
+                        text=f"#{j['id']} {j['stage']} {j['status']}: {done}/{total or '?'} rows{rate}{stopping}")
+        with b:
+            if st.button("Cancel", key=f"cancel_job_{j['id']}", disabled=bool(j["cancel_requested"])):
+                jobs.cancel(j["id"])
+    resumable = [j["id"] for j in recent if j["status"] in ("failed", "cancelled")]
+    if resumable:
+        r1, r2 = st.columns([2, 5])
+        with r1:
+            pick = st.selectbox("Resume job", resumable, key="resume_job_id")
+        with r2:
+            st.write("")
+            if st.button("Resume from checkpoint"):
+                if jobs.resume(int(pick)):
+                    jobs.ensure_worker()
+                else:
+                    st.warning("An identical job is already queued or running.")
+
+    df = pd.DataFrame(recent)[["id", "stage", "status", "rows_done", "rows_total", "rows_per_sec",
+                               "checkpoint", "params", "error", "created_at", "finished_at"]]
+    st.dataframe(df, use_container_width=True, hide_index=True)
+
 with tabs[3]:
+    st.subheader("Background jobs")
+    # poll in place every 2s without rerunning the whole page (older Streamlit: refresh manually)
+    if hasattr(st, "fragment"):
+        st.fragment(run_every=2)(_jobs_panel)()
+    else:
+        _jobs_panel()
+
+with tabs[4]:
+    st.subheader("Performance")
+    st.caption("Timers and counters from this app, the job worker and batch scripts, merged since the last reset.")
+    snap = metrics.collect()
+    perf = metrics.summary_rows(snap)
+    if not perf:
+        st.info("No measurements yet. Run a pipeline stage (or a job) and come back.")
+    else:
+        runs = [r for r in perf if r["metric"] == "stage_run" and r["rows_per_sec"]]
+        if runs:
+            st.write("**Stage throughput (rows/sec)**")
+            st.bar_chart(pd.DataFrame({"rows/sec": [r["rows_per_sec"] for r in runs]},
+                                      index=[r["labels"] for r in runs]))
+        st.write("**Latency and throughput by operation**")
+        st.dataframe(pd.DataFrame(perf), use_container_width=True, hide_index=True)
+
+        series = sorted(snap["timers"])
+        pick = st.selectbox("Latency histogram", series)
+        h = snap["timers"][pick]
+        # numbered labels keep bucket order when the chart sorts its x axis
+        edges = [f"{i:02d} ≤{b * 1000:g} ms" for i, b in enumerate(metrics.BUCKETS)] + [f"{len(metrics.BUCKETS):02d} > 300 s"]
+        st.bar_chart(pd.DataFrame({"calls": h["buckets"]}, index=pd.Index(edges, name="bucket")))
+
+    if snap["counters"]:
+        st.write("**Counters**")
+        st.dataframe(pd.DataFrame([{"counter": sid, "value": c["value"]} for sid, c in sorted(snap["counters"].items())]),
+                     use_container_width=True, hide_index=True)
+
+    d1, d2, d3 = st.columns(3)
+    with d1:
+        st.download_button("Download JSON snapshot", json.dumps(snap, indent=2), "metrics.json", "application/json")
+    with d2:
+        st.download_button("Download metrics text", metrics.to_prometheus(snap), "metrics.prom", "text/plain")
+    with d3:
+        if st.button("Reset metrics"):
+            metrics.clear_all()
+            st.rerun()
+
+with tabs[5]:
     st.subheader("Database status")
     st.code(f"DATABASE_URL = {DATABASE_URL}", language="bash")
     try:
-        with engine.connect() as conn:
-            tables = [r[0] for r in conn.execute(text(
-                "SELECT name FROM sqlite_master WHERE type='table' ORDER BY name"
-            )).fetchall()]
-            counts = {}
-            for t in tables:
-                try:
-                    counts[t] = conn.execute(text(f"SELECT COUNT(*) FROM {t}")).scalar()
-                except Exception:
-                    counts[t] = "n/a"
+        counts = table_counts()
+        tables = list(counts)
         st.write("**Tables & row counts:**")
         st.json(counts)
         if not tables:
             st.warning("No tables found. Click **Create tables** above.")
     except Exception as e:
         st.error(f"Status check failed: {e}")
+
+# ---- Startup profile ----
+if PROFILE:
+    with st.sidebar:
+        st.divider()
+        st.header("Startup profile")
+        prof = startup_profile()
+        st.dataframe(
+            pd.DataFrame({"step": list(prof), "ms": [round(v, 1) for v in prof.values()]}).sort_values("ms", ascending=False),
+            use_container_width=True, hide_index=True,
+        )
+        st.caption(f"This rerun: {(time.perf_counter() - _T0) * 1000:.1f} ms")
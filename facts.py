@@ -0,0 +1,62 @@
+# app/db/facts.py
+from __future__ import annotations
+from typing import Iterable, Optional
+from sqlalchemy import bindparam, text
+
+_FACT_COLUMNS = (
+    "claim_id, customer_id, customer_name, product_id, product_name, product_category, product_price, "
+    "status, issue_label, sentiment_score, is_photo_attached, damage_score, predicted_refund_prob, ai_model, "
+    "created_at, updated_at, refreshed_at"
+)
+_FACT_SELECT = f"""
+    INSERT OR REPLACE INTO claims_facts ({_FACT_COLUMNS})
+    SELECT c.id, c.customer_id, cu.name, c.product_id, p.name, p.category, p.price,
+           c.status, c.issue_label, c.sentiment_score, c.is_photo_attached, c.damage_score,
+           c.predicted_refund_prob, c.ai_model, c.created_at, c.updated_at, CURRENT_TIMESTAMP
+    FROM claims c
+    JOIN customers cu ON cu.id = c.customer_id
+    JOIN products  p  ON p.id  = c.product_id
+"""
+_ID_CHUNK = 500
+
+# Triggers keep fact rows current for writes that bypass the pipelines (seeding, inserts, status or
+# customer/product edits). Pipeline write-backs only touch output columns, which the triggers don't
+# watch, and call refresh_claims_facts themselves in the same transaction, one statement per chunk.
+_TRIGGERS = {
+    "trg_claims_facts_insert": f"AFTER INSERT ON claims BEGIN {_FACT_SELECT} WHERE c.id = NEW.id; END",
+    "trg_claims_facts_edit": (
+        "AFTER UPDATE OF status, customer_id, product_id, created_at ON claims "
+        f"BEGIN {_FACT_SELECT} WHERE c.id = NEW.id; END"
+    ),
+    "trg_claims_facts_delete": "AFTER DELETE ON claims BEGIN DELETE FROM claims_facts WHERE claim_id = OLD.id; END",
+    "trg_claims_facts_customer": (
+        f"AFTER UPDATE OF name ON customers BEGIN {_FACT_SELECT} WHERE c.customer_id = NEW.id; END"
+    ),
+    "trg_claims_facts_product": (
+        f"AFTER UPDATE OF name, category, price ON products BEGIN {_FACT_SELECT} WHERE c.product_id = NEW.id; END"
+    ),
+}
+
+def create_claims_facts_triggers(conn) -> None:
+    """(Re)create the SQLite triggers that maintain claims_facts outside pipeline write-backs."""
+    for name, body in _TRIGGERS.items():
+        conn.execute(text(f"DROP TRIGGER IF EXISTS {name}"))
+        conn.execute(text(f"CREATE TRIGGER {name} {body}"))
+
+def refresh_claims_facts(conn, claim_ids: Optional[Iterable[int]] = None) -> None:
+    """
+    Recompute fact rows for `claim_ids` (all claims if None) inside the caller's transaction, so a
+    pipeline chunk and its facts commit together. `conn` may be a Session or a Connection.
+    Rows for deleted claims are dropped.
+    """
+    if claim_ids is None:
+        conn.execute(text("DELETE FROM claims_facts"))
+        conn.execute(text(_FACT_SELECT))
+        return
+    ids = list(claim_ids)
+    delete = text("DELETE FROM claims_facts WHERE claim_id IN :ids").bindparams(bindparam("ids", expanding=True))
+    insert = text(_FACT_SELECT + " WHERE c.id IN :ids").bindparams(bindparam("ids", expanding=True))
+    for i in range(0, len(ids), _ID_CHUNK):
+        part = ids[i:i + _ID_CHUNK]
+        conn.execute(delete, {"ids": part})
+        conn.execute(insert, {"ids": part})
@@ -1,24 +1,44 @@
 # app/cnn/image_checks.py
+from concurrent.futures import ProcessPoolExecutor
 from io import BytesIO
-from typing import Dict, Any
+from pathlib import Path
+from typing import Dict, Any, List, Optional, Sequence, Tuple, Union
+import multiprocessing
+import multiprocessing.util
+import os
 import numpy as np
 from PIL import Image
 import cv2
+from app.utils.metrics import REGISTRY as METRICS, timer
 
-def _to_cv2(img: Image.Image) -> np.ndarray:
-    if img.mode != "RGB":
-        img = img.convert("RGB")
-    arr = np.array(img)  # RGB
-    return cv2.cvtColor(arr, cv2.COLOR_RGB2BGR)
+# Every photo is measured with its longest side at exactly this many pixels (larger ones are
+# downscaled, smaller ones upscaled): blur and edge statistics depend on resolution, so scores are
+# only comparable across cameras, uploads and backfills when taken at one canonical size.
+ANALYSIS_SIDE = 1024
 
-def analyze_image(file_bytes: bytes) -> Dict[str, Any]:
+def _canonical_size(size: Tuple[int, int], side: int) -> Tuple[int, int]:
+    scale = side / max(size)
+    return max(1, round(size[0] * scale)), max(1, round(size[1] * scale))
+
+def _decode_gray(img: Image.Image, side: int, reduced: bool = True) -> Image.Image:
     """
-    Returns: dict with blur, brightness, contrast, edge_density, damage_score [0..1], quality_ok bool.
+    Grayscale image with its longest side at exactly `side`. With `reduced`, large photos skip the
+    full-size decode: `draft` lets the JPEG decoder emit L at 1/2, 1/4 or 1/8 scale directly and
+    `reduce` does cheap integer box downscaling before the final resize.
     """
-    img = Image.open(BytesIO(file_bytes))
-    cv = _to_cv2(img)
-    gray = cv2.cvtColor(cv, cv2.COLOR_BGR2GRAY)
+    if reduced and max(img.size) > side:
+        img.draft("L", (side, side))
+    gray = img if img.mode == "L" else img.convert("L")
+    if reduced:
+        factor = max(gray.size) // side
+        if factor > 1:
+            gray = gray.reduce(factor)
+    size = _canonical_size(gray.size, side)
+    if size != gray.size:
+        gray = gray.resize(size, Image.BOX if max(gray.size) > side else Image.BILINEAR)
+    return gray
 
+def _measure(gray: np.ndarray) -> Dict[str, Any]:
     # Blur (higher = sharper). Typical good > ~100; low => blurry.
     blur = float(cv2.Laplacian(gray, cv2.CV_64F).var())
 
@@ -45,8 +65,6 @@ def analyze_image(file_bytes: bytes) -> Dict[str, Any]:
     damage_score = max(0.0, min(1.0, damage_score))
 
     return {
-        "width": int(img.width),
-        "height": int(img.height),
         "blur": blur,
         "brightness": brightness,
         "contrast": contrast,
@@ -54,3 +72,67 @@ def analyze_image(file_bytes: bytes) -> Dict[str, Any]:
         "damage_score": damage_score,
         "quality_ok": bool(quality_ok),
     }
+
+def analyze_image(file_bytes: Union[bytes, str, Path], reduced: bool = True) -> Dict[str, Any]:
+    """
+    Returns: dict with blur, brightness, contrast, edge_density, damage_score [0..1], quality_ok bool.
+    `file_bytes` may also be a path, which is decoded straight from disk.
+    The photo is measured in grayscale at ANALYSIS_SIDE (`analysis_width`/`analysis_height` report
+    the size used). `reduced` decodes large JPEGs at reduced resolution; reduced=False decodes the
+    full image first and gives the same scores within resampling noise, at several times the cost.
+    """
+    mode = "reduced" if reduced else "full"
+    with timer("image_decode", mode=mode):
+        img = Image.open(file_bytes if isinstance(file_bytes, (str, Path)) else BytesIO(file_bytes))
+        width, height = img.size
+        gray = np.asarray(_decode_gray(img, ANALYSIS_SIDE, reduced=reduced))
+    with timer("image_measure", mode=mode):
+        stats = _measure(gray)
+
+    return {
+        "width": int(width),
+        "height": int(height),
+        "analysis_width": int(gray.shape[1]),
+        "analysis_height": int(gray.shape[0]),
+        **stats,
+    }
+
+# never fork: callers (Streamlit, job workers) are multi-threaded, and a fork taken while another thread
+# holds a lock can deadlock the child. (The fork server's preload list is process-wide and already set by
+# app.nlp.text_models, so workers here import this module themselves.)
+_MP_CONTEXT = multiprocessing.get_context(
+    "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+)
+
+def _init_worker() -> None:
+    # one OpenCV thread per process; the pool provides the parallelism
+    cv2.setNumThreads(1)
+    # pool workers leave via os._exit (no atexit), so flush their timings from multiprocessing's own exit hook
+    multiprocessing.util.Finalize(None, METRICS.flush, exitpriority=10)
+
+def _analyze_safe(args) -> Dict[str, Any]:
+    file_bytes, reduced = args
+    try:
+        return analyze_image(file_bytes, reduced=reduced)
+    except Exception as e:
+        return {"error": f"{type(e).__name__}: {e}", "quality_ok": False}
+
+def analyze_images(
+    images: Sequence[bytes],
+    reduced: bool = True,
+    workers: Optional[int] = None,
+    chunksize: int = 4,
+) -> List[Dict[str, Any]]:
+    """
+    Batch analyze_image over a process pool; results keep input order.
+    A photo that fails to decode yields {"error": ..., "quality_ok": False} instead of aborting the batch.
+    """
+    workers = workers or os.cpu_count() or 1
+    jobs = [(b, reduced) for b in images]
+    with timer("image_batch", rows=len(jobs)):
+        if workers == 1 or len(jobs) <= 1:
+            return [_analyze_safe(j) for j in jobs]
+        with ProcessPoolExecutor(
+            max_workers=min(workers, len(jobs)), mp_context=_MP_CONTEXT, initializer=_init_worker,
+        ) as ex:
+            return list(ex.map(_analyze_safe, jobs, chunksize=chunksize))
@@ -0,0 +1,332 @@
+# app/db/ingest.py
+"""
+Streaming bulk ingestion of claims from JSONL or CSV (optionally .gz, or "-" for stdin).
+
+Records are read one line at a time, validated, and inserted in batches: each batch resolves
+(or creates) its customers by email and products by SKU through in-memory maps, inserts all its
+claims with one executemany and commits, so memory is bounded by the batch and the lookup maps,
+not the file. With nlp=True each batch is classified/scored before commit (and added to the
+near-duplicate index), so the NLP job later skips it; ann=True also scores refund probability.
+Key phrases use the persisted TF-IDF vocabulary; when there is none (e.g. an empty database), a
+provisional one is fitted in memory on the first batch, its rows are left NLP-stale, and at the
+end the persisted vocabulary is fitted on the whole table and their key phrases redone.
+
+Record fields: description, customer_email, product_sku (required); customer_name,
+product_name, product_category, product_price, status, created_at (optional).
+"""
+from __future__ import annotations
+import argparse
+import csv
+import gzip
+import io
+import json
+import sys
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any, Dict, Iterator, List, Optional, TextIO, Tuple
+
+from sqlalchemy import bindparam, func, insert, select, update
+
+from app.db.migrations import ensure_schema
+from app.db.session import get_engine, get_write_engine
+from app.models.schema import Claim, Customer, Product
+from app.nlp.dedup import description_hash, match as dedup_match, persist as dedup_persist
+from app.utils.logger import get_logger
+from app.utils.metrics import count, observe, timer
+
+logger = get_logger()
+
+DEFAULT_BATCH_SIZE = 5000
+_ID_CHUNK = 500
+_NLP_FIELDS = ("issue_label", "key_phrases", "sentiment_score", "nlp_hash", "nlp_version", "predicted_refund_prob")
+
+# ---- Reading ----
+def _open_text(path: str) -> TextIO:
+    if path == "-":
+        return io.TextIOWrapper(sys.stdin.buffer, encoding="utf-8")
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8", newline="")
+    return open(path, "r", encoding="utf-8", newline="")
+
+def iter_records(path: str, fmt: Optional[str] = None) -> Iterator[Tuple[int, Any]]:
+    """(line number, raw record) pairs; raw is a dict, or the unparsed line if it is not valid JSON."""
+    fmt = fmt or ("csv" if Path(path.removesuffix(".gz")).suffix.lower() == ".csv" else "jsonl")
+    with _open_text(path) as f:
+        if fmt == "csv":
+            reader = csv.DictReader(f)
+            for rec in reader:
+                # line_num is the record's last physical line (quoted fields may span lines)
+                yield reader.line_num, {k: (v if v != "" else None) for k, v in rec.items()}
+            return
+        for n, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                yield n, json.loads(line)
+            except ValueError:
+                yield n, line.rstrip("\n")
+
+# ---- Validation ----
+def _text(rec: Dict[str, Any], key: str, max_len: int, default: Optional[str] = None) -> Optional[str]:
+    v = rec.get(key)
+    if v is None:
+        return default
+    v = str(v).strip()
+    if len(v) > max_len:
+        raise ValueError(f"{key} longer than {max_len} characters")
+    return v or default
+
+def validate(rec: Any) -> Dict[str, Any]:
+    """Normalized record, or ValueError naming the first problem."""
+    if not isinstance(rec, dict):
+        raise ValueError("not a JSON object")
+    desc = rec.get("description")
+    if not isinstance(desc, str) or not desc.strip():
+        raise ValueError("description is required")
+    email = (_text(rec, "customer_email", 200) or "").lower()
+    if "@" not in email:
+        raise ValueError("customer_email is missing or invalid")
+    sku = _text(rec, "product_sku", 64)
+    if not sku:
+        raise ValueError("product_sku is required")
+    try:
+        price = float(rec.get("product_price") or 0.0)
+    except (TypeError, ValueError):
+        raise ValueError("product_price is not a number")
+    if price < 0:
+        raise ValueError("product_price is negative")
+    created = rec.get("created_at")
+    if created:
+        try:
+            created = datetime.fromisoformat(str(created).replace("Z", "+00:00"))
+        except ValueError:
+            raise ValueError("created_at is not an ISO date/time")
+        if created.tzinfo is not None:
+            created = created.astimezone(timezone.utc).replace(tzinfo=None)
+    return {
+        "description": desc.strip(),
+        "customer_email": email,
+        "customer_name": _text(rec, "customer_name", 120, default=email.split("@")[0]),
+        "product_sku": sku,
+        "product_name": _text(rec, "product_name", 200, default=sku),
+        "product_category": _text(rec, "product_category", 120),
+        "product_price": price,
+        "status": _text(rec, "status", 32, default="new"),
+        "created_at": created or datetime.utcnow(),
+    }
+
+# ---- Lookup maps ----
+class Lookups:
+    """email -> customer id and sku -> product id, loaded once and extended as batches create rows."""
+    def __init__(self) -> None:
+        with get_engine().connect() as conn:
+            self.customers: Dict[str, int] = {e.lower(): i for e, i in conn.execute(select(Customer.email, Customer.id))}
+            self.products: Dict[str, int] = {k: i for k, i in conn.execute(select(Product.sku, Product.id))}
+        self.created = {"customers": 0, "products": 0}
+
+    def _resolve(self, conn, model, key_col, known: Dict[str, int], new_rows: Dict[str, Dict[str, Any]]) -> None:
+        if not new_rows:
+            return
+        # OR IGNORE: a row created since the maps were loaded is simply looked up below
+        res = conn.execute(insert(model).prefix_with("OR IGNORE"), list(new_rows.values()))
+        self.created[model.__tablename__] += max(res.rowcount, 0)
+        keys = list(new_rows)
+        for i in range(0, len(keys), _ID_CHUNK):
+            for k, pk in conn.execute(select(key_col, model.id).where(key_col.in_(keys[i:i + _ID_CHUNK]))):
+                known[k.lower() if model is Customer else k] = pk
+
+    def resolve(self, conn, batch: List[Dict[str, Any]]) -> None:
+        """Create the batch's unknown customers/products (inside the caller's transaction) and map their ids."""
+        now = datetime.utcnow()
+        new_customers = {
+            r["customer_email"]: {"email": r["customer_email"], "name": r["customer_name"], "created_at": now}
+            for r in batch if r["customer_email"] not in self.customers
+        }
+        new_products = {
+            r["product_sku"]: {"sku": r["product_sku"], "name": r["product_name"], "category": r["product_category"],
+                               "price": r["product_price"], "created_at": now}
+            for r in batch if r["product_sku"] not in self.products
+        }
+        self._resolve(conn, Customer, Customer.email, self.customers, new_customers)
+        self._resolve(conn, Product, Product.sku, self.products, new_products)
+
+# ---- Ingestion ----
+class _Ingestor:
+    def __init__(self, batch_size: int, nlp: bool, ann: bool) -> None:
+        self.batch_size, self.nlp, self.ann = batch_size, nlp or ann, ann  # ANN features need the NLP outputs
+        self.lookups = Lookups()
+        self.vectorizer = self.model = None
+        self.provisional = False                  # vectorizer fitted on the first batch only, never persisted
+        self.ranges: List[List[int]] = []         # [first id, last id] of committed batches, merged when adjacent
+        self.inserted = 0
+
+    def _analyze(self, batch: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Per-record NLP/ANN fields, computed before the batch takes the write lock."""
+        if not self.nlp:
+            return [dict.fromkeys(_NLP_FIELDS) for _ in batch]
+        from app.nlp.run_pipeline import nlp_outputs
+        from app.nlp.text_models import NLP_VERSION, fit_tfidf, load_tfidf
+        texts = [r["description"] for r in batch]
+        if self.vectorizer is None:
+            self.vectorizer = load_tfidf()
+            if self.vectorizer is None:
+                self.vectorizer, self.provisional = fit_tfidf(texts), True
+        # provisional key phrases stay NLP-stale until finish() redoes them, so a crash leaves them to the NLP job
+        version = None if self.provisional else NLP_VERSION
+        out = [
+            {**o, "nlp_hash": description_hash(t), "nlp_version": version, "predicted_refund_prob": None}
+            for o, t in zip(nlp_outputs(texts, self.vectorizer), texts)
+        ]
+        if self.ann:
+            from app.ann.refund_predictor import predict_refund_probs, train_or_load_model
+            if self.model is None:
+                self.model = train_or_load_model([])
+            feats = [SimpleNamespace(is_photo_attached=False, damage_score=None, **o) for o in out]
+            for o, p in zip(out, predict_refund_probs(self.model, feats)):
+                o["predicted_refund_prob"] = float(p)
+        return out
+
+    def flush(self, batch: List[Dict[str, Any]]) -> None:
+        if not batch:
+            return
+        outputs = self._analyze(batch)
+        now = datetime.utcnow()
+        with timer("db_write", stage="ingest", rows=len(batch)):
+            with get_write_engine().begin() as conn:
+                self.lookups.resolve(conn, batch)
+                # explicit ids (we hold the write lock) so the batch can be indexed without RETURNING;
+                # its claims_facts rows come from the insert trigger
+                base = conn.execute(select(func.max(Claim.id))).scalar() or 0
+                rows = [
+                    {
+                        "id": base + i,
+                        "customer_id": self.lookups.customers[r["customer_email"]],
+                        "product_id": self.lookups.products[r["product_sku"]],
+                        "description": r["description"],
+                        "status": r["status"],
+                        "is_photo_attached": False,
+                        "created_at": r["created_at"],
+                        "updated_at": now,
+                        **o,
+                    }
+                    for i, (r, o) in enumerate(zip(batch, outputs), 1)
+                ]
+                conn.execute(insert(Claim), rows)
+                if self.nlp:
+                    with timer("dedup_match", rows=len(rows)):
+                        plan = dedup_match(conn, [(r["id"], r["description"]) for r in rows])
+                    dedup_persist(conn, plan)
+        if self.ranges and self.ranges[-1][1] == base:
+            self.ranges[-1][1] = base + len(batch)
+        else:
+            self.ranges.append([base + 1, base + len(batch)])
+        self.inserted += len(batch)
+
+    def finish(self) -> int:
+        """Fit the persisted vocabulary on the whole table and redo provisional key phrases; returns rows redone."""
+        if not self.provisional or not self.ranges:
+            return 0
+        from app.nlp.run_pipeline import get_vectorizer
+        from app.nlp.text_models import NLP_VERSION, extract_keywords_tfidf
+        vec = get_vectorizer(force=True)
+        stmt = update(Claim.__table__).where(Claim.id == bindparam("b_id"), Claim.nlp_version.is_(None)).values(
+            key_phrases=bindparam("b_kp"), nlp_version=NLP_VERSION,
+        )
+        redone = 0
+        with timer("ingest_keyphrases") as t:
+            for lo, hi in self.ranges:
+                last_id = lo - 1
+                while last_id < hi:
+                    with get_engine().connect() as conn:
+                        rows = conn.execute(
+                            select(Claim.id, Claim.description).where(Claim.id > last_id, Claim.id <= hi)
+                            .order_by(Claim.id).limit(self.batch_size)
+                        ).all()
+                    if not rows:
+                        break
+                    last_id = rows[-1][0]
+                    phrases = extract_keywords_tfidf([d or "" for _, d in rows], top_k=5, vectorizer=vec)
+                    with get_write_engine().begin() as conn:
+                        conn.execute(stmt, [{"b_id": cid, "b_kp": ", ".join(kp)} for (cid, _), kp in zip(rows, phrases)])
+                    redone += len(rows)
+            t.rows = redone
+        self.provisional = False
+        return redone
+
+def ingest(
+    path: str,
+    fmt: Optional[str] = None,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    nlp: bool = False,
+    ann: bool = False,
+    rejects_path: Optional[str] = None,
+    skip_lines: int = 0,
+) -> Dict[str, int]:
+    """
+    Stream `path` into the claims table, one committed transaction per `batch_size` valid records.
+    Invalid records are skipped and, with `rejects_path`, written there as JSONL
+    {"line", "error", "record"}. After a crash, rerun with `skip_lines` set to the last
+    "committed through line" logged to continue without duplicating claims.
+    Returns {"read", "inserted", "rejected", "customers_created", "products_created"}.
+    """
+    ensure_schema()
+    t_run = time.perf_counter()
+    ing = _Ingestor(batch_size, nlp, ann)
+    read = rejected = 0
+    batch: List[Dict[str, Any]] = []
+    rejects = open(rejects_path, "a", encoding="utf-8") if rejects_path else None
+    try:
+        for line_no, raw in iter_records(path, fmt):
+            if line_no <= skip_lines:
+                continue
+            read += 1
+            try:
+                batch.append(validate(raw))
+            except ValueError as e:
+                rejected += 1
+                if rejects is not None:
+                    rejects.write(json.dumps({"line": line_no, "error": str(e), "record": raw}, default=str) + "\n")
+                continue
+            if len(batch) >= batch_size:
+                ing.flush(batch)
+                batch = []
+                logger.info(f"Ingested {ing.inserted} claims (committed through line {line_no}, {rejected} rejected)")
+        ing.flush(batch)
+        rekeyed = ing.finish()
+        if rekeyed:
+            logger.info(f"Fitted the keyphrase vocabulary on the loaded table; redid key phrases of {rekeyed} claims")
+        count("ingest_records", ing.inserted, result="inserted")
+        count("ingest_records", rejected, result="rejected")
+        logger.info(f"Ingest done: read={read}, inserted={ing.inserted}, rejected={rejected}")
+        return {
+            "read": read,
+            "inserted": ing.inserted,
+            "rejected": rejected,
+            "customers_created": ing.lookups.created["customers"],
+            "products_created": ing.lookups.created["products"],
+        }
+    except Exception:
+        count("stage_errors", stage="ingest")
+        raise
+    finally:
+        if rejects is not None:
+            rejects.close()
+        observe("stage_run", time.perf_counter() - t_run, rows=ing.inserted, stage="ingest")
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Bulk-load claims from JSONL or CSV.")
+    ap.add_argument("path", help='input file (.jsonl, .csv, optionally .gz) or "-" for stdin')
+    ap.add_argument("--format", choices=["jsonl", "csv"], help="override detection by extension")
+    ap.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    ap.add_argument("--nlp", action="store_true", help="classify/score each batch before commit")
+    ap.add_argument("--ann", action="store_true", help="also score refund probability (implies --nlp)")
+    ap.add_argument("--rejects", help="append invalid records here as JSONL")
+    ap.add_argument("--skip-lines", type=int, default=0, help="resume after this input line")
+    args = ap.parse_args()
+    print(ingest(args.path, fmt=args.format, batch_size=args.batch_size, nlp=args.nlp, ann=args.ann,
+                 rejects_path=args.rejects, skip_lines=args.skip_lines))
+
+if __name__ == "__main__":
+    main()
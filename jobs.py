@@ -0,0 +1,321 @@
+# app/db/jobs.py
+"""
+SQLite-backed job queue for long pipeline runs (NLP, ANN, GenAI, all three streamed, or
+refund-model retraining).
+
+The UI only enqueues; a separate worker process (`python -m app.db.jobs`) claims jobs, runs the
+stage chunk by chunk and records checkpoint/progress/throughput after every committed chunk, so
+the UI can poll, a cancel takes effect at the next chunk boundary, and a crashed or cancelled
+job resumes from its last checkpoint instead of starting over.
+"""
+from __future__ import annotations
+import argparse
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+from sqlalchemy import func, select, update
+from sqlalchemy.exc import IntegrityError
+
+from app.db.migrations import ensure_schema
+from app.db.session import get_engine, get_write_engine
+from app.models.schema import Claim, Job
+from app.utils.logger import get_logger
+from app.utils.metrics import REGISTRY as METRICS, count, pid_alive
+
+logger = get_logger()
+jobs = Job.__table__
+
+ROOT = Path(__file__).resolve().parents[2]
+WORKER_DIR = ROOT / "app" / "data" / "jobs"
+WORKER_PID_PATH = WORKER_DIR / "worker.pid"
+
+ACTIVE = ("queued", "running")
+HEARTBEAT_INTERVAL_S = 5.0  # a running job's heartbeat thread refreshes heartbeat_at and the pid file this often
+HEARTBEAT_STALE_S = 300     # a running job silent this long whose worker process is gone is requeued
+WORKER_STALE_S = 60         # ensure_worker spawns a new worker if the pid file is older than this
+DEFAULT_POLL_S = 1.0
+
+# ---- Stages ----
+# Each runner gets the job params plus start_after/on_chunk and returns a JSON-able result.
+ChunkCallback = Callable[[int, int], bool]
+
+def _run_nlp(params: Dict[str, Any], start_after: int, on_chunk: ChunkCallback) -> Any:
+    from app.nlp.run_pipeline import run_pipeline_incremental
+    return run_pipeline_incremental(start_after=start_after, on_chunk=on_chunk, **params)
+
+def _run_ann(params: Dict[str, Any], start_after: int, on_chunk: ChunkCallback) -> Any:
+    from app.ann.refund_predictor import run_ann_predictor_on_claims
+    return {"updated": run_ann_predictor_on_claims(start_after=start_after, on_chunk=on_chunk, **params)}
+
+def _run_genai(params: Dict[str, Any], start_after: int, on_chunk: ChunkCallback) -> Any:
+    from app.genai.summarizer import run_genai_on_claims
+    return {"updated": run_genai_on_claims(start_after=start_after, on_chunk=on_chunk, **params)}
+
+def _run_stream(params: Dict[str, Any], start_after: int, on_chunk: ChunkCallback) -> Any:
+    from app.db.stream import run_stream
+    return run_stream(start_after=start_after, on_chunk=on_chunk, **params)
+
+def _run_pending(params: Dict[str, Any], start_after: int, on_chunk: ChunkCallback) -> Any:
+    from app.nlp.pipeline import process_pending_claims
+    return process_pending_claims(start_after=start_after, on_chunk=on_chunk, **{"drain": True, **params})
+
+def _run_retrain(params: Dict[str, Any], start_after: int, on_chunk: ChunkCallback) -> Any:
+    # the candidate model lives in memory: a requeued retrain restarts from the training head's watermark
+    from app.ann.refund_predictor import retrain_incremental
+    return retrain_incremental(on_chunk=on_chunk, **params)
+
+RUNNERS: Dict[str, Callable[[Dict[str, Any], int, ChunkCallback], Any]] = {
+    "nlp": _run_nlp,
+    "ann": _run_ann,
+    "genai": _run_genai,
+    "stream": _run_stream,
+    "pending": _run_pending,
+    "retrain": _run_retrain,
+}
+
+def _rows_remaining(stage: str, params: Dict[str, Any], start_after: int) -> int:
+    """Rows the stage will report through on_chunk from `start_after` on (the progress denominator)."""
+    if stage == "retrain":
+        from app.ann.refund_predictor import training_backlog
+        return training_backlog()
+    stmt = select(func.count()).select_from(Claim).where(Claim.id > start_after)
+    if stage == "pending":
+        from app.nlp.pipeline import PENDING_STATUSES
+        stmt = stmt.where(Claim.status.in_(PENDING_STATUSES))
+    if stage == "genai":
+        if params.get("only_missing", True):
+            stmt = stmt.where(Claim.ai_summary.is_(None))
+        if params.get("claim_ids") is not None:
+            stmt = stmt.where(Claim.id.in_(list(params["claim_ids"])))
+    with get_engine().connect() as conn:
+        return int(conn.execute(stmt).scalar() or 0)
+
+# ---- Queue API ----
+def _dedupe_key(stage: str, params: Dict[str, Any]) -> str:
+    digest = hashlib.sha1(json.dumps(params, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+    return f"{stage}:{digest[:16]}"
+
+def enqueue(stage: str, **params) -> int:
+    """
+    Queue a run of `stage` with keyword `params`. If an identical job (same stage and params) is
+    already queued or running, its id is returned instead of queueing a duplicate.
+    """
+    if stage not in RUNNERS:
+        raise ValueError(f"Unknown stage {stage!r}; expected one of {sorted(RUNNERS)}")
+    ensure_schema()
+    key = _dedupe_key(stage, params)
+    active = select(jobs.c.id).where(jobs.c.dedupe_key == key, jobs.c.status.in_(ACTIVE))
+    try:
+        with get_write_engine().begin() as conn:  # BEGIN IMMEDIATE: check + insert is atomic
+            existing = conn.execute(active).scalar()
+            if existing is not None:
+                return int(existing)
+            res = conn.execute(jobs.insert().values(
+                stage=stage, params=json.dumps(params, sort_keys=True, default=str),
+                dedupe_key=key, status="queued", created_at=datetime.utcnow(),
+            ))
+            return int(res.inserted_primary_key[0])
+    except IntegrityError:
+        # unique partial index caught a racing enqueue from a non-SQLite-locking backend
+        with get_engine().connect() as conn:
+            return int(conn.execute(active).scalar())
+
+def cancel(job_id: int) -> bool:
+    """Cancel a queued job now, or ask a running one to stop after its current chunk."""
+    with get_write_engine().begin() as conn:
+        n = conn.execute(
+            update(jobs).where(jobs.c.id == job_id, jobs.c.status == "queued")
+            .values(status="cancelled", finished_at=datetime.utcnow())
+        ).rowcount
+        n += conn.execute(
+            update(jobs).where(jobs.c.id == job_id, jobs.c.status == "running").values(cancel_requested=True)
+        ).rowcount
+    return n > 0
+
+def resume(job_id: int) -> bool:
+    """Requeue a failed or cancelled job; it continues from its checkpoint. False if not resumable."""
+    try:
+        with get_write_engine().begin() as conn:
+            n = conn.execute(
+                update(jobs).where(jobs.c.id == job_id, jobs.c.status.in_(("failed", "cancelled")))
+                .values(status="queued", cancel_requested=False, error=None, finished_at=None)
+            ).rowcount
+    except IntegrityError:
+        return False  # an identical job is already active
+    return n > 0
+
+def get_job(job_id: int) -> Optional[Dict[str, Any]]:
+    with get_engine().connect() as conn:
+        row = conn.execute(select(jobs).where(jobs.c.id == job_id)).mappings().fetchone()
+    return dict(row) if row else None
+
+def list_jobs(limit: int = 20) -> List[Dict[str, Any]]:
+    with get_engine().connect() as conn:
+        rows = conn.execute(select(jobs).order_by(jobs.c.id.desc()).limit(limit)).mappings().fetchall()
+    return [dict(r) for r in rows]
+
+# ---- Worker ----
+def requeue_stale(max_age_s: float = HEARTBEAT_STALE_S) -> int:
+    """
+    Put running jobs back in the queue (they resume from checkpoint) when their heartbeat is older
+    than `max_age_s` and their worker process is gone. A live worker in a long silent phase keeps
+    its job: two processes must never run the same job and overwrite each other's checkpoints.
+    """
+    cutoff = datetime.utcnow() - timedelta(seconds=max_age_s)
+    stale = (jobs.c.status == "running", jobs.c.heartbeat_at < cutoff)
+    with get_write_engine().begin() as conn:
+        orphaned = [
+            job_id for job_id, pid in conn.execute(select(jobs.c.id, jobs.c.worker_pid).where(*stale))
+            if pid is None or not pid_alive(pid)
+        ]
+        if not orphaned:
+            return 0
+        return conn.execute(
+            update(jobs).where(jobs.c.id.in_(orphaned), *stale).values(status="queued", worker_pid=None)
+        ).rowcount
+
+def claim_next() -> Optional[Dict[str, Any]]:
+    """Atomically move the oldest queued job to running and return it."""
+    now = datetime.utcnow()
+    with get_write_engine().begin() as conn:
+        row = conn.execute(
+            select(jobs).where(jobs.c.status == "queued").order_by(jobs.c.id).limit(1)
+        ).mappings().fetchone()
+        if row is None:
+            return None
+        conn.execute(update(jobs).where(jobs.c.id == row["id"]).values(
+            status="running", worker_pid=os.getpid(), heartbeat_at=now,
+            started_at=row["started_at"] or now,
+        ))
+    return dict(row)
+
+def _touch_worker_pid() -> None:
+    WORKER_DIR.mkdir(parents=True, exist_ok=True)
+    WORKER_PID_PATH.write_text(str(os.getpid()), encoding="utf-8")
+
+def _heartbeat(job_id: int, stop: threading.Event) -> None:
+    """Refresh the job's heartbeat_at and the worker pid file until `stop`, independent of chunk boundaries."""
+    while not stop.wait(HEARTBEAT_INTERVAL_S):
+        try:
+            _touch_worker_pid()
+            with get_write_engine().begin() as conn:
+                conn.execute(update(jobs).where(jobs.c.id == job_id, jobs.c.status == "running")
+                             .values(heartbeat_at=datetime.utcnow()))
+        except Exception as e:
+            logger.warning(f"Job {job_id} heartbeat failed: {e}")  # retried next interval
+
+def run_job(job: Dict[str, Any]) -> str:
+    """Run one claimed job to completion, cancellation or failure; returns the final status."""
+    job_id, stage = job["id"], job["stage"]
+    params = json.loads(job["params"] or "{}")
+    start_after = int(job["checkpoint"] or 0)
+    done = int(job["rows_done"] or 0)
+    done_at_start, t0 = done, time.perf_counter()
+
+    # chunk callbacks alone leave gaps (TF-IDF refit, rate-limited GenAI chunks, large partial_fit
+    # chunks) long enough for ensure_worker to think this worker is gone
+    stop = threading.Event()
+    beat = threading.Thread(target=_heartbeat, args=(job_id, stop), name=f"job-{job_id}-heartbeat", daemon=True)
+    beat.start()
+    try:
+        total = done + _rows_remaining(stage, params, start_after)
+        with get_write_engine().begin() as conn:
+            conn.execute(update(jobs).where(jobs.c.id == job_id).values(rows_total=total))
+        logger.info(f"Job {job_id} ({stage}) started after id={start_after}: {done}/{total} rows done")
+
+        cancelled = False
+
+        def on_chunk(last_id: int, rows: int) -> bool:
+            nonlocal done, cancelled
+            done += rows
+            elapsed = time.perf_counter() - t0
+            with get_write_engine().begin() as conn:
+                conn.execute(update(jobs).where(jobs.c.id == job_id).values(
+                    checkpoint=last_id, rows_done=done, heartbeat_at=datetime.utcnow(),
+                    rows_per_sec=(done - done_at_start) / elapsed if elapsed > 0 else None,
+                ))
+                cancelled = bool(conn.execute(select(jobs.c.cancel_requested).where(jobs.c.id == job_id)).scalar())
+            _touch_worker_pid()
+            return not cancelled
+
+        try:
+            result = RUNNERS[stage](params, start_after, on_chunk)
+            status, error = ("cancelled" if cancelled else "done"), None
+        except Exception as e:
+            logger.exception(f"Job {job_id} ({stage}) failed")
+            result, status, error = None, "failed", f"{type(e).__name__}: {e}"
+
+        with get_write_engine().begin() as conn:
+            conn.execute(update(jobs).where(jobs.c.id == job_id).values(
+                status=status, error=error, finished_at=datetime.utcnow(),
+                result=json.dumps(result, default=str) if result is not None else None,
+            ))
+        count("jobs_finished", stage=stage, status=status)
+        logger.info(f"Job {job_id} ({stage}) {status}: {done}/{total} rows")
+        return status
+    finally:
+        stop.set()
+        beat.join()
+
+def work(poll_s: float = DEFAULT_POLL_S, once: bool = False, idle_exit_s: Optional[float] = None) -> int:
+    """
+    Worker loop: claim and run jobs one at a time. `once=True` drains the queue and returns;
+    `idle_exit_s` exits after that long without work. Returns the number of jobs run.
+    """
+    ensure_schema()
+    ran, idle_since = 0, time.monotonic()
+    while True:
+        _touch_worker_pid()
+        requeue_stale()
+        job = claim_next()
+        if job is None:
+            if once or (idle_exit_s is not None and time.monotonic() - idle_since > idle_exit_s):
+                return ran
+            time.sleep(poll_s)
+            continue
+        run_job(job)
+        METRICS.flush()  # the worker may idle next; publish this job's timings now
+        ran += 1
+        idle_since = time.monotonic()
+
+def ensure_worker(idle_exit_s: float = 300) -> bool:
+    """
+    Start a background worker unless one has checked in recently. Two workers are harmless
+    (claiming is atomic), so a race here only costs an extra process. Returns True if one was started.
+    """
+    try:
+        if time.time() - WORKER_PID_PATH.stat().st_mtime < WORKER_STALE_S:
+            return False
+    except FileNotFoundError:
+        pass
+    WORKER_DIR.mkdir(parents=True, exist_ok=True)
+    env = {**os.environ, "PYTHONPATH": os.pathsep.join(filter(None, [str(ROOT), os.environ.get("PYTHONPATH")]))}
+    log = open(WORKER_DIR / "worker.log", "a", encoding="utf-8")
+    subprocess.Popen(
+        [sys.executable, "-m", "app.db.jobs", "--idle-exit", str(idle_exit_s)],
+        cwd=str(ROOT), env=env, stdout=log, stderr=subprocess.STDOUT, stdin=subprocess.DEVNULL,
+        start_new_session=True,
+    )
+    log.close()
+    _touch_worker_pid()  # hold off other spawners until the new worker checks in
+    return True
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Run queued pipeline jobs.")
+    ap.add_argument("--once", action="store_true", help="drain the queue and exit")
+    ap.add_argument("--poll", type=float, default=DEFAULT_POLL_S, help="seconds between queue polls")
+    ap.add_argument("--idle-exit", type=float, default=None, help="exit after this many idle seconds")
+    args = ap.parse_args()
+    n = work(poll_s=args.poll, once=args.once, idle_exit_s=args.idle_exit)
+    logger.info(f"Worker exiting after {n} job(s)")
+
+if __name__ == "__main__":
+    main()
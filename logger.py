@@ -1,8 +1,19 @@
 from loguru import logger
 import sys
+import threading
+
+_configured = False
+_lock = threading.Lock()
 
 def get_logger():
     # Basic console logger; can expand later (rotate, serialize, etc.)
-    logger.remove()
-    logger.add(sys.stdout, level="INFO", enqueue=True, backtrace=False, diagnose=False)
+    # Configured once per process: modules call this at import time, and re-adding the sink on
+    # every call would drop handlers other code installed and, with enqueue=True, restart the queue.
+    global _configured
+    if not _configured:
+        with _lock:
+            if not _configured:
+                logger.remove()
+                logger.add(sys.stdout, level="INFO", enqueue=True, backtrace=False, diagnose=False)
+                _configured = True
     return logger
@@ -0,0 +1,404 @@
+# app/utils/metrics.py
+"""
+Lightweight in-process metrics: timers (latency histograms + rows/sec) and counters.
+
+    with timer("db_write", stage="nlp") as t:
+        ...
+        t.rows = len(params)
+    count("llm_requests", outcome="ok")
+
+Each process keeps its own registry and periodically dumps it to app/data/metrics/, so the
+Streamlit app, the job worker and batch scripts can be read back as one merged snapshot
+(JSON or Prometheus text; `python -m app.utils.metrics --serve 9108` exposes the latter).
+Files of processes that have exited are folded into one archive file by `collect`, so the
+directory holds one file per live process plus the archive.
+"""
+from __future__ import annotations
+import argparse
+import atexit
+import bisect
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+# CLAIMS_METRICS_DIR redirects a whole process tree (pool workers inherit it), e.g. for benchmarks
+METRICS_DIR = Path(os.getenv("CLAIMS_METRICS_DIR") or Path(__file__).resolve().parents[2] / "app" / "data" / "metrics")
+RESET_MARKER = METRICS_DIR / ".reset"   # touched by clear_all; live processes zero themselves when they see it
+FLUSH_INTERVAL_S = 5.0
+ARCHIVE_NAME = "_archive.json"          # merged totals of exited processes
+COMPACT_LOCK_STALE_S = 60.0             # a compaction lock older than this was left by a crashed process
+# latency bucket upper bounds in seconds (Prometheus-style, +Inf implied)
+BUCKETS: Tuple[float, ...] = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                              1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+Key = Tuple[str, Tuple[Tuple[str, str], ...]]
+
+def _key(name: str, labels: Dict[str, Any]) -> Key:
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+def _series_id(key: Key) -> str:
+    name, labels = key
+    return name + ("{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}" if labels else "")
+
+class _Timer:
+    __slots__ = ("rows",)
+
+    def __init__(self):
+        self.rows: Optional[int] = None
+
+def _reset_mtime() -> float:
+    try:
+        return RESET_MARKER.stat().st_mtime
+    except OSError:
+        return 0.0
+
+class Registry:
+    """Thread-safe timers and counters for one process. `persist=False` keeps it in memory only."""
+    def __init__(self, persist: bool = True):
+        self.persist = persist
+        self._init_state()
+
+    def _init_state(self) -> None:
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._timers: Dict[Key, Dict[str, Any]] = {}
+        self._counters: Dict[Key, float] = {}
+        self._last_flush = 0.0
+        self._reset_seen = _reset_mtime()
+        self.path = METRICS_DIR / f"{os.getpid()}-{int(time.time() * 1000)}.json"
+
+    def observe(self, name: str, seconds: float, rows: Optional[int] = None, **labels) -> None:
+        key = _key(name, labels)
+        with self._lock:
+            h = self._timers.get(key)
+            if h is None:
+                h = self._timers[key] = {"count": 0, "sum": 0.0, "min": None, "max": None,
+                                         "rows": 0, "buckets": [0] * (len(BUCKETS) + 1)}
+            h["count"] += 1
+            h["sum"] += seconds
+            h["min"] = seconds if h["min"] is None else min(h["min"], seconds)
+            h["max"] = seconds if h["max"] is None else max(h["max"], seconds)
+            h["buckets"][bisect.bisect_left(BUCKETS, seconds)] += 1
+            if rows:
+                h["rows"] += int(rows)
+        self.maybe_flush()
+
+    def count(self, name: str, value: float = 1, **labels) -> None:
+        key = _key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+        self.maybe_flush()
+
+    @contextmanager
+    def timer(self, name: str, rows: Optional[int] = None, **labels) -> Iterator[_Timer]:
+        """Time the block; set `.rows` on the yielded object to record throughput."""
+        t = _Timer()
+        t.rows = rows
+        t0 = time.perf_counter()
+        try:
+            yield t
+        finally:
+            self.observe(name, time.perf_counter() - t0, rows=t.rows, **labels)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "timers": {_series_id(k): {"name": k[0], "labels": dict(k[1]), **{**h, "buckets": list(h["buckets"])}}
+                           for k, h in self._timers.items()},
+                "counters": {_series_id(k): {"name": k[0], "labels": dict(k[1]), "value": v}
+                             for k, v in self._counters.items()},
+            }
+
+    def reset(self) -> None:
+        with self._lock:
+            self._timers.clear()
+            self._counters.clear()
+
+    def flush(self, blocking: bool = True) -> None:
+        """Write this process's snapshot (atomically) for cross-process readers."""
+        if not self._flush_lock.acquire(blocking):
+            return  # another thread is flushing
+        try:
+            marker = _reset_mtime()
+            if marker > self._reset_seen:
+                self._reset_seen = marker
+                self.reset()
+            snap = {"pid": os.getpid(), "written_at": time.time(), **self.snapshot()}
+            if snap["timers"] or snap["counters"]:
+                METRICS_DIR.mkdir(parents=True, exist_ok=True)
+                tmp = self.path.with_suffix(".tmp")
+                tmp.write_text(json.dumps(snap), encoding="utf-8")
+                os.replace(tmp, self.path)
+        except OSError:
+            pass  # metrics must never break the pipeline
+        finally:
+            self._last_flush = time.monotonic()
+            self._flush_lock.release()
+
+    def maybe_flush(self) -> None:
+        if self.persist and time.monotonic() - self._last_flush >= FLUSH_INTERVAL_S:
+            self.flush(blocking=False)
+
+REGISTRY = Registry()
+atexit.register(REGISTRY.flush)
+if hasattr(os, "register_at_fork"):
+    # forked pool workers start empty with their own file instead of re-reporting the parent's numbers
+    os.register_at_fork(after_in_child=REGISTRY._init_state)
+
+# module-level shortcuts on the process registry
+observe = REGISTRY.observe
+count = REGISTRY.count
+timer = REGISTRY.timer
+
+def pid_alive(pid: int) -> bool:
+    """True if a process with this pid exists on this host."""
+    if pid <= 0:
+        return False
+    if os.name == "nt":
+        import ctypes  # os.kill(pid, 0) would send CTRL_C_EVENT on Windows
+        handle = ctypes.windll.kernel32.OpenProcess(0x1000, False, pid)  # PROCESS_QUERY_LIMITED_INFORMATION
+        if not handle:
+            return False
+        ctypes.windll.kernel32.CloseHandle(handle)
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True  # exists, owned by someone else
+    except OSError:
+        return False
+    return True
+
+# ---- Reading back ----
+def _pick(fn, a, b):
+    return b if a is None else a if b is None else fn(a, b)
+
+def merge(snapshots: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Sum timers/counters series-wise across process snapshots."""
+    timers: Dict[str, Dict[str, Any]] = {}
+    counters: Dict[str, Dict[str, Any]] = {}
+    for snap in snapshots:
+        for sid, h in snap.get("timers", {}).items():
+            cur = timers.get(sid)
+            if cur is None:
+                timers[sid] = {**h, "buckets": list(h["buckets"])}
+                continue
+            cur["count"] += h["count"]
+            cur["sum"] += h["sum"]
+            cur["rows"] += h["rows"]
+            cur["min"] = _pick(min, cur["min"], h["min"])
+            cur["max"] = _pick(max, cur["max"], h["max"])
+            cur["buckets"] = [a + b for a, b in zip(cur["buckets"], h["buckets"])]
+        for sid, c in snap.get("counters", {}).items():
+            if sid in counters:
+                counters[sid]["value"] += c["value"]
+            else:
+                counters[sid] = dict(c)
+    return {"timers": timers, "counters": counters}
+
+def _read(p: Path) -> Optional[Dict[str, Any]]:
+    try:
+        return json.loads(p.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None  # being replaced, truncated or already compacted; next read picks it up
+
+def _file_pid(p: Path) -> Optional[int]:
+    head = p.name.split("-", 1)[0]
+    return int(head) if head.isdigit() else None
+
+def _compact() -> None:
+    """
+    Fold the files of exited processes into the archive and delete them. One compactor at a time
+    (exclusive lock file); the archive lists the files it last absorbed, so a crash between
+    writing it and deleting them can't count them twice.
+    """
+    lock = METRICS_DIR / ".compact.lock"
+    try:
+        fd = os.open(lock, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        try:
+            if time.time() - lock.stat().st_mtime > COMPACT_LOCK_STALE_S:
+                lock.unlink()
+        except OSError:
+            pass
+        return
+    except OSError:
+        return
+    try:
+        archive_path = METRICS_DIR / ARCHIVE_NAME
+        archive = _read(archive_path) or {}
+        merged_before = set(archive.get("merged", []))
+        dead = [p for p in METRICS_DIR.glob("*.json")
+                if _file_pid(p) is not None and p != REGISTRY.path and not pid_alive(_file_pid(p))]
+        fresh = [p for p in dead if p.name not in merged_before]
+        if fresh:
+            snaps = [snap for snap in map(_read, fresh) if snap is not None]
+            new = {**merge([archive, *snaps]), "merged": [p.name for p in fresh], "written_at": time.time()}
+            tmp = archive_path.with_suffix(".tmp")
+            tmp.write_text(json.dumps(new), encoding="utf-8")
+            os.replace(tmp, archive_path)
+        for p in dead:
+            try:
+                p.unlink()
+            except OSError:
+                pass
+    except OSError:
+        pass  # metrics must never break the caller
+    finally:
+        os.close(fd)
+        try:
+            lock.unlink()
+        except OSError:
+            pass
+
+def collect(include_self: bool = True) -> Dict[str, Any]:
+    """
+    Merged snapshot of every process that has flushed to METRICS_DIR (this one flushed first),
+    after folding the files of exited processes into the archive.
+    """
+    if include_self:
+        REGISTRY.flush()
+    if METRICS_DIR.exists():
+        _compact()
+    files = sorted(METRICS_DIR.glob("*.json"))
+    archive = _read(METRICS_DIR / ARCHIVE_NAME) or {}
+    absorbed = set(archive.get("merged", [])) | {ARCHIVE_NAME}
+    snaps = [archive] + [snap for snap in (_read(p) for p in files if p.name not in absorbed) if snap is not None]
+    return merge(snaps)
+
+def clear_all() -> None:
+    """Drop recorded metrics for every process (the live registry included)."""
+    METRICS_DIR.mkdir(parents=True, exist_ok=True)
+    RESET_MARKER.touch()
+    REGISTRY._reset_seen = _reset_mtime()
+    REGISTRY.reset()
+    for p in METRICS_DIR.glob("*.json"):
+        try:
+            p.unlink()
+        except OSError:
+            pass
+
+def quantile(h: Dict[str, Any], q: float) -> Optional[float]:
+    """Estimate a latency quantile from histogram buckets (linear within the bucket)."""
+    n = h["count"]
+    if not n:
+        return None
+    target, seen = q * n, 0
+    for i, c in enumerate(h["buckets"]):
+        if c and seen + c >= target:
+            lo = BUCKETS[i - 1] if i > 0 else 0.0
+            hi = BUCKETS[i] if i < len(BUCKETS) else h["max"]
+            est = lo + (hi - lo) * (target - seen) / c
+            return min(max(est, h["min"]), h["max"])
+        seen += c
+    return h["max"]
+
+def summary_rows(snap: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """One flat row per timer series: latency stats in ms and rows/sec (time spent inside the timer)."""
+    out = []
+    for sid, h in sorted(snap["timers"].items()):
+        out.append({
+            "metric": h["name"],
+            "labels": ", ".join(f"{k}={v}" for k, v in h["labels"].items()),
+            "count": h["count"],
+            "total_s": round(h["sum"], 3),
+            "mean_ms": round(1000 * h["sum"] / h["count"], 2) if h["count"] else None,
+            "p50_ms": _ms(quantile(h, 0.50)),
+            "p95_ms": _ms(quantile(h, 0.95)),
+            "p99_ms": _ms(quantile(h, 0.99)),
+            "max_ms": _ms(h["max"]),
+            "rows": h["rows"],
+            "rows_per_sec": round(h["rows"] / h["sum"], 1) if h["rows"] and h["sum"] > 0 else None,
+        })
+    return out
+
+def _ms(v: Optional[float]) -> Optional[float]:
+    return None if v is None else round(v * 1000, 2)
+
+def to_prometheus(snap: Dict[str, Any], prefix: str = "claims_hub_") -> str:
+    """Prometheus text exposition format."""
+    lines: List[str] = []
+    seen_types = set()
+
+    def labels(d: Dict[str, str], extra: Optional[Dict[str, str]] = None) -> str:
+        d = {**d, **(extra or {})}
+        return "{" + ",".join(f'{k}="{v}"' for k, v in d.items()) + "}" if d else ""
+
+    for h in sorted(snap["timers"].values(), key=lambda h: (h["name"], sorted(h["labels"].items()))):
+        base = f"{prefix}{h['name']}_seconds"
+        if base not in seen_types:
+            lines.append(f"# TYPE {base} histogram")
+            seen_types.add(base)
+        cum = 0
+        for le, c in zip(list(BUCKETS) + ["+Inf"], h["buckets"]):
+            cum += c
+            lines.append(f"{base}_bucket{labels(h['labels'], {'le': str(le)})} {cum}")
+        lines.append(f"{base}_sum{labels(h['labels'])} {h['sum']}")
+        lines.append(f"{base}_count{labels(h['labels'])} {h['count']}")
+        if h["rows"]:
+            rows = f"{prefix}{h['name']}_rows_total"
+            if rows not in seen_types:
+                lines.append(f"# TYPE {rows} counter")
+                seen_types.add(rows)
+            lines.append(f"{rows}{labels(h['labels'])} {h['rows']}")
+    for c in sorted(snap["counters"].values(), key=lambda c: (c["name"], sorted(c["labels"].items()))):
+        name = f"{prefix}{c['name']}_total"
+        if name not in seen_types:
+            lines.append(f"# TYPE {name} counter")
+            seen_types.add(name)
+        lines.append(f"{name}{labels(c['labels'])} {c['value']}")
+    return "\n".join(lines) + "\n"
+
+# ---- Scrape endpoint / CLI ----
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        snap = collect()
+        if self.path.startswith("/metrics.json"):
+            body, ctype = json.dumps(snap).encode(), "application/json"
+        elif self.path.startswith("/metrics"):
+            body, ctype = to_prometheus(snap).encode(), "text/plain; version=0.0.4"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", ctype)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+def serve(port: int = 9108, host: str = "127.0.0.1") -> None:
+    """Serve merged metrics at /metrics (Prometheus text) and /metrics.json until interrupted."""
+    ThreadingHTTPServer((host, port), _MetricsHandler).serve_forever()
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Print or serve merged pipeline metrics.")
+    ap.add_argument("--format", choices=["prom", "json", "table"], default="table")
+    ap.add_argument("--serve", type=int, metavar="PORT", help="serve /metrics and /metrics.json on PORT")
+    args = ap.parse_args()
+    if args.serve:
+        serve(args.serve)
+        return
+    snap = collect(include_self=False)
+    if args.format == "prom":
+        print(to_prometheus(snap), end="")
+    elif args.format == "json":
+        print(json.dumps(snap, indent=2))
+    else:
+        for r in summary_rows(snap):
+            print(f"{r['metric']:<22} {r['labels']:<32} n={r['count']:<7} p50={r['p50_ms']}ms "
+                  f"p95={r['p95_ms']}ms rows/s={r['rows_per_sec']}")
+        for sid, c in sorted(snap["counters"].items()):
+            print(f"{sid:<55} {c['value']}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+# app/db/migrations.py
+from __future__ import annotations
+import threading
+from typing import Callable, List, Tuple
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+from app.db.base import Base
+from app.db.facts import create_claims_facts_triggers, refresh_claims_facts
+from app.db.session import get_engine, get_write_engine
+from app.models.schema import REFUND_OUTCOMES, Claim, ClaimFact, ClaimLshBucket, ClaimMinHash, Job, PhotoAnalysis
+
+# ---- Steps ----
+# Each step runs in its own transaction together with its schema_migrations row. Steps are
+# idempotent so databases upgraded by the old PRAGMA-probing helpers converge to the same state.
+def _add_columns(conn: Connection, table: str, ddl: List[Tuple[str, str]]) -> None:
+    cols = {r[1] for r in conn.execute(text(f"PRAGMA table_info({table})")).fetchall()}
+    for col, decl in ddl:
+        if col not in cols:
+            conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {col} {decl}"))
+
+def _create_indexes(conn: Connection, table) -> None:
+    # only indexes whose columns exist at this step; later steps add the rest with their columns
+    cols = {r[1] for r in conn.execute(text(f"PRAGMA table_info({table.name})")).fetchall()}
+    for idx in table.indexes:
+        if all(c.name in cols for c in idx.columns):
+            idx.create(conn, checkfirst=True)
+
+def _m001_base_tables(conn: Connection) -> None:
+    Base.metadata.create_all(conn, checkfirst=True)
+
+def _m002_claims_output_columns(conn: Connection) -> None:
+    _add_columns(conn, "claims", [
+        ("sentiment_score", "REAL"),
+        ("predicted_refund_prob", "REAL"),
+        ("is_photo_attached", "INTEGER DEFAULT 0"),
+        ("issue_label", "TEXT"),
+        ("key_phrases", "TEXT"),
+        ("photo_path", "TEXT"),
+        ("photo_blur", "REAL"),
+        ("photo_brightness", "REAL"),
+        ("photo_contrast", "REAL"),
+        ("damage_score", "REAL"),
+        ("ai_summary", "TEXT"),
+        ("ai_reply", "TEXT"),
+        ("ai_model", "TEXT"),
+    ])
+
+def _m003_nlp_stamp_columns(conn: Connection) -> None:
+    _add_columns(conn, "claims", [("nlp_hash", "TEXT"), ("nlp_version", "TEXT")])
+
+def _m004_indexes_and_claims_facts(conn: Connection) -> None:
+    ClaimFact.__table__.create(conn, checkfirst=True)
+    _create_indexes(conn, Claim.__table__)
+    _create_indexes(conn, ClaimFact.__table__)
+    refresh_claims_facts(conn)
+
+def _m005_jobs(conn: Connection) -> None:
+    Job.__table__.create(conn, checkfirst=True)
+    _create_indexes(conn, Job.__table__)
+
+def _m006_near_duplicates(conn: Connection) -> None:
+    _add_columns(conn, "claims", [("duplicate_of", "INTEGER"), ("duplicate_similarity", "REAL")])
+    _create_indexes(conn, Claim.__table__)
+    for model in (ClaimMinHash, ClaimLshBucket):
+        model.__table__.create(conn, checkfirst=True)
+        _create_indexes(conn, model.__table__)
+
+def _m007_photo_store(conn: Connection) -> None:
+    _add_columns(conn, "claims", [("photo_sha256", "VARCHAR(64)")])
+    PhotoAnalysis.__table__.create(conn, checkfirst=True)
+    _create_indexes(conn, PhotoAnalysis.__table__)
+
+def _m008_claims_facts_triggers(conn: Connection) -> None:
+    create_claims_facts_triggers(conn)
+    refresh_claims_facts(conn)  # rows seeded or edited before the triggers existed
+
+# refund_outcome/outcome_at follow the status: set on reaching a final status, cleared on reopening.
+# outcome_at is written in SQLAlchemy's DateTime format (microseconds) so keyset comparisons against
+# bound datetimes stay exact.
+_FINAL = ", ".join(f"'{st}'" for st in REFUND_OUTCOMES)
+
+def _outcome_assignments(status: str) -> str:
+    cases = " ".join(f"WHEN '{st}' THEN {v}" for st, v in REFUND_OUTCOMES.items())
+    return (
+        f"refund_outcome = CASE lower({status}) {cases} END, "
+        f"outcome_at = CASE WHEN lower({status}) IN ({_FINAL}) "
+        "THEN strftime('%Y-%m-%d %H:%M:%f', 'now') || '000' END"
+    )
+
+_OUTCOME_TRIGGERS = {
+    "trg_claims_outcome_insert": (
+        f"AFTER INSERT ON claims WHEN lower(NEW.status) IN ({_FINAL}) "
+        f"BEGIN UPDATE claims SET {_outcome_assignments('NEW.status')} WHERE id = NEW.id; END"
+    ),
+    "trg_claims_outcome_status": (
+        "AFTER UPDATE OF status ON claims WHEN NEW.status IS NOT OLD.status "
+        f"AND (lower(NEW.status) IN ({_FINAL}) OR lower(OLD.status) IN ({_FINAL})) "
+        f"BEGIN UPDATE claims SET {_outcome_assignments('NEW.status')} WHERE id = NEW.id; END"
+    ),
+}
+
+def _m009_refund_outcomes(conn: Connection) -> None:
+    _add_columns(conn, "claims", [("refund_outcome", "REAL"), ("outcome_at", "DATETIME")])
+    _create_indexes(conn, Claim.__table__)
+    for name, body in _OUTCOME_TRIGGERS.items():
+        conn.execute(text(f"DROP TRIGGER IF EXISTS {name}"))
+        conn.execute(text(f"CREATE TRIGGER {name} {body}"))
+    # claims closed before the triggers existed are labeled as of now
+    conn.execute(text(
+        f"UPDATE claims SET {_outcome_assignments('status')} "
+        f"WHERE lower(status) IN ({_FINAL}) AND refund_outcome IS NULL"
+    ))
+
+def _m010_photo_analysis_side(conn: Connection) -> None:
+    # rows without it predate canonical-size measurement and are re-analyzed on next upload
+    _add_columns(conn, "photo_analyses", [("analysis_side", "INTEGER")])
+
+MIGRATIONS: List[Tuple[int, str, Callable[[Connection], None]]] = [
+    (1, "base_tables", _m001_base_tables),
+    (2, "claims_output_columns", _m002_claims_output_columns),
+    (3, "nlp_stamp_columns", _m003_nlp_stamp_columns),
+    (4, "indexes_and_claims_facts", _m004_indexes_and_claims_facts),
+    (5, "jobs", _m005_jobs),
+    (6, "near_duplicates", _m006_near_duplicates),
+    (7, "photo_store", _m007_photo_store),
+    (8, "claims_facts_triggers", _m008_claims_facts_triggers),
+    (9, "refund_outcomes", _m009_refund_outcomes),
+    (10, "photo_analysis_side", _m010_photo_analysis_side),
+]
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+# ---- Runner ----
+def _ensure_version_table(conn: Connection) -> None:
+    conn.execute(text(
+        "CREATE TABLE IF NOT EXISTS schema_migrations ("
+        " version INTEGER PRIMARY KEY, name TEXT NOT NULL,"
+        " applied_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP)"
+    ))
+
+def current_version() -> int:
+    with get_engine().connect() as conn:
+        try:
+            return int(conn.execute(text("SELECT COALESCE(MAX(version), 0) FROM schema_migrations")).scalar())
+        except Exception:
+            return 0  # no version table yet
+
+def migrate() -> List[int]:
+    """Apply every step newer than the recorded version, in order. Returns the versions applied."""
+    eng = get_write_engine()
+    with eng.begin() as conn:
+        _ensure_version_table(conn)
+    applied: List[int] = []
+    for version, name, step in MIGRATIONS:
+        with eng.begin() as conn:
+            done = conn.execute(text("SELECT 1 FROM schema_migrations WHERE version=:v"), {"v": version}).fetchone()
+            if done:
+                continue
+            step(conn)
+            conn.execute(
+                text("INSERT OR IGNORE INTO schema_migrations(version, name) VALUES (:v, :n)"),
+                {"v": version, "n": name},
+            )
+        applied.append(version)
+    return applied
+
+_checked = False
+_lock = threading.Lock()
+
+def ensure_schema() -> None:
+    """
+    Bring the DB to LATEST_VERSION. After the first successful call in a process this is a
+    no-op, so pipelines and UI actions can call it before every write for free.
+    """
+    global _checked
+    if _checked:
+        return
+    with _lock:
+        if _checked:
+            return
+        if current_version() < LATEST_VERSION:
+            migrate()
+        _checked = True
+
+def reset_schema_check() -> None:
+    """Forget the cached check (e.g. after tables were dropped/recreated)."""
+    global _checked
+    _checked = False
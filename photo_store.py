@@ -0,0 +1,160 @@
+# app/cnn/photo_store.py
+"""
+Content-addressed photo uploads with cached image checks.
+
+Uploads are stored once under uploads/objects/<aa>/<sha256> (atomic rename, so concurrent
+uploads of the same photo are harmless) with a small JPEG thumbnail under uploads/thumbs/ for
+the UI. Image-check results live in photo_analyses keyed by the same hash: an exact re-upload
+is a lookup, and a photo whose perceptual hash (dHash) is within PHASH_MAX_DISTANCE bits of an
+analyzed one reuses that analysis without running OpenCV. Cached rows are stamped with the
+ANALYSIS_SIDE they were measured at and only reused at the current one, so upload-time scores stay
+comparable with image_checks.analyze_images backfills.
+"""
+from __future__ import annotations
+import hashlib
+import os
+import tempfile
+from pathlib import Path
+from typing import Any, BinaryIO, Dict, Optional, Tuple, Union
+
+import numpy as np
+from PIL import Image
+from sqlalchemy import insert, or_, select
+
+from app.cnn.image_checks import ANALYSIS_SIDE, analyze_image
+from app.db.session import get_engine, get_write_engine
+from app.models.schema import PhotoAnalysis
+from app.utils.metrics import count, timer
+
+ROOT = Path(__file__).resolve().parents[2]
+UPLOAD_DIR = ROOT / "app" / "data" / "uploads"
+CHUNK = 1 << 20
+THUMB_SIDE = 256
+PHASH_MAX_DISTANCE = 3   # < 4 parts, so a match always shares at least one exact 16-bit part
+_MASK = (1 << 64) - 1
+_STATS = ("width", "height", "blur", "brightness", "contrast", "edge_density", "damage_score", "quality_ok")
+photos = PhotoAnalysis.__table__
+
+Source = Union[bytes, bytearray, memoryview, BinaryIO]
+
+# ---- Content-addressed store ----
+def object_path(sha: str, root: Path = UPLOAD_DIR) -> Path:
+    return root / "objects" / sha[:2] / sha
+
+def thumb_path(sha: str, root: Path = UPLOAD_DIR) -> Path:
+    return root / "thumbs" / sha[:2] / f"{sha}.jpg"
+
+def _publish(tmp: str, dest: Path) -> bool:
+    """Move a finished temp file into place unless the object already exists; True if it was new."""
+    if dest.exists():
+        os.unlink(tmp)
+        return False
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    os.replace(tmp, dest)
+    return True
+
+def store_upload(src: Source, root: Path = UPLOAD_DIR) -> Tuple[str, Path, bool]:
+    """
+    Store upload bytes (a buffer, or anything with getbuffer()/read()) and return
+    (sha256, path, newly_written). Buffers are hashed in place and written only if new;
+    streams are hashed while being copied to disk in CHUNK-sized pieces.
+    """
+    tmp_dir = root / "tmp"
+    tmp_dir.mkdir(parents=True, exist_ok=True)
+    if hasattr(src, "getbuffer"):
+        src = src.getbuffer()
+    if isinstance(src, (bytes, bytearray, memoryview)):
+        sha = hashlib.sha256(src).hexdigest()
+        dest = object_path(sha, root)
+        if dest.exists():
+            return sha, dest, False
+        with tempfile.NamedTemporaryFile(dir=tmp_dir, delete=False) as out:
+            out.write(src)
+        return sha, dest, _publish(out.name, dest)
+
+    h = hashlib.sha256()
+    with tempfile.NamedTemporaryFile(dir=tmp_dir, delete=False) as out:
+        while True:
+            chunk = src.read(CHUNK)
+            if not chunk:
+                break
+            h.update(chunk)
+            out.write(chunk)
+    sha = h.hexdigest()
+    dest = object_path(sha, root)
+    return sha, dest, _publish(out.name, dest)
+
+# ---- Perceptual hash + thumbnail ----
+def dhash(img: Image.Image) -> int:
+    """64-bit difference hash (signed, to fit SQLite INTEGER): row-wise gradient signs of a 9x8 gray image."""
+    a = np.asarray(img.convert("L").resize((9, 8), Image.BOX), dtype=np.int16)
+    v = int.from_bytes(np.packbits(a[:, 1:] > a[:, :-1]).tobytes(), "big")
+    return v - (1 << 64) if v >= 1 << 63 else v
+
+def hamming(a: int, b: int) -> int:
+    return bin((a ^ b) & _MASK).count("1")
+
+def _parts(phash: int) -> Tuple[int, int, int, int]:
+    u = phash & _MASK
+    return tuple((u >> (16 * i)) & 0xFFFF for i in range(4))
+
+def make_thumbnail(path: Path, sha: str, root: Path = UPLOAD_DIR) -> Tuple[Path, int, Tuple[int, int]]:
+    """Write the thumbnail (if missing); returns (thumb path, dHash, original size) from one reduced decode."""
+    with Image.open(path) as img:
+        size = img.size
+        img.draft("RGB", (THUMB_SIDE, THUMB_SIDE))  # JPEG decodes at 1/2..1/8 scale directly
+        img = img.convert("RGB")
+        img.thumbnail((THUMB_SIDE, THUMB_SIDE))
+    dest = thumb_path(sha, root)
+    if not dest.exists():
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=root / "tmp", suffix=".jpg", delete=False) as out:
+            img.save(out, "JPEG", quality=80)
+        _publish(out.name, dest)
+    return dest, dhash(img), size
+
+# ---- Cached analysis ----
+def _row_stats(row) -> Dict[str, Any]:
+    return {k: row[k] for k in _STATS}
+
+def _find_similar(conn, phash: int) -> Optional[Dict[str, Any]]:
+    p = _parts(phash)
+    rows = conn.execute(select(photos).where(photos.c.analysis_side == ANALYSIS_SIDE, or_(
+        photos.c.ph0 == p[0], photos.c.ph1 == p[1], photos.c.ph2 == p[2], photos.c.ph3 == p[3],
+    ))).mappings().all()
+    best = min(rows, key=lambda r: hamming(r["phash"], phash), default=None)
+    return dict(best) if best is not None and hamming(best["phash"], phash) <= PHASH_MAX_DISTANCE else None
+
+def ingest_photo(src: Source, root: Path = UPLOAD_DIR) -> Dict[str, Any]:
+    """
+    Store an upload and return its image checks plus sha256, path, thumb_path and cache
+    ("hit": same bytes seen before, "similar": stats reused from a near-identical photo, "miss": analyzed).
+    """
+    with timer("photo_ingest") as t:
+        t.rows = 1
+        sha, path, _ = store_upload(src, root)
+        with get_engine().connect() as conn:
+            row = conn.execute(select(photos).where(photos.c.sha256 == sha)).mappings().fetchone()
+        if row is not None and row["analysis_side"] == ANALYSIS_SIDE:
+            count("photo_cache", result="hit")
+            return {"sha256": sha, "path": str(path), "thumb_path": row["thumb_path"], "cache": "hit", **_row_stats(row)}
+
+        thumb, phash, (width, height) = make_thumbnail(path, sha, root)
+        with get_engine().connect() as conn:
+            similar = _find_similar(conn, phash)
+        if similar is not None:
+            stats = {**_row_stats(similar), "width": width, "height": height}
+            source, cache = similar["source_sha256"] or similar["sha256"], "similar"
+        else:
+            # same canonical size and decode as the analyze_images backfill
+            stats, source, cache = analyze_image(path, reduced=True), None, "miss"
+        p = _parts(phash)
+        with get_write_engine().begin() as conn:
+            # REPLACE: a stale row (older analysis_side) is overwritten; a concurrent upload writes the same stats
+            conn.execute(insert(photos).prefix_with("OR REPLACE").values(
+                sha256=sha, phash=phash, ph0=p[0], ph1=p[1], ph2=p[2], ph3=p[3],
+                path=str(path), thumb_path=str(thumb), source_sha256=source, analysis_side=ANALYSIS_SIDE,
+                **{k: stats.get(k) for k in _STATS},
+            ))
+        count("photo_cache", result=cache)
+        return {**stats, "sha256": sha, "path": str(path), "thumb_path": str(thumb), "cache": cache}
@@ -1,67 +1,136 @@
 from __future__ import annotations
-from typing import Tuple
-from sqlalchemy import select
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+from sqlalchemy import select, union_all, update
+from app.db.facts import refresh_claims_facts
+from app.db.migrations import ensure_schema
 from app.db.session import get_session
 from app.models.schema import Claim
 from app.utils.logger import get_logger
-from app.nlp.text_models import classify_issue, sentiment_label
+from app.utils.metrics import count, observe, timer
+from app.nlp.text_models import classify_issue, classify_issues, sentiment_compound, sentiment_compounds
 
 logger = get_logger()
 
-def analyze_text(text: str | None) -> Tuple[str, str]:
-    """Return (issue_label, sentiment_label) for a claim description."""
-    return classify_issue(text), sentiment_label(text)
+PENDING_STATUSES = ("new", "investigating")
+_UNSET_LABELS = ("", "unknown", "other")   # labels a prediction may overwrite
+_UNKNOWN = "Other"                         # classifier result when no keyword matched
 
-def process_pending_claims(batch_size: int = 100) -> dict:
+# on_chunk(last_id, rows_examined) is called after each committed batch; returning False stops the run
+ChunkCallback = Callable[[int, int], bool]
+
+def analyze_text(text: str | None) -> Tuple[str, float]:
+    """Return (issue_label, sentiment_score) for a claim description."""
+    return classify_issue(text or "")[0], sentiment_compound(text or "")
+
+def _pending_batch(sess, last_id: int, batch_size: int) -> List[Tuple[int, str, Optional[str], Optional[float]]]:
     """
-    Process claims with status in ('new','investigating').
-    - Always (re)compute sentiment_label if empty or different.
-    - Update issue_category only if it's empty/unknown. If it differs, log a note.
+    Next `batch_size` pending claims after `last_id` (id order). One keyset range per status,
+    each walking ix_claims_status in id order, so a batch costs O(batch_size) however large the
+    backlog is (a single `status IN (...) ORDER BY id` sorts every remaining match each time).
     """
-    sess = get_session()
-    updated = 0
-    skipped = 0
-    examined = 0
-    try:
-        stmt = select(Claim).where(Claim.status.in_(["new", "investigating"]))
-        claims = sess.scalars(stmt).all()
-        for claim in claims[:batch_size]:
-            examined += 1
-            pred_issue, pred_sent = analyze_text(claim.description_text)
+    cols = (Claim.id, Claim.description, Claim.issue_label, Claim.sentiment_score)
+    parts = [
+        select(sub).select_from(sub) for sub in (
+            select(*cols).where(Claim.status == status, Claim.id > last_id)
+            .order_by(Claim.id).limit(batch_size).subquery()
+            for status in PENDING_STATUSES
+        )
+    ]
+    u = union_all(*parts).subquery()
+    return sess.execute(select(u).order_by(u.c.id).limit(batch_size)).all()
 
-            changed = False
-
-            # Update sentiment if missing or different
-            if not claim.sentiment_label or claim.sentiment_label != pred_sent:
-                claim.sentiment_label = pred_sent
-                changed = True
+def _batch_updates(rows: Sequence[Tuple[int, str, Optional[str], Optional[float]]]) -> List[Dict[str, Any]]:
+    """
+    Bulk-UPDATE params for the rows whose outputs change:
+    - sentiment_score is (re)computed when missing or different;
+    - issue_label is filled only when unset/unknown; a disagreeing prediction is logged, not written.
+    """
+    texts = [desc or "" for _, desc, _, _ in rows]
+    labels = classify_issues(texts)
+    sentiments = sentiment_compounds(texts)
+    now = datetime.utcnow()
+    params = []
+    for (cid, _, curr_label, curr_sent), (pred_label, _), pred_sent in zip(rows, labels, sentiments):
+        p: Dict[str, Any] = {}
+        if curr_sent is None or abs(curr_sent - pred_sent) > 1e-9:
+            p["sentiment_score"] = pred_sent
+        if (curr_label or "").lower() in _UNSET_LABELS:
+            if pred_label != _UNKNOWN:
+                p["issue_label"] = pred_label
+        elif pred_label != _UNKNOWN and pred_label != curr_label:
+            logger.debug(f"Claim#{cid}: kept issue_label='{curr_label}', pred='{pred_label}'")
+        if p:
+            # every row of an executemany needs the same keys: keep the current value where unchanged
+            params.append({
+                "id": cid, "issue_label": p.get("issue_label", curr_label),
+                "sentiment_score": p.get("sentiment_score", curr_sent), "updated_at": now,
+            })
+    return params
 
-            # Update issue_category only if it's unset/unknown
-            curr_issue = (claim.issue_category or "unknown").lower()
-            if curr_issue in ("", "unknown", None):
-                if pred_issue and pred_issue != "unknown":
-                    claim.issue_category = pred_issue
-                    changed = True
-            else:
-                # If our prediction disagrees, just log for now (don’t overwrite)
-                if pred_issue != "unknown" and pred_issue != curr_issue:
-                    logger.info(
-                        f"Claim#{claim.id}: kept issue_category='{curr_issue}', "
-                        f"pred='{pred_issue}'"
-                    )
+def process_pending_claims(
+    batch_size: int = 100,
+    drain: bool = False,
+    start_after: int = 0,
+    on_chunk: Optional[ChunkCallback] = None,
+) -> Dict[str, Any]:
+    """
+    Refresh sentiment_score and fill unset issue_label for claims with status 'new'/'investigating'.
 
-            if changed:
-                sess.add(claim)
-                updated += 1
-            else:
-                skipped += 1
+    Pending claims are fetched `batch_size` at a time (LIMIT + keyset on id) and each batch's
+    changes are committed on their own. By default one batch is processed; `drain=True` keeps
+    pulling batches until the backlog is empty. `start_after`/`on_chunk` resume from a
+    checkpointed id and report each committed batch (the "pending" job records them, so a
+    crashed run picks up after its last commit). Returns {"examined", "updated", "skipped",
+    "batches", "last_id"}.
+    """
+    ensure_schema()
+    t_run = time.perf_counter()
+    examined = updated = batches = 0
+    last_id = start_after
+    rs = get_session()             # reads: snapshot released after every batch
+    s = get_session(write=True)    # writes: write lock held only for the UPDATE + commit
+    try:
+        while True:
+            t_batch = time.perf_counter()
+            with timer("db_read", stage="pending") as t:
+                rows = _pending_batch(rs, last_id, batch_size)
+                rs.rollback()
+                t.rows = len(rows)
+            if not rows:
+                break
+            last_id = rows[-1][0]
+            params = _batch_updates(rows)
+            if params:
+                with timer("db_write", stage="pending", rows=len(params)):
+                    s.execute(update(Claim), params)
+                    refresh_claims_facts(s, [p["id"] for p in params])
+                    s.commit()
+            batches += 1
+            examined += len(rows)
+            updated += len(params)
+            elapsed = time.perf_counter() - t_batch
+            logger.info(
+                f"Pending batch {batches} up to id={last_id}: examined={len(rows)}, updated={len(params)}, "
+                f"skipped={len(rows) - len(params)} ({len(rows) / elapsed if elapsed > 0 else 0.0:.0f} claims/s)"
+            )
+            if on_chunk is not None and on_chunk(last_id, len(rows)) is False:
+                break
+            if not drain or len(rows) < batch_size:
+                break
 
-        sess.commit()
-        logger.info(f"Processed claims: examined={examined}, updated={updated}, skipped={skipped}")
-        return {"examined": examined, "updated": updated, "skipped": skipped}
+        skipped = examined - updated
+        count("claims_processed", updated, stage="pending", result="updated")
+        count("claims_processed", skipped, stage="pending", result="skipped")
+        logger.info(f"Processed claims: examined={examined}, updated={updated}, skipped={skipped}, batches={batches}")
+        return {"examined": examined, "updated": updated, "skipped": skipped, "batches": batches, "last_id": last_id}
     except Exception as e:
-        sess.rollback()
+        s.rollback()
+        count("stage_errors", stage="pending")
         logger.exception(f"❌ NLP pipeline failed: {e}")
         raise
     finally:
-        sess.close()
+        rs.close()
+        s.close()
+        observe("stage_run", time.perf_counter() - t_run, rows=examined, stage="pending")
@@ -1,48 +1,153 @@
 # app/utils/powerbi_export.py
+from datetime import datetime
 from pathlib import Path
-from typing import Dict
+from typing import Any, Dict, List, Optional
+import csv
+import json
+import os
 import pandas as pd
 from sqlalchemy import text
 from app.db.session import get_engine
+from app.utils.metrics import timer
 
 EXPORT_DIR = Path(__file__).resolve().parents[2] / "app" / "data" / "exports"
 EXPORT_DIR.mkdir(parents=True, exist_ok=True)
+MANIFEST_PATH = EXPORT_DIR / "manifest.json"
 
-def _read(sql: str) -> pd.DataFrame:
-    eng = get_engine()
-    with eng.connect() as conn:
-        return pd.read_sql_query(text(sql), conn)
+TABLES = ["customers", "products", "claims", "claims_facts", "v_claims_facts"]
+DEFAULT_CHUNKSIZE = 50_000
+
+def _columns(conn, name: str) -> List[str]:
+    # works for tables and views; raises if `name` doesn't exist
+    return list(conn.execute(text(f"SELECT * FROM {name} LIMIT 0")).keys())
+
+def _load_manifest() -> Dict[str, Any]:
+    if MANIFEST_PATH.exists():
+        return json.loads(MANIFEST_PATH.read_text(encoding="utf-8"))
+    return {}
 
-def export_powerbi_csvs() -> Dict[str, Path]:
+def _save_manifest(manifest: Dict[str, Any]) -> None:
+    tmp = MANIFEST_PATH.with_suffix(".json.tmp")
+    tmp.write_text(json.dumps(manifest, indent=2, default=str), encoding="utf-8")
+    os.replace(tmp, MANIFEST_PATH)
+
+def _stream_csv(conn, sql: str, params: Dict[str, Any], path: Path, append: bool,
+                wm_col: Optional[str], chunksize: int, key: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Write query results to `path` chunk by chunk; returns row count, max watermark value seen and,
+    with `key` (the query is then ordered by wm_col, key), the key of the last row at that value.
     """
-    Writes CSVs for customers, products, claims, and v_claims_facts (if present).
+    rows, wm_max, wm_key = 0, None, None
+    write_header = not (append and path.exists())
+    with timer("export_table", table=path.stem) as t, open(path, "a" if append else "w", newline="", encoding="utf-8") as f:
+        for chunk in pd.read_sql_query(text(sql), conn, params=params, chunksize=chunksize):
+            chunk.to_csv(f, index=False, header=write_header)
+            write_header = False
+            rows += len(chunk)
+            if wm_col and key and len(chunk):
+                wm_max, wm_key = str(chunk[wm_col].iloc[-1]), chunk[key].iloc[-1].item()
+            elif wm_col and len(chunk):
+                m = str(chunk[wm_col].max())
+                wm_max = m if wm_max is None or m > wm_max else wm_max
+        t.rows = rows
+    return {"rows": rows, "watermark": wm_max, "watermark_key": wm_key}
+
+def _upsert_csv(path: Path, delta_path: Path, key: str) -> int:
+    """Rewrite `path` without rows whose `key` is in `delta_path`, then append the delta. Streams both files."""
+    with open(delta_path, newline="", encoding="utf-8") as f:
+        delta_keys = {row[key] for row in csv.DictReader(f)}
+    tmp = path.with_suffix(".csv.tmp")
+    total = 0
+    with open(tmp, "w", newline="", encoding="utf-8") as out:
+        writer = None
+        for src, skip in ((path, delta_keys), (delta_path, set())):
+            with open(src, newline="", encoding="utf-8") as f:
+                reader = csv.reader(f)
+                header = next(reader, None)
+                if header is None:
+                    continue
+                if writer is None:
+                    writer = csv.writer(out)
+                    writer.writerow(header)
+                k = header.index(key)
+                for row in reader:
+                    if row[k] not in skip:
+                        writer.writerow(row)
+                        total += 1
+    os.replace(tmp, path)
+    delta_path.unlink()
+    return total
+
+def export_powerbi_csvs(
+    incremental: bool = False,
+    upsert: bool = True,
+    chunksize: int = DEFAULT_CHUNKSIZE,
+) -> Dict[str, Path]:
+    """
+    Writes CSVs for customers, products, claims, claims_facts and v_claims_facts (if present).
     Returns mapping {name: path}.
+
+    Rows are streamed with read_sql_query(chunksize=...) so memory stays flat. With
+    `incremental=True`, each table only exports rows whose (updated_at, id) (created_at for tables
+    without updated_at, claim_id for keyed views) is past the watermark recorded in manifest.json,
+    so rows sharing the previous export's last timestamp are not skipped; the delta is upserted by
+    id (or appended with `upsert=False`). Tables without a watermark column, or never exported
+    before, get a full dump. The manifest records watermark and row counts per table.
     """
     out: Dict[str, Path] = {}
+    manifest = _load_manifest()
+    eng = get_engine()
+    with eng.connect() as conn:
+        for name in TABLES:
+            try:
+                cols = _columns(conn, name)
+            except Exception:
+                # view/table missing—skip silently
+                continue
+            path = EXPORT_DIR / f"{name}.csv"
+            wm_col = "updated_at" if "updated_at" in cols else ("created_at" if "created_at" in cols else None)
+            key = "id" if "id" in cols else ("claim_id" if "claim_id" in cols else None)
+            prev = manifest.get(name, {})
+            last_wm = prev.get("watermark")
+            # manifests written before the key was recorded re-read rows at their last timestamp
+            last_key = prev.get("watermark_key", -1)
+
+            order = f" ORDER BY {wm_col}, {key}" if wm_col and key else (f" ORDER BY {wm_col}" if wm_col else "")
+            if incremental and wm_col and last_wm and path.exists():
+                if key:
+                    where, params = f"{wm_col} > :wm OR ({wm_col} = :wm AND {key} > :wk)", {"wm": last_wm, "wk": last_key}
+                else:
+                    where, params = f"{wm_col} > :wm", {"wm": last_wm}
+                sql = f"SELECT * FROM {name} WHERE {where}{order}"
+                if upsert and key:
+                    delta_path = path.with_suffix(".delta.csv")
+                    res = _stream_csv(conn, sql, params, delta_path, False, wm_col, chunksize, key)
+                    if res["rows"]:
+                        total = _upsert_csv(path, delta_path, key)
+                    else:
+                        delta_path.unlink()
+                        total = prev.get("rows_total", 0)
+                    mode = "upsert"
+                else:
+                    res = _stream_csv(conn, sql, params, path, True, wm_col, chunksize, key)
+                    total = prev.get("rows_total", 0) + res["rows"]
+                    mode = "append"
+            else:
+                res = _stream_csv(conn, f"SELECT * FROM {name}{order}", {}, path, False, wm_col, chunksize, key)
+                total = res["rows"]
+                mode = "full"
 
-    # base tables
-    df_customers = _read("SELECT * FROM customers")
-    df_products  = _read("SELECT * FROM products")
-    df_claims    = _read("SELECT * FROM claims")
-
-    paths = {
-        "customers": EXPORT_DIR / "customers.csv",
-        "products":  EXPORT_DIR / "products.csv",
-        "claims":    EXPORT_DIR / "claims.csv",
-    }
-    df_customers.to_csv(paths["customers"], index=False)
-    df_products.to_csv(paths["products"], index=False)
-    df_claims.to_csv(paths["claims"], index=False)
-    out.update(paths)
-
-    # analytics view (if exists)
-    try:
-        df_v = _read("SELECT * FROM v_claims_facts")
-        p = EXPORT_DIR / "v_claims_facts.csv"
-        df_v.to_csv(p, index=False)
-        out["v_claims_facts"] = p
-    except Exception:
-        # view missing—skip silently
-        pass
+            manifest[name] = {
+                "path": str(path),
+                "mode": mode,
+                "watermark_column": wm_col,
+                "watermark": res["watermark"] or last_wm,
+                "watermark_key": res["watermark_key"] if res["watermark"] else prev.get("watermark_key"),
+                "rows_exported": res["rows"],
+                "rows_total": total,
+                "exported_at": datetime.utcnow().isoformat(timespec="seconds"),
+            }
+            out[name] = path
 
+    _save_manifest(manifest)
     return out
@@ -1,19 +1,35 @@
 # app/ann/refund_predictor.py
 from __future__ import annotations
+from datetime import datetime
 from pathlib import Path
-from typing import List, Tuple, Optional
+from typing import Any, Callable, Dict, Iterator, List, Sequence, Tuple, Optional
+import argparse
+import copy
 import json
+import os
+import threading
+import time
 
 import numpy as np
 from joblib import dump, load
 from sklearn.neural_network import MLPRegressor
+from sqlalchemy import and_, func, or_, select, update
 
+from app.db.facts import refresh_claims_facts
+from app.db.migrations import ensure_schema
 from app.db.session import get_session
 from app.models.schema import Claim
+from app.utils.logger import get_logger
+from app.utils.metrics import count, observe, timer
+
+logger = get_logger()
 
 MODELS_DIR = Path(__file__).resolve().parents[2] / "app" / "data" / "models"
 MODELS_DIR.mkdir(parents=True, exist_ok=True)
-MODEL_PATH = MODELS_DIR / "refund_mlp.joblib"
+MODEL_PATH = MODELS_DIR / "refund_mlp.joblib"   # legacy single artifact, imported into the registry as v1
+REGISTRY_DIR = MODELS_DIR / "refund"
+
+FEATURE_SCHEMA = ["sentiment_score", "is_photo_attached", "damage_score", "issue_code"]
 
 ISSUE_MAP = {
     "Audio Issue": 0,
@@ -28,22 +44,27 @@ ISSUE_MAP = {
 def _encode_issue(label: Optional[str]) -> int:
     return ISSUE_MAP.get(label or "Other", 6)
 
+# Columns needed to build a feature row; selecting just these avoids loading full ORM objects.
+FEATURE_COLUMNS = (Claim.sentiment_score, Claim.is_photo_attached, Claim.damage_score, Claim.issue_label)
+
+def _extract_features_batch(rows: Sequence[Any]) -> np.ndarray:
+    """(n, 4) feature matrix from Claims or result rows exposing the FEATURE_COLUMNS attributes."""
+    n = len(rows)
+    X = np.empty((n, 4), dtype=float)
+    X[:, 0] = np.fromiter((r.sentiment_score or 0.0 for r in rows), dtype=float, count=n)
+    X[:, 1] = np.fromiter((1.0 if r.is_photo_attached else 0.0 for r in rows), dtype=float, count=n)
+    X[:, 2] = np.fromiter((r.damage_score or 0.0 for r in rows), dtype=float, count=n)
+    X[:, 3] = np.fromiter((_encode_issue(r.issue_label) for r in rows), dtype=float, count=n)
+    return X
+
 def _extract_features(c: Claim) -> np.ndarray:
-    x = [
-        float(c.sentiment_score or 0.0),
-        1.0 if c.is_photo_attached else 0.0,
-        float(c.damage_score or 0.0),
-        float(_encode_issue(c.issue_label)),
-    ]
-    return np.array(x, dtype=float)
-
-def _build_training_data(claims: List[Claim]) -> Tuple[np.ndarray, np.ndarray]:
-    X, y = [], []
-    for c in claims:
-        if c.predicted_refund_prob is not None:
-            X.append(_extract_features(c))
-            y.append(float(c.predicted_refund_prob))
-    return np.array(X, dtype=float), np.array(y, dtype=float)
+    return _extract_features_batch([c])[0]
+
+def _build_training_data(claims: Sequence[Any]) -> Tuple[np.ndarray, np.ndarray]:
+    # the target is the observed outcome, never predicted_refund_prob (the model's own output)
+    labeled = [c for c in claims if c.refund_outcome is not None]
+    y = np.fromiter((c.refund_outcome for c in labeled), dtype=float, count=len(labeled))
+    return _extract_features_batch(labeled), y
 
 def _synthetic_training_data(n: int = 300, seed: int = 42) -> Tuple[np.ndarray, np.ndarray]:
     rng = np.random.default_rng(seed)
@@ -62,35 +83,377 @@ def _synthetic_training_data(n: int = 300, seed: int = 42) -> Tuple[np.ndarray,
     X = np.vstack([sent, photo, damage, issue]).T
     return X, y
 
-def train_or_load_model(claims: List[Claim]) -> MLPRegressor:
-    if MODEL_PATH.exists():
-        return load(MODEL_PATH)
+# ---- Model registry ----
+def _write_atomic(path: Path, data: str) -> None:
+    tmp = path.with_suffix(path.suffix + ".tmp")
+    tmp.write_text(data, encoding="utf-8")
+    os.replace(tmp, path)
+
+class ModelRegistry:
+    """
+    Versioned refund-model artifacts on disk:
+        v{n}.joblib  model
+        v{n}.json    metadata (feature_schema, n_train, source, metrics, created_at)
+        ACTIVE       {"version": n}, replaced atomically on activation
+    The active model is cached in memory and reloaded only when ACTIVE changes on disk.
+    Readers never take the lock: they grab the cached (version, model, meta) tuple, which is
+    swapped in one assignment, so running scorers keep the model they started with.
+    """
+    def __init__(self, root: Path):
+        self.root = root
+        self.root.mkdir(parents=True, exist_ok=True)
+        self._pointer = root / "ACTIVE"
+        self._lock = threading.Lock()
+        self._stamp: Optional[int] = None
+        self._active: Optional[Tuple[int, MLPRegressor, Dict[str, Any]]] = None
+
+    def _artifact(self, version: int) -> Path:
+        return self.root / f"v{version}.joblib"
+
+    def _meta_path(self, version: int) -> Path:
+        return self.root / f"v{version}.json"
+
+    def versions(self) -> List[Dict[str, Any]]:
+        metas = [json.loads(p.read_text(encoding="utf-8")) for p in self.root.glob("v*.json")]
+        return sorted(metas, key=lambda m: m["version"])
+
+    def metadata(self, version: int) -> Dict[str, Any]:
+        return json.loads(self._meta_path(version).read_text(encoding="utf-8"))
+
+    def load(self, version: int) -> MLPRegressor:
+        """A fresh copy of any registered version's model (the cached active one is never handed out)."""
+        return load(self._artifact(version))
 
-    X_labeled, y_labeled = _build_training_data(claims)
-    if X_labeled.shape[0] < 10:
-        X, y = _synthetic_training_data()
+    def register(self, model: MLPRegressor, meta: Dict[str, Any], activate: bool = True) -> int:
+        with self._lock:
+            version = max((m["version"] for m in self.versions()), default=0) + 1
+            tmp = self._artifact(version).with_suffix(".joblib.tmp")
+            dump(model, tmp)
+            os.replace(tmp, self._artifact(version))
+            meta = {
+                **meta,
+                "version": version,
+                "feature_schema": meta.get("feature_schema", FEATURE_SCHEMA),
+                "created_at": datetime.utcnow().isoformat(timespec="seconds"),
+            }
+            _write_atomic(self._meta_path(version), json.dumps(meta, indent=2))
+        if activate:
+            self.activate(version, _model=model)
+        return version
+
+    def activate(self, version: int, _model: Optional[MLPRegressor] = None) -> None:
+        meta = self.metadata(version)
+        model = _model if _model is not None else load(self._artifact(version))
+        with self._lock:
+            _write_atomic(self._pointer, json.dumps({"version": version}))
+            self._stamp = self._pointer.stat().st_mtime_ns
+            self._active = (version, model, meta)
+
+    def active(self) -> Optional[Tuple[MLPRegressor, Dict[str, Any]]]:
+        """(model, metadata) of the active version, or None if nothing is registered."""
+        try:
+            stamp = self._pointer.stat().st_mtime_ns
+        except FileNotFoundError:
+            return None
+        current = self._active
+        if stamp != self._stamp or current is None:
+            with self._lock:
+                if stamp != self._stamp or self._active is None:
+                    version = json.loads(self._pointer.read_text(encoding="utf-8"))["version"]
+                    if self._active is None or self._active[0] != version:
+                        self._active = (version, load(self._artifact(version)), self.metadata(version))
+                    self._stamp = stamp
+                current = self._active
+        return current[1], current[2]
+
+REGISTRY = ModelRegistry(REGISTRY_DIR)
+
+# Claims with id % HOLDOUT_MOD == 0 are the fixed holdout: no training path (full fit or incremental)
+# ever fits on them, so the active model and its candidates are compared on rows neither has seen.
+HOLDOUT_MOD = 5
+
+def _holdout_split(X: np.ndarray, y: np.ndarray, frac: float = 0.2, seed: int = 42):
+    idx = np.random.default_rng(seed).permutation(len(y))
+    n_test = int(len(y) * frac)
+    return X[idx[n_test:]], y[idx[n_test:]], X[idx[:n_test]], y[idx[:n_test]]
+
+def _evaluate(model: MLPRegressor, X: np.ndarray, y: np.ndarray) -> Dict[str, float]:
+    pred = np.clip(model.predict(X), 0.0, 1.0)
+    ss_res = float(np.sum((y - pred) ** 2))
+    ss_tot = float(np.sum((y - y.mean()) ** 2))
+    return {
+        "mae": float(np.mean(np.abs(y - pred))),
+        "r2": 1.0 - ss_res / ss_tot if ss_tot > 0 else 0.0,
+        "n_eval": int(len(y)),
+    }
+
+def train_model(claims: Sequence[Any], activate: bool = True) -> Tuple[MLPRegressor, Dict[str, Any]]:
+    """
+    Fit a fresh model on claims (rows exposing id, FEATURE_COLUMNS and refund_outcome) outside the
+    HOLDOUT_MOD holdout, evaluate it on the holdout and register it. With fewer than 10 training
+    outcomes it falls back to synthetic data and a random 20% split.
+    """
+    X_tr, y_tr = _build_training_data([c for c in claims if c.id % HOLDOUT_MOD != 0])
+    if len(y_tr) < 10:
+        X_tr, y_tr, X_te, y_te = _holdout_split(*_synthetic_training_data())
+        source = "synthetic"
     else:
-        X, y = X_labeled, y_labeled
+        X_te, y_te = _build_training_data([c for c in claims if c.id % HOLDOUT_MOD == 0])
+        source = "labeled"
 
     model = MLPRegressor(hidden_layer_sizes=(16, 8), activation="relu", random_state=42, max_iter=600)
-    model.fit(X, y)
-    dump(model, MODEL_PATH)
-    return model
+    model.fit(X_tr, y_tr)
+    metrics = _evaluate(model, X_te, y_te) if len(y_te) else {"n_eval": 0}
+    meta = {"source": source, "n_train": int(len(y_tr)), "metrics": metrics}
+    meta["version"] = REGISTRY.register(model, meta, activate=activate)
+    return model, meta
+
+def train_or_load_model(claims: Sequence[Any], retrain: bool = False) -> MLPRegressor:
+    if not retrain:
+        active = REGISTRY.active()
+        if active is not None and active[1].get("feature_schema") == FEATURE_SCHEMA:
+            return active[0]
+        if active is None and MODEL_PATH.exists():
+            # one-time import of the pre-registry artifact
+            REGISTRY.register(load(MODEL_PATH), {"source": "legacy", "n_train": None, "metrics": {}})
+            return REGISTRY.active()[0]
+    return train_model(claims)[0]
+
+# ---- Incremental retraining ----
+HOLDOUT_MAX = 20_000     # most recent holdout rows used to compare candidate vs active
+HOLDOUT_MIN = 10         # fewer labeled holdout rows than this: a candidate is kept but never promoted
+RETRAIN_CHUNK = 5000
+RETRAIN_EPOCHS = 3       # partial_fit passes over each chunk of new rows
+
+Watermark = Tuple[datetime, int]   # (outcome_at, id) of the last labeled claim a model was trained on
+
+def _watermark(meta: Dict[str, Any]) -> Watermark:
+    w = meta.get("watermark")
+    # watermarks from before refund_outcome (keyed on updated_at) covered no real labels
+    return (datetime.fromisoformat(w["outcome_at"]), int(w["id"])) if w and "outcome_at" in w else (datetime.min, 0)
 
-def run_ann_predictor_on_claims() -> int:
+def _after(since: Watermark):
+    ts, last_id = since
+    return or_(Claim.outcome_at > ts, and_(Claim.outcome_at == ts, Claim.id > last_id))
+
+def _training_head(active: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Metadata of the model the next incremental run continues from: the newest unpromoted candidate
+    trained on top of the active version, else the active version itself. Rejected candidates are
+    carried forward, so each run trains on outcomes recorded since the last run, not since the
+    last promotion.
+    """
+    line = [m for m in REGISTRY.versions()
+            if m.get("source") == "incremental" and m.get("base_version") == active.get("version")
+            and not m.get("promoted")]
+    return line[-1] if line else active
+
+def _labeled_since(conn, since: Watermark, until: datetime, chunk_size: int) -> Iterator[Sequence[Any]]:
+    """Claims whose outcome was recorded after `since` up to `until`, in (outcome_at, id) keyset chunks."""
+    while True:
+        rows = conn.execute(
+            select(Claim.id, Claim.outcome_at, *FEATURE_COLUMNS, Claim.refund_outcome)
+            .where(Claim.refund_outcome.is_not(None), Claim.outcome_at <= until, _after(since))
+            .order_by(Claim.outcome_at, Claim.id).limit(chunk_size)
+        ).all()
+        conn.rollback()
+        if not rows:
+            return
+        since = (rows[-1].outcome_at, rows[-1].id)
+        yield rows
+
+def training_backlog() -> int:
+    """Outcomes recorded since the last incremental run (everything if no model has a watermark)."""
+    active = REGISTRY.active()
+    since = _watermark(_training_head(active[1]) if active is not None else {})
     s = get_session()
     try:
-        claims: List[Claim] = s.query(Claim).order_by(Claim.id).all()
-        if not claims:
+        return int(s.execute(select(func.count()).select_from(Claim).where(
+            Claim.refund_outcome.is_not(None), _after(since),
+        )).scalar() or 0)
+    finally:
+        s.close()
+
+def retrain_incremental(
+    chunk_size: int = RETRAIN_CHUNK,
+    epochs: int = RETRAIN_EPOCHS,
+    max_regression: float = 0.0,
+    on_chunk: Optional[Callable[[int, int], bool]] = None,
+) -> Dict[str, Any]:
+    """
+    Warm-start the training head (see _training_head) with partial_fit on claims whose refund
+    outcome was recorded since its watermark, streamed in `chunk_size` (outcome_at, id) keyset
+    chunks, so a nightly run costs the new outcomes, not the history. A model without a watermark
+    (legacy, synthetic or full refit) has seen no outcomes yet, so its first incremental run makes
+    one streaming pass over all of them.
+
+    Candidate and active model are scored on the same fixed holdout (labeled claims with
+    id % HOLDOUT_MOD == 0, the latest HOLDOUT_MAX); the candidate is always registered but only
+    activated if MAE does not rise and R2 does not drop by more than `max_regression`, and only
+    if the active version is still the one it started from. Scorers keep using the active model
+    throughout (activation is an atomic swap). on_chunk(last_id, rows) returning False abandons
+    the candidate. Returns {"status", "n_new", "version", "baseline", "metrics", ...}.
+    """
+    ensure_schema()
+    t_run = time.perf_counter()
+    n_new = 0
+    s = get_session()
+    try:
+        model = load_model(s)   # bootstraps a first model if nothing is registered
+        active = REGISTRY.active()[1]
+        head = _training_head(active)
+        since = _watermark(head)
+        until = s.execute(select(func.max(Claim.outcome_at))).scalar()
+        s.rollback()
+        if until is None:
+            return {"status": "up_to_date", "n_new": 0, "version": active.get("version")}
+
+        # the cached active model stays untouched for scorers
+        candidate = copy.deepcopy(model) if head is active else REGISTRY.load(head["version"])
+        watermark = since
+        for rows in _labeled_since(s, since, until, chunk_size):
+            train = [r for r in rows if r.id % HOLDOUT_MOD != 0]
+            if train:
+                X, y = _build_training_data(train)
+                with timer("ann_partial_fit", rows=len(train)):
+                    for _ in range(epochs):
+                        candidate.partial_fit(X, y)
+            n_new += len(train)
+            watermark = (rows[-1].outcome_at, rows[-1].id)
+            if on_chunk is not None and on_chunk(rows[-1].id, len(rows)) is False:
+                return {"status": "cancelled", "n_new": n_new, "version": active.get("version")}
+        if n_new == 0:
+            return {"status": "up_to_date", "n_new": 0, "version": active.get("version")}
+
+        holdout = s.execute(
+            select(*FEATURE_COLUMNS, Claim.refund_outcome)
+            .where(Claim.refund_outcome.is_not(None), Claim.id % HOLDOUT_MOD == 0)
+            .order_by(Claim.id.desc()).limit(HOLDOUT_MAX)
+        ).all()
+        s.rollback()
+        X_te, y_te = _build_training_data(holdout)
+        if len(y_te) >= HOLDOUT_MIN:
+            baseline, metrics = _evaluate(model, X_te, y_te), _evaluate(candidate, X_te, y_te)
+            ok = metrics["mae"] <= baseline["mae"] + max_regression and metrics["r2"] >= baseline["r2"] - max_regression
+        else:
+            baseline = metrics = {"n_eval": int(len(y_te))}
+            ok = False
+
+        meta = {
+            "source": "incremental",
+            "base_version": active.get("version"),
+            "parent_version": head.get("version"),
+            "n_train": (head.get("n_train") or 0) + n_new,
+            "n_new": n_new,
+            "watermark": {"outcome_at": watermark[0].isoformat(), "id": watermark[1]},
+            "metrics": metrics,
+            "baseline_metrics": baseline,
+        }
+        current = REGISTRY.active()
+        meta["promoted"] = ok and current is not None and current[1].get("version") == active.get("version")
+        version = REGISTRY.register(candidate, meta, activate=meta["promoted"])
+        count("ann_retrain", result="promoted" if meta["promoted"] else "rejected")
+        scores = (
+            f"mae {baseline['mae']:.4f} -> {metrics['mae']:.4f}, r2 {baseline['r2']:.4f} -> {metrics['r2']:.4f}"
+            if "mae" in metrics else f"only {metrics['n_eval']} holdout outcomes"
+        )
+        logger.info(
+            f"ANN retrain v{version} from v{head.get('version')}: {n_new} new outcomes, {scores}, "
+            f"{'promoted' if meta['promoted'] else 'kept active model'}"
+        )
+        return {"status": "promoted" if meta["promoted"] else "rejected", "version": version, **meta}
+    except Exception:
+        count("stage_errors", stage="retrain")
+        raise
+    finally:
+        s.close()
+        observe("stage_run", time.perf_counter() - t_run, rows=n_new, stage="retrain")
+
+def load_model(conn) -> MLPRegressor:
+    """Active model; the first run trains one from the claim outcomes readable through `conn`."""
+    labeled = [] if REGISTRY.active() is not None or MODEL_PATH.exists() else conn.execute(
+        select(Claim.id, *FEATURE_COLUMNS, Claim.refund_outcome).where(Claim.refund_outcome.is_not(None))
+    ).all()
+    with timer("ann_load_model"):
+        return train_or_load_model(labeled)
+
+def predict_refund_probs(model: MLPRegressor, rows: Sequence[Any]) -> np.ndarray:
+    """Refund probabilities in [0, 1] for rows exposing the FEATURE_COLUMNS attributes."""
+    with timer("ann_features", rows=len(rows)):
+        X = _extract_features_batch(rows)
+    with timer("ann_predict", rows=len(rows)):
+        return np.clip(model.predict(X), 0.0, 1.0)
+
+def run_ann_predictor_on_claims(
+    batch_size: int = 5000,
+    start_after: int = 0,
+    on_chunk: Optional[Callable[[int, int], bool]] = None,
+) -> int:
+    """
+    Scores every claim in keyset-paginated batches: one feature matrix and one model.predict
+    per batch, written back with a single bulk UPDATE and committed per batch. Only claims whose
+    prediction changed are written (and get a new updated_at), so a rerun with the same model
+    leaves incremental exports untouched. Returns the number of claims written.
+    Resumes after claim id `start_after`; on_chunk(last_id, rows) returning False stops the run.
+    """
+    ensure_schema()
+    t_run = time.perf_counter()
+    updated = 0
+    rs = get_session()
+    s = get_session(write=True)
+    try:
+        if rs.execute(select(Claim.id).limit(1)).first() is None:
             return 0
-        model = train_or_load_model(claims)
-        updated = 0
-        for c in claims:
-            x = _extract_features(c).reshape(1, -1)
-            yhat = float(model.predict(x)[0])
-            c.predicted_refund_prob = float(np.clip(yhat, 0.0, 1.0))
-            updated += 1
-        s.commit()
+        model = load_model(rs)
+
+        last_id = start_after
+        while True:
+            with timer("db_read", stage="ann") as t:
+                rows = rs.execute(
+                    select(Claim.id, *FEATURE_COLUMNS, Claim.predicted_refund_prob)
+                    .where(Claim.id > last_id).order_by(Claim.id).limit(batch_size)
+                ).all()
+                rs.rollback()
+                t.rows = len(rows)
+            if not rows:
+                break
+            last_id = rows[-1].id
+            yhat = predict_refund_probs(model, rows)
+            now = datetime.utcnow()
+            params = [
+                {"id": r.id, "predicted_refund_prob": float(p), "updated_at": now}
+                for r, p in zip(rows, yhat)
+                if r.predicted_refund_prob is None or abs(r.predicted_refund_prob - float(p)) > 1e-9
+            ]
+            if params:
+                with timer("db_write", stage="ann", rows=len(params)):
+                    s.execute(update(Claim), params)
+                    refresh_claims_facts(s, [p["id"] for p in params])
+                    s.commit()
+            updated += len(params)
+            if on_chunk is not None and on_chunk(last_id, len(rows)) is False:
+                break
+        count("claims_processed", updated, stage="ann", result="updated")
         return updated
+    except Exception:
+        s.rollback()
+        count("stage_errors", stage="ann")
+        raise
     finally:
+        rs.close()
         s.close()
+        observe("stage_run", time.perf_counter() - t_run, rows=updated, stage="ann")
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Refund model maintenance.")
+    ap.add_argument("--retrain", action="store_true", help="incremental retrain on refund outcomes recorded since the watermark")
+    ap.add_argument("--queue", action="store_true", help="queue the retrain for the background worker instead")
+    args = ap.parse_args()
+    if args.queue:
+        from app.db.jobs import enqueue
+        print(f"retrain queued as job #{enqueue('retrain')}")
+    elif args.retrain:
+        print(retrain_incremental())
+
+if __name__ == "__main__":
+    main()
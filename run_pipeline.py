@@ -1,31 +1,181 @@
 # app/nlp/pipeline.py
-from typing import List
+import time
+from datetime import datetime
+from itertools import chain
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+from sqlalchemy import select, update
 from app.db.session import get_session
 from app.models.schema import Claim
-from app.db.migrations import ensure_claims_nlp_columns
-from .text_models import classify_issue, sentiment_compound, extract_keywords_tfidf
+from app.db.migrations import ensure_schema
+from app.db.facts import refresh_claims_facts
+from app.utils.logger import get_logger
+from app.utils.metrics import count, observe, timer
+from .dedup import IndexPlan, canonical_outputs, description_hash, match as dedup_match, persist as dedup_persist
+from .text_models import (
+    NLP_VERSION, classify_issues, sentiment_compounds, extract_keywords_tfidf, load_or_fit_tfidf, refresh_tfidf,
+)
 
-def run_pipeline_all_claims() -> int:
-    """Runs classification + sentiment + keyphrases over all claims, writes to DB."""
-    ensure_claims_nlp_columns()
+logger = get_logger()
 
+DEFAULT_CHUNK_SIZE = 1000
+
+def _iter_descriptions(chunk_size: int) -> Iterator[str]:
+    """Stream every description (keyset on id) on its own session, for fitting TF-IDF."""
     s = get_session()
     try:
-        claims: List[Claim] = s.query(Claim).order_by(Claim.id).all()
-        if not claims:
-            return 0
-
-        texts = [c.description or "" for c in claims]
-        kw_lists = extract_keywords_tfidf(texts, top_k=5)
-
-        for c, kws in zip(claims, kw_lists):
-            label, _ = classify_issue(c.description or "")
-            sent = sentiment_compound(c.description or "")
-            c.issue_label = label
-            c.sentiment_score = sent
-            c.key_phrases = ", ".join(kws)
-
-        s.commit()
-        return len(claims)
+        last_id = 0
+        while True:
+            rows = s.execute(
+                select(Claim.id, Claim.description).where(Claim.id > last_id).order_by(Claim.id).limit(chunk_size)
+            ).all()
+            if not rows:
+                return
+            for _, desc in rows:
+                yield desc or ""
+            last_id = rows[-1][0]
+    finally:
+        s.close()
+
+def get_vectorizer(force: bool = False, chunk_size: int = DEFAULT_CHUNK_SIZE, extra: Iterable[str] = ()):
+    """Keyphrase vectorizer fitted on all descriptions (plus `extra` ones not stored yet) when missing/expired/forced."""
+    corpus = lambda: chain(_iter_descriptions(chunk_size), extra)
+    return refresh_tfidf(corpus()) if force else load_or_fit_tfidf(corpus)
+
+def nlp_outputs(texts: Sequence[str], vectorizer) -> List[Dict[str, Any]]:
+    """issue_label, key_phrases and sentiment_score for each text (no database access)."""
+    with timer("nlp_keyphrases", rows=len(texts)):
+        kw_lists = extract_keywords_tfidf(list(texts), top_k=5, vectorizer=vectorizer) if texts else []
+    with timer("nlp_classify", rows=len(texts)):
+        labels = classify_issues(list(texts))
+    with timer("nlp_sentiment", rows=len(texts)):
+        sentiments = sentiment_compounds(texts)
+    return [
+        {"issue_label": label, "key_phrases": ", ".join(kws), "sentiment_score": sent}
+        for kws, (label, _), sent in zip(kw_lists, labels, sentiments)
+    ]
+
+def analyze_chunk(
+    conn, stale: Sequence[Tuple[int, str, str]], vectorizer,
+) -> Tuple[List[Dict[str, Any]], IndexPlan]:
+    """
+    NLP outputs for (id, description, description hash) rows as bulk-UPDATE params, plus the
+    near-duplicate plan to persist in the same transaction. Only reads through `conn`.
+    """
+    with timer("dedup_match", rows=len(stale)):
+        plan = dedup_match(conn, [(cid, desc) for cid, desc, _ in stale])
+        stale_ids = {cid for cid, _, _ in stale}
+        reuse = {
+            cid: (label, phrases)
+            for cid, (label, phrases, version) in canonical_outputs(
+                conn, {cid: root for cid, (root, _) in plan.duplicates.items() if root not in stale_ids},
+                [Claim.issue_label, Claim.key_phrases, Claim.nlp_version],
+            ).items()
+            if label is not None and version == NLP_VERSION
+        }
+    fresh = iter(nlp_outputs([desc for cid, desc, _ in stale if cid not in reuse], vectorizer))
+    reused_sentiments = iter(())
+    if reuse:
+        count("dedup_reused", len(reuse), stage="nlp")
+        with timer("nlp_sentiment", rows=len(reuse)):
+            reused_sentiments = iter(sentiment_compounds([desc for cid, desc, _ in stale if cid in reuse]))
+
+    now = datetime.utcnow()
+    params = []
+    for cid, _, dh in stale:
+        if cid in reuse:
+            label, phrases = reuse[cid]
+            out = {"issue_label": label, "key_phrases": phrases, "sentiment_score": next(reused_sentiments)}
+        else:
+            out = next(fresh)
+        params.append({"id": cid, **out, "nlp_hash": dh, "nlp_version": NLP_VERSION, "updated_at": now})
+    return params, plan
+
+# on_chunk(last_id, rows_examined) is called after each committed chunk; returning False stops the run
+ChunkCallback = Callable[[int, int], bool]
+
+def run_pipeline_incremental(
+    force: bool = False,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    start_after: int = 0,
+    on_chunk: Optional[ChunkCallback] = None,
+) -> Dict[str, int]:
+    """
+    Classification + sentiment + keyphrases for claims that are new, edited since their last
+    NLP run (description hash differs) or stamped with an older NLP_VERSION.
+
+    New/edited descriptions are added to the near-duplicate index (app.nlp.dedup) in the same
+    transaction, and a duplicate whose canonical claim already has current NLP outputs copies its
+    issue_label/key_phrases instead of recomputing them.
+
+    Claims are read in keyset-paginated chunks of `chunk_size` and each chunk is written back
+    with one bulk UPDATE and committed on its own, so memory is bounded by the chunk and an
+    interrupted run resumes where it stopped (finished chunks already carry the current stamp).
+    `force=True` recomputes everything and refits the TF-IDF vocabulary. `start_after`/`on_chunk`
+    let a job runner resume from a checkpointed id and report progress or cancel between chunks.
+    Returns {"examined", "updated", "skipped"}.
+    """
+    ensure_schema()
+
+    t_run = time.perf_counter()
+    examined = updated = 0
+    vectorizer = None  # loaded lazily: a run with nothing stale never touches the TF-IDF model
+    rs = get_session()             # reads: snapshot released after every chunk
+    s = get_session(write=True)    # writes: write lock held only for the UPDATE + commit
+    try:
+        last_id = start_after
+        while True:
+            with timer("db_read", stage="nlp") as t:
+                rows = rs.execute(
+                    select(Claim.id, Claim.description, Claim.nlp_hash, Claim.nlp_version)
+                    .where(Claim.id > last_id).order_by(Claim.id).limit(chunk_size)
+                ).all()
+                rs.rollback()
+                t.rows = len(rows)
+            if not rows:
+                break
+            last_id = rows[-1][0]
+            examined += len(rows)
+
+            stale = []
+            for cid, desc, h, v in rows:
+                dh = description_hash(desc)
+                if force or h != dh or v != NLP_VERSION:
+                    stale.append((cid, desc or "", dh))
+            if not stale:
+                if on_chunk is not None and on_chunk(last_id, len(rows)) is False:
+                    break
+                continue
+
+            if vectorizer is None:
+                # Persisted whole-table vocabulary/IDF; only refitted when missing, expired or forced
+                vectorizer = get_vectorizer(force, chunk_size)
+
+            params, plan = analyze_chunk(rs, stale, vectorizer)
+            rs.rollback()
+            with timer("db_write", stage="nlp", rows=len(params)):
+                dedup_persist(s, plan)
+                s.execute(update(Claim), params)
+                refresh_claims_facts(s, [p["id"] for p in params])
+                s.commit()
+            updated += len(params)
+            logger.info(f"NLP chunk up to id={last_id}: updated={len(params)} (total {updated})")
+            if on_chunk is not None and on_chunk(last_id, len(rows)) is False:
+                break
+
+        skipped = examined - updated
+        count("claims_processed", updated, stage="nlp", result="updated")
+        count("claims_processed", skipped, stage="nlp", result="skipped")
+        logger.info(f"NLP: examined={examined}, updated={updated}, skipped={skipped}")
+        return {"examined": examined, "updated": updated, "skipped": skipped}
+    except Exception:
+        s.rollback()
+        count("stage_errors", stage="nlp")
+        raise
     finally:
+        rs.close()
         s.close()
+        observe("stage_run", time.perf_counter() - t_run, rows=examined, stage="nlp")
+
+def run_pipeline_all_claims(force: bool = False, chunk_size: int = DEFAULT_CHUNK_SIZE) -> int:
+    """Runs classification + sentiment + keyphrases over new/changed claims, writes to DB."""
+    return run_pipeline_incremental(force=force, chunk_size=chunk_size)["updated"]
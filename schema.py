@@ -4,7 +4,7 @@ from datetime import datetime
 from typing import List, Optional
 
 from sqlalchemy import (
-    String, Integer, DateTime, ForeignKey, Text, Float, Boolean
+    String, Integer, BigInteger, DateTime, ForeignKey, Text, Float, Boolean, Index, LargeBinary, text
 )
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 
@@ -30,11 +30,21 @@ class Product(Base):
 
     claims: Mapped[List["Claim"]] = relationship(back_populates="product", cascade="all, delete-orphan")
 
+# Final claim statuses and the refund outcome each one records (see Claim.refund_outcome)
+REFUND_OUTCOMES = {"approved": 1.0, "refunded": 1.0, "rejected": 0.0, "denied": 0.0}
+
 class Claim(Base):
     __tablename__ = "claims"
+    __table_args__ = (
+        # match the real access paths: status queues by recency, label trends by date
+        Index("ix_claims_status_updated_at", "status", "updated_at"),
+        Index("ix_claims_issue_label_created_at", "issue_label", "created_at"),
+        Index("ix_claims_updated_at", "updated_at"),
+        Index("ix_claims_outcome_at", "outcome_at"),   # refund-model retraining watermark
+    )
     id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
-    customer_id: Mapped[int] = mapped_column(ForeignKey("customers.id"), nullable=False)
-    product_id: Mapped[int] = mapped_column(ForeignKey("products.id"), nullable=False)
+    customer_id: Mapped[int] = mapped_column(ForeignKey("customers.id"), nullable=False, index=True)
+    product_id: Mapped[int] = mapped_column(ForeignKey("products.id"), nullable=False, index=True)
 
     description: Mapped[str] = mapped_column(Text, nullable=False)
     status: Mapped[str] = mapped_column(String(32), default="new", index=True)
@@ -43,10 +53,13 @@ class Claim(Base):
     issue_label: Mapped[Optional[str]] = mapped_column(String(64), nullable=True)
     key_phrases: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
     sentiment_score: Mapped[Optional[float]] = mapped_column(Float)
+    nlp_hash: Mapped[Optional[str]] = mapped_column(String(64), nullable=True)      # sha256 of description at last NLP run
+    nlp_version: Mapped[Optional[str]] = mapped_column(String(64), nullable=True)   # text_models.NLP_VERSION used
 
     # Vision outputs
     is_photo_attached: Mapped[bool] = mapped_column(Boolean, default=False)
     photo_path: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
+    photo_sha256: Mapped[Optional[str]] = mapped_column(String(64), nullable=True)   # key into photo_analyses
     photo_blur: Mapped[Optional[float]] = mapped_column(Float)          # Laplacian variance
     photo_brightness: Mapped[Optional[float]] = mapped_column(Float)    # mean gray
     photo_contrast: Mapped[Optional[float]] = mapped_column(Float)      # std gray
@@ -55,9 +68,138 @@ class Claim(Base):
     # ANN output
     predicted_refund_prob: Mapped[Optional[float]] = mapped_column(Float)
 
+    # Observed outcome the refund model trains on (REFUND_OUTCOMES of a final status, set by trigger)
+    refund_outcome: Mapped[Optional[float]] = mapped_column(Float)
+    outcome_at: Mapped[Optional[datetime]] = mapped_column(DateTime)   # when refund_outcome was set
+
+    # GenAI outputs
+    ai_summary: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
+    ai_reply: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
+    ai_model: Mapped[Optional[str]] = mapped_column(String(64), nullable=True)
+
+    # Near-duplicate detection (app.nlp.dedup): earliest claim this one repeats, and estimated Jaccard
+    duplicate_of: Mapped[Optional[int]] = mapped_column(Integer, nullable=True, index=True)
+    duplicate_similarity: Mapped[Optional[float]] = mapped_column(Float)
+
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, nullable=False)
     updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
 
     customer: Mapped["Customer"] = relationship(back_populates="claims")
     product:  Mapped["Product"]  = relationship(back_populates="claims")
 
+
+class ClaimFact(Base):
+    """
+    Materialized, denormalized claim row for dashboards/exports (replaces joining v_claims_facts
+    on every read). Kept current by app.db.facts.refresh_claims_facts from pipeline write-backs and
+    by triggers on claims/customers/products for every other write.
+    """
+    __tablename__ = "claims_facts"
+    __table_args__ = (
+        Index("ix_claims_facts_status_updated_at", "status", "updated_at"),
+        Index("ix_claims_facts_issue_label_created_at", "issue_label", "created_at"),
+    )
+    claim_id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    customer_id: Mapped[int] = mapped_column(Integer, nullable=False, index=True)
+    customer_name: Mapped[str] = mapped_column(String(120), nullable=False)
+    product_id: Mapped[int] = mapped_column(Integer, nullable=False, index=True)
+    product_name: Mapped[str] = mapped_column(String(200), nullable=False)
+    product_category: Mapped[Optional[str]] = mapped_column(String(120))
+    product_price: Mapped[Optional[float]] = mapped_column(Float)
+
+    status: Mapped[Optional[str]] = mapped_column(String(32))
+    issue_label: Mapped[Optional[str]] = mapped_column(String(64))
+    sentiment_score: Mapped[Optional[float]] = mapped_column(Float)
+    is_photo_attached: Mapped[Optional[bool]] = mapped_column(Boolean)
+    damage_score: Mapped[Optional[float]] = mapped_column(Float)
+    predicted_refund_prob: Mapped[Optional[float]] = mapped_column(Float)
+    ai_model: Mapped[Optional[str]] = mapped_column(String(64))
+
+    created_at: Mapped[Optional[datetime]] = mapped_column(DateTime)
+    updated_at: Mapped[Optional[datetime]] = mapped_column(DateTime)
+    refreshed_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, nullable=False)
+
+
+class Job(Base):
+    """
+    Background run of a pipeline stage (see app.db.jobs). One active job per dedupe_key: enqueueing
+    the same stage/params while one is queued or running returns the existing job.
+    """
+    __tablename__ = "jobs"
+    __table_args__ = (
+        Index("ix_jobs_status_id", "status", "id"),
+        Index("ux_jobs_active_dedupe_key", "dedupe_key", unique=True,
+              sqlite_where=text("status IN ('queued', 'running')")),
+    )
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    stage: Mapped[str] = mapped_column(String(32), nullable=False)              # nlp | ann | genai
+    params: Mapped[str] = mapped_column(Text, nullable=False, default="{}")     # JSON kwargs for the stage
+    dedupe_key: Mapped[str] = mapped_column(String(80), nullable=False)
+    status: Mapped[str] = mapped_column(String(16), nullable=False, default="queued")  # queued|running|done|failed|cancelled
+    cancel_requested: Mapped[bool] = mapped_column(Boolean, nullable=False, default=False)
+
+    checkpoint: Mapped[int] = mapped_column(Integer, nullable=False, default=0)  # last claim id fully written
+    rows_done: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    rows_total: Mapped[Optional[int]] = mapped_column(Integer)
+    rows_per_sec: Mapped[Optional[float]] = mapped_column(Float)
+    result: Mapped[Optional[str]] = mapped_column(Text)
+    error: Mapped[Optional[str]] = mapped_column(Text)
+    worker_pid: Mapped[Optional[int]] = mapped_column(Integer)
+
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, nullable=False)
+    started_at: Mapped[Optional[datetime]] = mapped_column(DateTime)
+    heartbeat_at: Mapped[Optional[datetime]] = mapped_column(DateTime)
+    finished_at: Mapped[Optional[datetime]] = mapped_column(DateTime)
+
+
+class ClaimMinHash(Base):
+    """MinHash signature of a claim description (app.nlp.dedup)."""
+    __tablename__ = "claim_minhash"
+    claim_id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    desc_hash: Mapped[str] = mapped_column(String(64), nullable=False)   # sha256 of the description signed
+    signature: Mapped[bytes] = mapped_column(LargeBinary, nullable=False)
+
+
+class ClaimLshBucket(Base):
+    """LSH band buckets: claims sharing a bucket in any band are near-duplicate candidates."""
+    __tablename__ = "claim_lsh_buckets"
+    __table_args__ = (
+        Index("ix_claim_lsh_buckets_claim_id", "claim_id"),
+        {"sqlite_with_rowid": False},
+    )
+    bucket: Mapped[int] = mapped_column(BigInteger, primary_key=True)
+    claim_id: Mapped[int] = mapped_column(Integer, primary_key=True)
+
+
+class PhotoAnalysis(Base):
+    """
+    Image checks per distinct upload (app.cnn.photo_store), keyed by content hash. The 64-bit
+    perceptual hash is also split into four 16-bit parts so near-identical photos can be found
+    with indexed equality lookups.
+    """
+    __tablename__ = "photo_analyses"
+    __table_args__ = (
+        Index("ix_photo_analyses_ph0", "ph0"),
+        Index("ix_photo_analyses_ph1", "ph1"),
+        Index("ix_photo_analyses_ph2", "ph2"),
+        Index("ix_photo_analyses_ph3", "ph3"),
+    )
+    sha256: Mapped[str] = mapped_column(String(64), primary_key=True)
+    phash: Mapped[int] = mapped_column(BigInteger, nullable=False)     # dHash, signed 64-bit
+    ph0: Mapped[int] = mapped_column(Integer, nullable=False)
+    ph1: Mapped[int] = mapped_column(Integer, nullable=False)
+    ph2: Mapped[int] = mapped_column(Integer, nullable=False)
+    ph3: Mapped[int] = mapped_column(Integer, nullable=False)
+    path: Mapped[str] = mapped_column(Text, nullable=False)
+    thumb_path: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
+    source_sha256: Mapped[Optional[str]] = mapped_column(String(64), nullable=True)  # stats copied from this near-identical photo
+    width: Mapped[Optional[int]] = mapped_column(Integer)
+    height: Mapped[Optional[int]] = mapped_column(Integer)
+    blur: Mapped[Optional[float]] = mapped_column(Float)
+    brightness: Mapped[Optional[float]] = mapped_column(Float)
+    contrast: Mapped[Optional[float]] = mapped_column(Float)
+    edge_density: Mapped[Optional[float]] = mapped_column(Float)
+    damage_score: Mapped[Optional[float]] = mapped_column(Float)
+    quality_ok: Mapped[Optional[bool]] = mapped_column(Boolean)
+    analysis_side: Mapped[Optional[int]] = mapped_column(Integer)   # image_checks.ANALYSIS_SIDE the stats were measured at
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, nullable=False)
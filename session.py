@@ -0,0 +1,85 @@
+# app/db/session.py
+from __future__ import annotations
+import threading
+from typing import Dict, Optional
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session, sessionmaker
+from app.config import DATABASE_URL
+
+# Engine profile for many Streamlit sessions + batch runs sharing one SQLite file:
+# WAL lets readers keep reading a snapshot while a pipeline commits, busy_timeout makes a second
+# writer wait instead of failing with "database is locked", and the writer engine takes the write
+# lock up front (BEGIN IMMEDIATE) so a read-then-write transaction can't hit SQLITE_BUSY mid-way.
+SQLITE_PRAGMAS: Dict[str, object] = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",      # durable at checkpoints; safe with WAL, far fewer fsyncs than FULL
+    "busy_timeout": 30_000,       # ms
+    "mmap_size": 256 * 1024 * 1024,
+    "cache_size": -64 * 1024,     # KiB (negative = size, not pages)
+    "temp_store": "MEMORY",
+}
+READER_POOL_SIZE = 8
+READER_MAX_OVERFLOW = 8
+
+def _is_sqlite(url: str) -> bool:
+    return url.startswith("sqlite")
+
+def create_sqlite_engine(url: str, writer: bool = False, pragmas: Optional[Dict[str, object]] = None) -> Engine:
+    """
+    Reader engine: pooled connections for concurrent readers.
+    Writer engine: one pooled connection per process (threads queue on the pool) and BEGIN IMMEDIATE.
+    """
+    pragmas = {**SQLITE_PRAGMAS, **(pragmas or {})}
+    engine = create_engine(
+        url,
+        future=True,
+        connect_args={"check_same_thread": False, "timeout": pragmas["busy_timeout"] / 1000},
+        pool_size=1 if writer else READER_POOL_SIZE,
+        max_overflow=0 if writer else READER_MAX_OVERFLOW,
+        pool_timeout=pragmas["busy_timeout"] / 1000,
+    )
+
+    @event.listens_for(engine, "connect")
+    def _on_connect(dbapi_conn, _record):
+        # take transaction control away from pysqlite so the "begin" hook below decides how to BEGIN
+        dbapi_conn.isolation_level = None
+        cur = dbapi_conn.cursor()
+        for key, value in pragmas.items():
+            cur.execute(f"PRAGMA {key}={value}")
+        cur.close()
+
+    @event.listens_for(engine, "begin")
+    def _on_begin(conn):
+        conn.exec_driver_sql("BEGIN IMMEDIATE" if writer else "BEGIN")
+
+    return engine
+
+_engines: Dict[str, Engine] = {}
+_lock = threading.Lock()
+
+def _engine(kind: str) -> Engine:
+    eng = _engines.get(kind)
+    if eng is None:
+        with _lock:
+            eng = _engines.get(kind)
+            if eng is None:
+                if _is_sqlite(DATABASE_URL):
+                    eng = create_sqlite_engine(DATABASE_URL, writer=(kind == "writer"))
+                else:
+                    eng = create_engine(DATABASE_URL, future=True, pool_pre_ping=True)
+                _engines[kind] = eng
+    return eng
+
+def get_engine() -> Engine:
+    """Shared engine for reads; every write, UI ones included, goes through get_write_engine()."""
+    return _engine("reader")
+
+def get_write_engine() -> Engine:
+    """Single-writer engine for pipeline/batch write-backs and migrations (same as get_engine off SQLite)."""
+    return _engine("writer") if _is_sqlite(DATABASE_URL) else get_engine()
+
+_SessionLocal = sessionmaker()
+
+def get_session(write: bool = False) -> Session:
+    return _SessionLocal(bind=get_write_engine() if write else get_engine())
@@ -0,0 +1,326 @@
+# app/db/stream.py
+"""
+Streaming stage graph: one keyset pass over the claims through NLP -> ANN -> (optional) GenAI.
+
+    reader --q--> NLP workers --q--> ANN workers --q--> GenAI workers --q--> writer
+
+Each arrow is a bounded queue (`queue_size` chunks), so a slow stage applies backpressure
+instead of buffering the table, and each stage has its own worker threads: CPU-bound NLP/ANN
+work on chunk n+1 overlaps the LLM round trips of chunk n. The single writer commits every
+chunk's NLP, near-duplicate, refund and GenAI outputs (and its claims_facts rows) in one
+transaction, in read order, so on_chunk checkpoints are monotonic and a resumed run never
+skips a chunk. A claim flows through if its NLP is stale, it has no refund score, or (with
+genai=True) it has no summary.
+
+Chunks in flight are not yet in the near-duplicate index, so a repeat of a claim from the
+previous few chunks may be stored as canonical rather than as its duplicate.
+"""
+from __future__ import annotations
+import queue
+import threading
+import time
+from dataclasses import dataclass, field
+from datetime import datetime
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, List, Optional
+
+from sqlalchemy import select, update
+
+from app.ann.refund_predictor import load_model, predict_refund_probs
+from app.db.facts import refresh_claims_facts
+from app.db.migrations import ensure_schema
+from app.db.session import get_session
+from app.models.schema import Claim, Customer, Product
+from app.nlp.dedup import description_hash, persist as dedup_persist
+from app.nlp.run_pipeline import analyze_chunk, get_vectorizer
+from app.nlp.text_models import NLP_VERSION
+from app.utils.logger import get_logger
+from app.utils.metrics import count, observe, timer
+
+logger = get_logger()
+
+DEFAULT_CHUNK_SIZE = 500
+ChunkCallback = Callable[[int, int], bool]
+_DONE = object()
+
+_COLUMNS = (
+    Claim.id, Claim.description, Claim.nlp_hash, Claim.nlp_version, Claim.status,
+    Customer.name.label("customer_name"), Product.name.label("product_name"),
+    Claim.product_id, Claim.duplicate_of, Claim.sentiment_score, Claim.is_photo_attached, Claim.damage_score,
+    Claim.issue_label, Claim.predicted_refund_prob, Claim.ai_summary,
+)
+
+@dataclass
+class _Chunk:
+    seq: int
+    last_id: int
+    examined: int
+    rows: List[Any]                   # claims in this chunk that need at least one stage
+    read_at: float
+    nlp: Dict[int, Dict[str, Any]] = field(default_factory=dict)   # id -> NLP update params
+    plan: Any = None                                               # dedup.IndexPlan of the NLP stage
+    refund: Dict[int, float] = field(default_factory=dict)
+    drafts: Dict[int, Any] = field(default_factory=dict)           # id -> (summary, reply, model)
+
+class _Graph:
+    """Shared state of one run: stop flag, first error, and models loaded once by whichever worker needs them first."""
+    def __init__(self, force: bool, genai: bool, chunk_size: int, genai_concurrency: int, limits: Dict[str, Any]):
+        self.force, self.genai, self.chunk_size = force, genai, chunk_size
+        self.genai_concurrency, self.limits = genai_concurrency, limits
+        self.stop = threading.Event()
+        self.error: Optional[BaseException] = None
+        self._lock = threading.Lock()
+        self._vectorizer = self._model = None
+
+    def fail(self, e: BaseException) -> None:
+        with self._lock:
+            if self.error is None:
+                self.error = e
+        self.stop.set()
+
+    def vectorizer(self):
+        with self._lock:
+            if self._vectorizer is None:
+                self._vectorizer = get_vectorizer(self.force, self.chunk_size)
+            return self._vectorizer
+
+    def model(self, conn):
+        with self._lock:
+            if self._model is None:
+                self._model = load_model(conn)
+            return self._model
+
+    # ---- Stages (each fills its part of the chunk; reads use a short-lived session) ----
+    def nlp(self, chunk: _Chunk) -> None:
+        stale = []
+        for r in chunk.rows:
+            dh = description_hash(r.description)
+            if self.force or r.nlp_hash != dh or r.nlp_version != NLP_VERSION:
+                stale.append((r.id, r.description or "", dh))
+        if not stale:
+            return
+        vectorizer = self.vectorizer()
+        rs = get_session()
+        try:
+            params, chunk.plan = analyze_chunk(rs, stale, vectorizer)
+        finally:
+            rs.close()
+        chunk.nlp = {p["id"]: p for p in params}
+
+    def ann(self, chunk: _Chunk) -> None:
+        if not chunk.rows:
+            return
+        rs = get_session()
+        try:
+            model = self.model(rs)
+        finally:
+            rs.close()
+        feats = []
+        for r in chunk.rows:
+            nlp = chunk.nlp.get(r.id, {})
+            feats.append(SimpleNamespace(
+                sentiment_score=nlp.get("sentiment_score", r.sentiment_score),
+                issue_label=nlp.get("issue_label", r.issue_label),
+                is_photo_attached=r.is_photo_attached, damage_score=r.damage_score,
+            ))
+        chunk.refund = {r.id: float(p) for r, p in zip(chunk.rows, predict_refund_probs(model, feats))}
+
+    def draft(self, chunk: _Chunk) -> None:
+        from app.genai.summarizer import draft_rows, reuse_drafts  # optional dependency (openai)
+        todo = [r for r in chunk.rows if r.ai_summary is None]
+        if not todo:
+            return
+        dups = chunk.plan.duplicates if chunk.plan is not None else {}
+        rows = [(r.id, r.description, r.status, r.customer_name, r.product_name, r.product_id) for r in todo]
+        canonical_of = {r.id: dups[r.id][0] if r.id in dups else r.duplicate_of for r in todo}
+        rs = get_session()
+        try:
+            reused = reuse_drafts(rs, rows, {k: v for k, v in canonical_of.items() if v is not None})
+        finally:
+            rs.close()
+        drafts = draft_rows(rows, reused, concurrency=self.genai_concurrency, **self.limits)
+        chunk.drafts = {row[0]: d for row, d in zip(rows, drafts)}
+
+def _spawn(graph: _Graph, name: str, fn: Callable[[_Chunk], None], workers: int,
+           inbox: "queue.Queue", outbox: "queue.Queue", downstream: int) -> List[threading.Thread]:
+    """`workers` threads applying `fn` to chunks; the last one to finish passes `downstream` end markers on."""
+    left = [workers]
+    lock = threading.Lock()
+
+    def loop() -> None:
+        while True:
+            chunk = inbox.get()
+            if chunk is _DONE:
+                with lock:
+                    left[0] -= 1
+                    last = left[0] == 0
+                if last:
+                    for _ in range(downstream):
+                        outbox.put(_DONE)
+                return
+            if not graph.stop.is_set():  # after a failure or cancel, chunks just drain through
+                try:
+                    with timer("stream_stage", stage=name, rows=len(chunk.rows)):
+                        fn(chunk)
+                except Exception as e:
+                    logger.exception(f"Stream stage {name} failed on chunk up to id={chunk.last_id}")
+                    graph.fail(e)
+            outbox.put(chunk)
+
+    threads = [threading.Thread(target=loop, name=f"stream-{name}-{i}", daemon=True) for i in range(workers)]
+    for t in threads:
+        t.start()
+    return threads
+
+def _read(graph: _Graph, start_after: int, outbox: "queue.Queue", downstream: int) -> None:
+    rs = get_session()
+    try:
+        last_id, seq = start_after, 0
+        while not graph.stop.is_set():
+            with timer("db_read", stage="stream") as t:
+                rows = rs.execute(
+                    select(*_COLUMNS)
+                    .join(Customer, Customer.id == Claim.customer_id)
+                    .join(Product, Product.id == Claim.product_id)
+                    .where(Claim.id > last_id).order_by(Claim.id).limit(graph.chunk_size)
+                ).all()
+                rs.rollback()
+                t.rows = len(rows)
+            if not rows:
+                break
+            last_id = rows[-1].id
+            work = [
+                r for r in rows
+                if graph.force or r.predicted_refund_prob is None or (graph.genai and r.ai_summary is None)
+                or r.nlp_version != NLP_VERSION or r.nlp_hash != description_hash(r.description)
+            ]
+            outbox.put(_Chunk(seq=seq, last_id=last_id, examined=len(rows), rows=work, read_at=time.perf_counter()))
+            seq += 1
+    except Exception as e:
+        logger.exception("Stream reader failed")
+        graph.fail(e)
+    finally:
+        rs.close()
+        for _ in range(downstream):
+            outbox.put(_DONE)
+
+def _write(s, chunk: _Chunk) -> int:
+    """One transaction per chunk: every stage's outputs, the dedup index and the facts rows."""
+    now = datetime.utcnow()
+    params = []
+    for r in chunk.rows:
+        p = {**chunk.nlp.get(r.id, {}), "id": r.id, "updated_at": now}
+        if r.id in chunk.refund:
+            p["predicted_refund_prob"] = chunk.refund[r.id]
+        if r.id in chunk.drafts:
+            p["ai_summary"], p["ai_reply"], p["ai_model"] = chunk.drafts[r.id]
+        params.append(p)
+    if not params:
+        return 0
+    with timer("db_write", stage="stream", rows=len(params)):
+        if chunk.plan is not None:
+            dedup_persist(s, chunk.plan)
+        s.execute(update(Claim), params)
+        refresh_claims_facts(s, [p["id"] for p in params])
+        s.commit()
+    return len(params)
+
+def _drain(outbox: "queue.Queue", threads: List[threading.Thread]) -> None:
+    """
+    After stop is set: keep emptying the writer's queue until the end marker, so no worker stays
+    blocked on a full queue, then join every thread. With stop set the reader quits and stages
+    pass chunks straight through, so this only waits for work already inside a stage.
+    """
+    while any(t.is_alive() for t in threads):
+        try:
+            if outbox.get(timeout=0.1) is _DONE:
+                break
+        except queue.Empty:
+            continue
+    for t in threads:
+        t.join()
+
+def run_stream(
+    force: bool = False,
+    genai: bool = False,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    nlp_workers: int = 1,
+    ann_workers: int = 1,
+    genai_workers: int = 2,
+    genai_concurrency: int = 8,
+    queue_size: int = 2,
+    start_after: int = 0,
+    on_chunk: Optional[ChunkCallback] = None,
+    rpm: Optional[int] = 500,
+    tpm: Optional[int] = 200_000,
+    **limits,
+) -> Dict[str, int]:
+    """
+    Run the stage graph once over claims after `start_after`. `force` recomputes NLP for every
+    claim. The GenAI `rpm`/`tpm` budget is split evenly between the GenAI workers, and other
+    keyword arguments (max_retries, use_cache, ...) go to the drafting as is. on_chunk(last_id,
+    rows_examined) is called after each committed chunk; returning False stops the run (chunks
+    already in flight are dropped, so the checkpoint stays exact).
+    Returns {"examined", "updated", "nlp", "ann", "genai", "chunks"}.
+    """
+    ensure_schema()
+    t_run = time.perf_counter()
+    share = lambda limit: max(1, limit // genai_workers) if limit else limit
+    graph = _Graph(force, genai, chunk_size, genai_concurrency, {**limits, "rpm": share(rpm), "tpm": share(tpm)})
+    stages = [("nlp", graph.nlp, nlp_workers), ("ann", graph.ann, ann_workers)]
+    if genai:
+        stages.append(("genai", graph.draft, genai_workers))
+    queues = [queue.Queue(maxsize=queue_size) for _ in range(len(stages) + 1)]
+    threads = [threading.Thread(target=_read, args=(graph, start_after, queues[0], stages[0][2]),
+                                name="stream-reader", daemon=True)]
+    for i, (name, fn, workers) in enumerate(stages):
+        downstream = stages[i + 1][2] if i + 1 < len(stages) else 1
+        threads += _spawn(graph, name, fn, workers, queues[i], queues[i + 1], downstream)
+    threads[0].start()
+
+    totals = dict.fromkeys(("examined", "updated", "nlp", "ann", "genai", "chunks"), 0)
+    s = get_session(write=True)
+    try:
+        pending: Dict[int, _Chunk] = {}
+        next_seq = 0
+        while True:
+            item = queues[-1].get()
+            if item is _DONE:
+                break
+            pending[item.seq] = item
+            # workers may finish out of order; commit strictly in read order
+            while next_seq in pending:
+                chunk = pending.pop(next_seq)
+                next_seq += 1
+                if graph.stop.is_set():
+                    continue  # drain
+                try:
+                    totals["updated"] += _write(s, chunk)
+                except Exception as e:
+                    s.rollback()
+                    graph.fail(e)
+                    continue
+                totals["examined"] += chunk.examined
+                totals["nlp"] += len(chunk.nlp)
+                totals["ann"] += len(chunk.refund)
+                totals["genai"] += len(chunk.drafts)
+                totals["chunks"] += 1
+                observe("stream_chunk_latency", time.perf_counter() - chunk.read_at, rows=len(chunk.rows))
+                if on_chunk is not None and on_chunk(chunk.last_id, chunk.examined) is False:
+                    graph.stop.set()
+        for t in threads:
+            t.join()
+        if graph.error is not None:
+            raise graph.error
+        for stage in ("nlp", "ann", "genai"):
+            count("claims_processed", totals[stage], stage=stage, result="updated")
+        logger.info(f"Stream: {totals}")
+        return totals
+    except Exception:
+        count("stage_errors", stage="stream")
+        raise
+    finally:
+        graph.stop.set()
+        _drain(queues[-1], threads)   # on_chunk or the writer raised: don't leave workers blocked in put()
+        s.close()
+        observe("stage_run", time.perf_counter() - t_run, rows=totals["examined"], stage="stream")
@@ -1,14 +1,151 @@
 # app/genai/summarizer.py
 from __future__ import annotations
+import asyncio
+import hashlib
 import json
-from typing import Tuple
-from openai import OpenAI
+import random
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+from openai import (
+    APIConnectionError, APITimeoutError, AsyncOpenAI, InternalServerError, OpenAI, RateLimitError,
+)
+from sqlalchemy import select, update
 from app.config import OPENAI_API_KEY, os
+from app.db.facts import refresh_claims_facts
+from app.db.migrations import ensure_schema
+from app.db.session import get_session
+from app.models.schema import Claim, Customer, Product
+from app.nlp.dedup import canonical_outputs
+from app.utils.metrics import count, observe, timer
+
+Draft = Tuple[str, str, str]  # (summary, reply, model_used)
+
+_RETRYABLE = (RateLimitError, APIConnectionError, APITimeoutError, InternalServerError)
+
+def _record_llm_call(t0: float, mode: str, outcome: str) -> None:
+    # latency per API round trip (retries are separate calls); outcome: ok | retryable | error
+    observe("llm_call", time.perf_counter() - t0, mode=mode, outcome=outcome)
 
 def _get_model() -> str:
     # allow override via .env, default to a compact, low-latency model
     return os.getenv("OPENAI_MODEL", "gpt-4o-mini")
 
+_client: Optional[OpenAI] = None
+
+def _get_client() -> OpenAI:
+    # one client (and HTTP connection pool) per process instead of one per call
+    global _client
+    if _client is None:
+        _client = OpenAI(api_key=OPENAI_API_KEY)
+    return _client
+
+# ---- Response cache ----
+CACHE_PATH = Path(__file__).resolve().parents[2] / "app" / "data" / "cache" / "genai_cache.sqlite"
+
+class ResponseCache:
+    """
+    Content-addressed cache of parsed completions, keyed on sha256(model + full prompt).
+    SQLite holds the durable copy (TTL + LRU eviction by last access); a small in-memory LRU in
+    front of it serves repeated keys without touching disk. Only real model output is cached,
+    never fallbacks.
+    """
+    def __init__(self, path: Path, ttl_s: float, max_entries: int, memory_entries: int = 1024):
+        self.ttl_s, self.max_entries, self.memory_entries = ttl_s, max_entries, memory_entries
+        self.hits = self.misses = 0
+        self._mem: "OrderedDict[str, Tuple[float, Draft]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._puts = 0
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(path), check_same_thread=False, isolation_level=None)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS genai_cache ("
+            " key TEXT PRIMARY KEY, model TEXT, summary TEXT, reply TEXT,"
+            " created_at REAL NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS ix_genai_cache_last_access ON genai_cache(last_access)")
+
+    @staticmethod
+    def key(model: str, messages: List[dict]) -> str:
+        blob = json.dumps({"model": model, "messages": messages, "temperature": 0.2}, sort_keys=True)
+        return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[Draft]:
+        now = time.time()
+        with self._lock:
+            hit = self._mem.get(key)
+            if hit is not None and now - hit[0] <= self.ttl_s:
+                self._mem.move_to_end(key)
+                self.hits += 1
+                return hit[1]
+            row = self._conn.execute(
+                "SELECT summary, reply, model, created_at FROM genai_cache WHERE key=?", (key,)
+            ).fetchone()
+            if row is None or now - row[3] > self.ttl_s:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE genai_cache SET last_access=? WHERE key=?", (now, key))
+            draft = (row[0], row[1], row[2])
+            self._remember(key, row[3], draft)
+            self.hits += 1
+            return draft
+
+    def put(self, key: str, draft: Draft) -> None:
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO genai_cache(key, model, summary, reply, created_at, last_access)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (key, draft[2], draft[0], draft[1], now, now),
+            )
+            self._remember(key, now, draft)
+            self._puts += 1
+            if self._puts % 100 == 0:
+                self._evict(now)
+
+    def _remember(self, key: str, created_at: float, draft: Draft) -> None:
+        self._mem[key] = (created_at, draft)
+        self._mem.move_to_end(key)
+        while len(self._mem) > self.memory_entries:
+            self._mem.popitem(last=False)
+
+    def _evict(self, now: float) -> None:
+        self._conn.execute("DELETE FROM genai_cache WHERE created_at < ?", (now - self.ttl_s,))
+        (n,) = self._conn.execute("SELECT COUNT(*) FROM genai_cache").fetchone()
+        if n > self.max_entries:
+            self._conn.execute(
+                "DELETE FROM genai_cache WHERE key IN"
+                " (SELECT key FROM genai_cache ORDER BY last_access ASC LIMIT ?)",
+                (n - self.max_entries,),
+            )
+
+    def evict(self) -> None:
+        with self._lock:
+            self._evict(time.time())
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            (n,) = self._conn.execute("SELECT COUNT(*) FROM genai_cache").fetchone()
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / total if total else 0.0, "entries": n}
+
+_cache: Optional[ResponseCache] = None
+
+def get_response_cache() -> ResponseCache:
+    global _cache
+    if _cache is None:
+        _cache = ResponseCache(
+            CACHE_PATH,
+            ttl_s=float(os.getenv("GENAI_CACHE_TTL_S", 30 * 24 * 3600)),
+            max_entries=int(os.getenv("GENAI_CACHE_MAX_ENTRIES", 100_000)),
+        )
+    return _cache
+
 def _extract_json(text: str) -> dict:
     """
     Try to parse a JSON blob even if it’s inside a Markdown code block.
@@ -27,29 +164,7 @@ def _extract_json(text: str) -> dict:
                 pass
         return {"summary": text.strip()[:900], "reply": ""}
 
-def draft_summary_and_reply(
-    claim_text: str,
-    customer_name: str,
-    product_name: str,
-    claim_status: str,
-) -> Tuple[str, str, str]:
-    """
-    Returns (summary, reply, model_used)
-    """
-    if not OPENAI_API_KEY:
-        # No key: deterministic, offline fallback
-        summary = f"{customer_name} reports an issue with {product_name}. Details: {claim_text[:400]}"
-        reply = (
-            f"Hi {customer_name.split(' ')[0]},\n\n"
-            "Thanks for contacting us. We’re sorry for the trouble with your item. "
-            "We’ve logged your case and will follow up shortly.\n\n"
-            "Regards,\nSupport Team"
-        )
-        return summary, reply, "offline-fallback"
-
-    client = OpenAI(api_key=OPENAI_API_KEY)
-    model = _get_model()
-
+def _build_messages(claim_text: str, customer_name: str, product_name: str, claim_status: str) -> List[dict]:
     system = (
         "You are an expert customer support assistant for e-commerce returns/claims. "
         "Read the claim text and produce a concise internal summary and a courteous customer reply. "
@@ -63,29 +178,317 @@ def draft_summary_and_reply(
         "Return a JSON object with keys exactly: summary, reply. "
         "summary = 2–4 bullet points. reply = short email (no HTML)."
     )
+    return [
+        {"role": "system", "content": system},
+        {"role": "user", "content": user},
+    ]
+
+def _parse_completion(txt: str, model: str) -> Draft:
+    data = _extract_json(txt)
+    summary = data.get("summary", "")[:3000]
+    reply = data.get("reply", "")[:3000]
+    if not summary:
+        summary = txt[:1000]
+    return summary, reply, model
+
+def _offline_fallback(claim_text: str, customer_name: str, product_name: str) -> Draft:
+    # No key: deterministic, offline fallback
+    summary = f"{customer_name} reports an issue with {product_name}. Details: {claim_text[:400]}"
+    reply = (
+        f"Hi {customer_name.split(' ')[0]},\n\n"
+        "Thanks for contacting us. We’re sorry for the trouble with your item. "
+        "We’ve logged your case and will follow up shortly.\n\n"
+        "Regards,\nSupport Team"
+    )
+    return summary, reply, "offline-fallback"
 
+def _error_fallback(claim_text: str, customer_name: str, product_name: str, e: Exception) -> Draft:
+    summary = f"(fallback) {customer_name} issue with {product_name}. Details: {claim_text[:400]}"
+    reply = (
+        f"Hi {customer_name.split(' ')[0]},\n\n"
+        "Thanks for reaching out. We’re looking into this and will update you soon.\n\n"
+        "Regards,\nSupport Team"
+    )
+    return summary, reply, f"error-fallback: {type(e).__name__}"
+
+def draft_summary_and_reply(
+    claim_text: str,
+    customer_name: str,
+    product_name: str,
+    claim_status: str,
+    use_cache: bool = True,
+) -> Tuple[str, str, str]:
+    """
+    Returns (summary, reply, model_used)
+    Identical prompts for the same model are answered from the response cache.
+    """
+    if not OPENAI_API_KEY:
+        return _offline_fallback(claim_text, customer_name, product_name)
+
+    model = _get_model()
+    messages = _build_messages(claim_text, customer_name, product_name, claim_status)
+    cache = get_response_cache() if use_cache else None
+    key = ResponseCache.key(model, messages)
+    if cache is not None:
+        cached = cache.get(key)
+        if cached is not None:
+            count("llm_cache_hits", mode="sync")
+            return cached
+
+    client = _get_client()
+    t0 = time.perf_counter()
     try:
         resp = client.chat.completions.create(
             model=model,
             temperature=0.2,
-            messages=[
-                {"role": "system", "content": system},
-                {"role": "user", "content": user},
-            ],
+            messages=messages,
         )
-        txt = resp.choices[0].message.content or ""
-        data = _extract_json(txt)
-        summary = data.get("summary", "")[:3000]
-        reply = data.get("reply", "")[:3000]
-        if not summary:
-            summary = txt[:1000]
-        return summary, reply, model
+        _record_llm_call(t0, "sync", "ok")
+        draft = _parse_completion(resp.choices[0].message.content or "", model)
+        if cache is not None:
+            cache.put(key, draft)
+        return draft
     except Exception as e:
         # Robust fallback
-        summary = f"(fallback) {customer_name} issue with {product_name}. Details: {claim_text[:400]}"
-        reply = (
-            f"Hi {customer_name.split(' ')[0]},\n\n"
-            "Thanks for reaching out. We’re looking into this and will update you soon.\n\n"
-            "Regards,\nSupport Team"
-        )
-        return summary, reply, f"error-fallback: {type(e).__name__}"
+        _record_llm_call(t0, "sync", "error")
+        return _error_fallback(claim_text, customer_name, product_name, e)
+
+# ---- Async batch drafting ----
+class _RateLimiter:
+    """Token buckets for requests/minute and tokens/minute, refilled continuously."""
+    def __init__(self, rpm: Optional[int], tpm: Optional[int]):
+        self.rpm, self.tpm = rpm, tpm
+        self._req = float(rpm or 0)
+        self._tok = float(tpm or 0)
+        self._t = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        dt, self._t = now - self._t, now
+        if self.rpm:
+            self._req = min(float(self.rpm), self._req + dt * self.rpm / 60.0)
+        if self.tpm:
+            self._tok = min(float(self.tpm), self._tok + dt * self.tpm / 60.0)
+
+    async def acquire(self, tokens: int) -> None:
+        async with self._lock:  # serialize waiters so budget is handed out in arrival order
+            if self.tpm:
+                tokens = min(tokens, self.tpm)
+            while True:
+                self._refill()
+                wait = 0.0
+                if self.rpm and self._req < 1:
+                    wait = max(wait, (1 - self._req) * 60.0 / self.rpm)
+                if self.tpm and self._tok < tokens:
+                    wait = max(wait, (tokens - self._tok) * 60.0 / self.tpm)
+                if wait <= 0:
+                    break
+                await asyncio.sleep(wait)
+            if self.rpm:
+                self._req -= 1
+            if self.tpm:
+                self._tok -= tokens
+
+def _estimate_tokens(messages: List[dict], max_completion: int = 400) -> int:
+    # ~4 chars/token is close enough for budgeting; completion budget reserved up front
+    return sum(len(m["content"]) for m in messages) // 4 + max_completion
+
+async def _draft_one_async(
+    client: AsyncOpenAI,
+    model: str,
+    limiter: _RateLimiter,
+    sem: asyncio.Semaphore,
+    item: Dict[str, str],
+    max_retries: int,
+    backoff_base: float,
+    cache: Optional[ResponseCache],
+) -> Draft:
+    messages = _build_messages(item["claim_text"], item["customer_name"], item["product_name"], item["claim_status"])
+    key = ResponseCache.key(model, messages)
+    if cache is not None:
+        cached = cache.get(key)
+        if cached is not None:
+            count("llm_cache_hits", mode="async")
+            return cached
+    async with sem:
+        for attempt in range(max_retries + 1):
+            t0 = time.perf_counter()
+            try:
+                with timer("llm_rate_limit_wait"):
+                    await limiter.acquire(_estimate_tokens(messages))
+                t0 = time.perf_counter()
+                resp = await client.chat.completions.create(model=model, temperature=0.2, messages=messages)
+                _record_llm_call(t0, "async", "ok")
+                draft = _parse_completion(resp.choices[0].message.content or "", model)
+                if cache is not None:
+                    cache.put(key, draft)
+                return draft
+            except _RETRYABLE as e:
+                _record_llm_call(t0, "async", "retryable")
+                if attempt == max_retries:
+                    return _error_fallback(item["claim_text"], item["customer_name"], item["product_name"], e)
+                # exponential backoff with full jitter, capped
+                await asyncio.sleep(random.uniform(0, min(30.0, backoff_base * (2 ** attempt))))
+            except Exception as e:
+                _record_llm_call(t0, "async", "error")
+                return _error_fallback(item["claim_text"], item["customer_name"], item["product_name"], e)
+
+async def draft_many_async(
+    items: Sequence[Dict[str, str]],
+    concurrency: int = 8,
+    rpm: Optional[int] = 500,
+    tpm: Optional[int] = 200_000,
+    max_retries: int = 4,
+    backoff_base: float = 0.5,
+    client: Optional[AsyncOpenAI] = None,
+    use_cache: bool = True,
+) -> List[Draft]:
+    """
+    Draft (summary, reply, model_used) for many claims concurrently over one shared client.
+    `items` hold the draft_summary_and_reply keyword arguments. At most `concurrency` requests
+    are in flight, bounded by `rpm`/`tpm` (None disables a limit); retryable API errors back off
+    exponentially, and any claim that still fails gets the usual error fallback. Results keep input order.
+    A caller-supplied `client` should be built with max_retries=0 so this is the only retry layer.
+    Prompts already in the response cache are answered without a request.
+    """
+    if client is None and not OPENAI_API_KEY:
+        return [_offline_fallback(i["claim_text"], i["customer_name"], i["product_name"]) for i in items]
+
+    own_client = client is None
+    # SDK retries off: they would bypass the limiter and stack on the backoff in _draft_one_async
+    client = client or AsyncOpenAI(api_key=OPENAI_API_KEY, max_retries=0)
+    limiter = _RateLimiter(rpm, tpm)
+    sem = asyncio.Semaphore(max(1, concurrency))
+    model = _get_model()
+    cache = get_response_cache() if use_cache else None
+    try:
+        return list(await asyncio.gather(*(
+            _draft_one_async(client, model, limiter, sem, item, max_retries, backoff_base, cache) for item in items
+        )))
+    finally:
+        if own_client:
+            await client.close()
+
+def _name_pattern(name: str) -> re.Pattern:
+    return re.compile(r"(?<!\w)" + re.escape(name) + r"(?!\w)")
+
+def _reuse_draft(canon: Tuple, customer_name: str, product_id: int, status: str) -> Optional[Draft]:
+    """
+    Adapt the canonical claim's draft to a near-duplicate: only real model output for the same
+    product and status, with the canonical customer's full name swapped (whole words only) for
+    this customer's. If any part of the old name is still left (e.g. "Hi Sam,"), the draft is
+    not reused, so one customer's name never reaches another's reply.
+    """
+    summary, reply, model, canon_product, canon_status, canon_customer = canon
+    if not summary or not model or "fallback" in model or (canon_product, canon_status) != (product_id, status):
+        return None
+    old, new = (canon_customer or "").strip(), (customer_name or "").strip()
+    if old == new:
+        return summary, reply, model
+    texts = [summary, reply or ""]
+    if old:
+        texts = [_name_pattern(old).sub(lambda _: new, t) for t in texts]
+        leftovers = [_name_pattern(part) for part in old.split() if part not in new.split()]
+        if any(p.search(t) for p in leftovers for t in texts):
+            return None
+    return texts[0], texts[1], model
+
+# (claim id, description, status, customer name, product name, product id)
+DraftRow = Tuple[int, Optional[str], str, str, str, int]
+
+def reuse_drafts(conn, rows: Sequence[DraftRow], canonical_of: Dict[int, int]) -> Dict[int, Draft]:
+    """Drafts of rows whose canonical claim ({claim id: canonical id}) already has one that fits, see _reuse_draft."""
+    canon = canonical_outputs(
+        conn, canonical_of,
+        [Claim.ai_summary, Claim.ai_reply, Claim.ai_model, Claim.product_id, Claim.status,
+         select(Customer.name).where(Customer.id == Claim.customer_id).scalar_subquery()],
+    ) if canonical_of else {}
+    reused: Dict[int, Draft] = {}
+    for cid, _, status, cust, _, product_id in rows:
+        draft = _reuse_draft(canon[cid], cust, product_id, status) if cid in canon else None
+        if draft is not None:
+            reused[cid] = draft
+    if reused:
+        count("dedup_reused", len(reused), stage="genai")
+    return reused
+
+def draft_rows(rows: Sequence[DraftRow], reused: Dict[int, Draft], concurrency: int = 8, **limits) -> List[Draft]:
+    """Drafts for `rows` in order: reused ones as given, the rest drafted concurrently (no database access)."""
+    todo = [r for r in rows if r[0] not in reused]
+    items = [
+        {"claim_text": desc or "", "customer_name": cust, "product_name": prod, "claim_status": status}
+        for _, desc, status, cust, prod, _ in todo
+    ]
+    with timer("genai_draft_batch", rows=len(items)):
+        drafted = asyncio.run(draft_many_async(items, concurrency=concurrency, **limits)) if items else []
+    by_id = {**reused, **{r[0]: d for r, d in zip(todo, drafted)}}
+    return [by_id[r[0]] for r in rows]
+
+def run_genai_on_claims(
+    only_missing: bool = True,
+    chunk_size: int = 200,
+    concurrency: int = 8,
+    claim_ids: Optional[Sequence[int]] = None,
+    start_after: int = 0,
+    on_chunk: Optional[Callable[[int, int], bool]] = None,
+    **limits,
+) -> int:
+    """
+    Drafts summaries/replies for all claims (or only those without ai_summary, or just `claim_ids`),
+    chunk by chunk: each chunk is drafted concurrently and written back with one bulk UPDATE + commit.
+    Near-duplicates of an already drafted claim (claims.duplicate_of) reuse its draft, see _reuse_draft.
+    Resumes after claim id `start_after`; on_chunk(last_id, rows) returning False stops the run.
+    Extra keyword arguments (rpm, tpm, max_retries, ...) go to draft_many_async.
+    """
+    ensure_schema()
+    t_run = time.perf_counter()
+    updated = 0
+    rs = get_session()
+    s = get_session(write=True)  # write lock only around each chunk's UPDATE, never across LLM calls
+    try:
+        last_id = start_after
+        while True:
+            stmt = (
+                select(Claim.id, Claim.description, Claim.status, Customer.name, Product.name,
+                       Claim.product_id, Claim.duplicate_of)
+                .join(Customer, Customer.id == Claim.customer_id)
+                .join(Product, Product.id == Claim.product_id)
+                .where(Claim.id > last_id)
+                .order_by(Claim.id)
+                .limit(chunk_size)
+            )
+            if only_missing:
+                stmt = stmt.where(Claim.ai_summary.is_(None))
+            if claim_ids is not None:
+                stmt = stmt.where(Claim.id.in_(list(claim_ids)))
+            with timer("db_read", stage="genai") as t:
+                rows = rs.execute(stmt).all()
+                t.rows = len(rows)
+                reused = reuse_drafts(rs, [r[:6] for r in rows], {r[0]: r[6] for r in rows if r[6] is not None})
+                rs.rollback()
+            if not rows:
+                break
+            last_id = rows[-1][0]
+            drafts = draft_rows([r[:6] for r in rows], reused, concurrency=concurrency, **limits)
+            now = datetime.utcnow()
+            with timer("db_write", stage="genai", rows=len(rows)):
+                s.execute(update(Claim), [
+                    {"id": r[0], "ai_summary": summary, "ai_reply": reply, "ai_model": model, "updated_at": now}
+                    for r, (summary, reply, model) in zip(rows, drafts)
+                ])
+                refresh_claims_facts(s, [r[0] for r in rows])
+                s.commit()
+            updated += len(rows)
+            if on_chunk is not None and on_chunk(last_id, len(rows)) is False:
+                break
+        count("claims_processed", updated, stage="genai", result="updated")
+        return updated
+    except Exception:
+        s.rollback()
+        count("stage_errors", stage="genai")
+        raise
+    finally:
+        rs.close()
+        s.close()
+        observe("stage_run", time.perf_counter() - t_run, rows=updated, stage="genai")
@@ -0,0 +1,39 @@
+from sqlalchemy import create_engine, insert, select, update
+
+from app.db.base import Base
+from app.models.schema import Claim, ClaimMinHash, Customer, Product
+from app.nlp.dedup import DEFAULT_THRESHOLD, band_buckets, match, persist, signature, similarity
+
+BASE = "The blender arrived with a cracked jar and the motor makes a grinding noise when started."
+
+def test_near_duplicates_score_high_and_share_a_bucket():
+    a, b = signature(BASE), signature(BASE.replace("grinding", "grinding,") + " ")
+    other = signature("Wrong size shoes were delivered; I ordered a 9 and received an 11.")
+    assert similarity(a, b) >= DEFAULT_THRESHOLD
+    assert set(band_buckets(a)) & set(band_buckets(b))
+    assert similarity(a, other) < 0.2
+    assert signature("") is None and signature("  ...  ") is None
+
+def test_editing_a_canonical_claim_unlinks_its_duplicates():
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(insert(Customer), [{"id": 1, "name": "Alex", "email": "alex@example.com"}])
+        conn.execute(insert(Product), [{"id": 1, "sku": "BL-1", "name": "Blender"}])
+        conn.execute(insert(Claim), [
+            {"id": i, "customer_id": 1, "product_id": 1, "description": d}
+            for i, d in ((1, BASE), (2, BASE + "!"), (3, BASE.upper()))
+        ])
+        persist(conn, match(conn, [(1, BASE), (2, BASE + "!"), (3, BASE.upper())]))
+        dup_of = lambda: dict(conn.execute(select(Claim.id, Claim.duplicate_of)).all())
+        assert dup_of() == {1: None, 2: 1, 3: 1}
+
+        edited = "Wrong size shoes were delivered; I ordered a 9 and received an 11."
+        conn.execute(update(Claim).where(Claim.id == 1).values(description=edited))
+        persist(conn, match(conn, [(1, edited)]))
+        assert dup_of() == {1: None, 2: None, 3: None}
+        assert set(conn.execute(select(ClaimMinHash.claim_id)).scalars()) == {1}
+
+        # the next pass re-resolves them against the current index
+        persist(conn, match(conn, [(2, BASE + "!"), (3, BASE.upper())]))
+        assert dup_of() == {1: None, 2: None, 3: 2}
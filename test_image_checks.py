@@ -0,0 +1,37 @@
+from io import BytesIO
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from app.cnn.image_checks import ANALYSIS_SIDE, analyze_image
+
+def _photo(w: int = 4000, h: int = 3000, seed: int = 0) -> Image.Image:
+    rng = np.random.default_rng(seed)
+    img = cv2.resize((rng.random((30, 40, 3)) * 255).astype("uint8"), (w, h), interpolation=cv2.INTER_CUBIC)
+    for _ in range(60):
+        p, q = rng.integers(0, [w, h]), rng.integers(0, [w, h])
+        color = tuple(int(c) for c in rng.integers(0, 255, 3))
+        cv2.line(img, tuple(map(int, p)), tuple(map(int, q)), color, int(rng.integers(4, 30)))
+    return Image.fromarray(img)
+
+def _jpeg(img: Image.Image) -> bytes:
+    buf = BytesIO()
+    img.save(buf, "JPEG", quality=90)
+    return buf.getvalue()
+
+def test_reduced_decode_matches_full_decode():
+    data = _jpeg(_photo())
+    full, reduced = analyze_image(data, reduced=False), analyze_image(data)
+    assert (full["analysis_width"], full["analysis_height"]) == (ANALYSIS_SIDE, 768)
+    assert (reduced["analysis_width"], reduced["analysis_height"]) == (ANALYSIS_SIDE, 768)
+    assert abs(full["damage_score"] - reduced["damage_score"]) < 0.01
+    assert abs(full["blur"] - reduced["blur"]) < 0.05 * full["blur"]
+    assert abs(full["edge_density"] - reduced["edge_density"]) < 0.002
+
+def test_scores_are_comparable_across_resolutions():
+    big = _photo()
+    scores = [analyze_image(_jpeg(big.resize((w, h), Image.LANCZOS)))
+              for w, h in ((4000, 3000), (2000, 1500), (800, 600))]
+    assert {(r["analysis_width"], r["analysis_height"]) for r in scores} == {(ANALYSIS_SIDE, 768)}
+    assert max(r["damage_score"] for r in scores) - min(r["damage_score"] for r in scores) < 0.05
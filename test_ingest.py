@@ -0,0 +1,23 @@
+from datetime import datetime
+
+import pytest
+
+from app.db.ingest import validate
+
+def test_validate_normalizes_and_defaults():
+    rec = validate({"description": " Screen cracked ", "customer_email": "Ann@X.com", "product_sku": "SKU-1",
+                    "product_price": "19.99", "created_at": "2024-05-01T12:00:00+02:00"})
+    assert rec["description"] == "Screen cracked" and rec["customer_email"] == "ann@x.com"
+    assert rec["customer_name"] == "ann" and rec["product_name"] == "SKU-1" and rec["status"] == "new"
+    assert rec["product_price"] == 19.99 and rec["created_at"] == datetime(2024, 5, 1, 10, 0)
+
+@pytest.mark.parametrize("rec, error", [
+    ("{broken", "not a JSON object"),
+    ({"customer_email": "a@x", "product_sku": "S"}, "description"),
+    ({"description": "d", "customer_email": "nope", "product_sku": "S"}, "customer_email"),
+    ({"description": "d", "customer_email": "a@x", "product_sku": "S", "product_price": "-1"}, "negative"),
+    ({"description": "d", "customer_email": "a@x", "product_sku": "S", "created_at": "yesterday"}, "created_at"),
+])
+def test_validate_rejects(rec, error):
+    with pytest.raises(ValueError, match=error):
+        validate(rec)
@@ -0,0 +1,44 @@
+from app.utils.metrics import Registry, merge, quantile, summary_rows, to_prometheus
+
+def test_timer_histogram_and_rows_per_sec():
+    reg = Registry(persist=False)
+    for ms in (2, 4, 8, 40, 900):
+        reg.observe("db_write", ms / 1000, rows=100, stage="nlp")
+    with reg.timer("db_write", stage="nlp") as t:
+        t.rows = 500
+    h = reg.snapshot()["timers"]['db_write{stage="nlp"}']
+    assert h["count"] == 6 and h["rows"] == 1000 and sum(h["buckets"]) == 6
+    assert h["min"] <= quantile(h, 0.5) <= 0.01 and 0.5 <= quantile(h, 0.99) <= 0.9
+    row = summary_rows(reg.snapshot())[0]
+    assert row["labels"] == "stage=nlp" and row["rows_per_sec"] == round(1000 / h["sum"], 1)
+
+def test_merge_across_processes_and_prometheus_text():
+    a, b = Registry(persist=False), Registry(persist=False)
+    a.observe("llm_call", 0.2, mode="async", outcome="ok")
+    b.observe("llm_call", 0.4, mode="async", outcome="ok")
+    b.count("jobs_finished", stage="nlp", status="done")
+    snap = merge([a.snapshot(), b.snapshot()])
+    h = snap["timers"]['llm_call{mode="async",outcome="ok"}']
+    assert (h["count"], round(h["sum"], 3), h["min"], h["max"]) == (2, 0.6, 0.2, 0.4)
+    text = to_prometheus(snap)
+    assert '# TYPE claims_hub_llm_call_seconds histogram' in text
+    assert 'claims_hub_llm_call_seconds_bucket{mode="async",outcome="ok",le="+Inf"} 2' in text
+    assert 'claims_hub_jobs_finished_total{stage="nlp",status="done"} 1' in text
+
+def test_collect_folds_exited_processes_into_archive(tmp_path, monkeypatch):
+    import json
+    import os
+    import subprocess
+    import sys
+    from app.utils import metrics
+    monkeypatch.setattr(metrics, "METRICS_DIR", tmp_path)
+    proc = subprocess.Popen([sys.executable, "-c", "pass"])
+    proc.wait()
+    for pid, n in ((proc.pid, 2), (os.getpid(), 3)):
+        reg = Registry(persist=False)
+        reg.count("jobs_finished", n, stage="nlp")
+        (tmp_path / f"{pid}-1.json").write_text(json.dumps({"pid": pid, **reg.snapshot()}))
+    for _ in range(2):
+        snap = metrics.collect(include_self=False)
+        assert snap["counters"]['jobs_finished{stage="nlp"}']["value"] == 5
+    assert sorted(p.name for p in tmp_path.glob("*.json")) == [f"{os.getpid()}-1.json", metrics.ARCHIVE_NAME]
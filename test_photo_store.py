@@ -0,0 +1,26 @@
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+
+from app.cnn.photo_store import PHASH_MAX_DISTANCE, dhash, hamming, store_upload
+
+def _jpeg(img: Image.Image, quality: int) -> bytes:
+    buf = BytesIO()
+    img.save(buf, "JPEG", quality=quality)
+    return buf.getvalue()
+
+def test_store_is_content_addressed(tmp_path):
+    data = _jpeg(Image.new("RGB", (64, 48), (200, 30, 30)), 90)
+    sha, path, new = store_upload(BytesIO(data), root=tmp_path)
+    sha2, path2, new2 = store_upload(data, root=tmp_path)
+    assert (sha, path) == (sha2, path2) and new and not new2
+    assert path.read_bytes() == data and list((tmp_path / "tmp").iterdir()) == []
+
+def test_dhash_ignores_recompression_but_not_new_content():
+    rng = np.random.default_rng(0)
+    base = Image.fromarray((rng.random((60, 80, 3)) * 255).astype("uint8")).resize((640, 480), Image.BILINEAR)
+    again = Image.open(BytesIO(_jpeg(base.resize((320, 240)), 60)))
+    other = base.transpose(Image.FLIP_LEFT_RIGHT)
+    assert hamming(dhash(base), dhash(again)) <= PHASH_MAX_DISTANCE
+    assert hamming(dhash(base), dhash(other)) > PHASH_MAX_DISTANCE
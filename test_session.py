@@ -0,0 +1,70 @@
+import threading
+import time
+
+from sqlalchemy import text
+
+from app.db.session import create_sqlite_engine
+
+def _engines(tmp_path):
+    url = f"sqlite:///{tmp_path / 'claims.db'}"
+    reader, writer = create_sqlite_engine(url), create_sqlite_engine(url, writer=True)
+    with writer.begin() as conn:
+        conn.execute(text("CREATE TABLE claims (id INTEGER PRIMARY KEY, description TEXT)"))
+        conn.execute(text("INSERT INTO claims(description) VALUES ('seed')"))
+    return reader, writer
+
+def test_wal_profile_applied(tmp_path):
+    reader, _ = _engines(tmp_path)
+    with reader.connect() as conn:
+        assert conn.execute(text("PRAGMA journal_mode")).scalar() == "wal"
+        assert conn.execute(text("PRAGMA busy_timeout")).scalar() == 30_000
+
+def test_readers_not_stalled_by_running_pipeline_write(tmp_path):
+    reader, writer = _engines(tmp_path)
+    in_txn, release = threading.Event(), threading.Event()
+
+    def pipeline_write():
+        with writer.begin() as conn:  # BEGIN IMMEDIATE: holds the write lock until commit
+            conn.execute(text("INSERT INTO claims(description) VALUES (:d)"), [{"d": f"row {i}"} for i in range(20_000)])
+            in_txn.set()
+            release.wait(5)
+
+    t = threading.Thread(target=pipeline_write)
+    t.start()
+    assert in_txn.wait(5)
+    try:
+        latencies = []
+        for _ in range(20):
+            t0 = time.perf_counter()
+            with reader.connect() as conn:
+                n = conn.execute(text("SELECT COUNT(*) FROM claims")).scalar()
+            latencies.append(time.perf_counter() - t0)
+            assert n == 1  # readers see the last committed snapshot, not the in-flight chunk
+        assert max(latencies) < 0.5
+    finally:
+        release.set()
+        t.join()
+    with reader.connect() as conn:
+        assert conn.execute(text("SELECT COUNT(*) FROM claims")).scalar() == 20_001
+
+def test_second_writer_waits_instead_of_database_locked(tmp_path):
+    _, writer = _engines(tmp_path)
+    other = create_sqlite_engine(f"sqlite:///{tmp_path / 'claims.db'}", writer=True)  # e.g. another process
+    holding = threading.Event()
+
+    def long_commit():
+        with writer.begin() as conn:
+            conn.execute(text("INSERT INTO claims(description) VALUES ('first')"))
+            holding.set()
+            time.sleep(0.5)
+
+    t = threading.Thread(target=long_commit)
+    t.start()
+    assert holding.wait(5)
+    t0 = time.perf_counter()
+    with other.begin() as conn:  # blocks on busy_timeout rather than raising OperationalError
+        conn.execute(text("INSERT INTO claims(description) VALUES ('second')"))
+    t.join()
+    assert time.perf_counter() - t0 > 0.2
+    with other.connect() as conn:
+        assert conn.execute(text("SELECT COUNT(*) FROM claims")).scalar() == 3
@@ -0,0 +1,100 @@
+import asyncio
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from openai import AsyncOpenAI
+
+from app.genai.summarizer import ResponseCache, draft_many_async
+
+class _StubChatCompletions(BaseHTTPRequestHandler):
+    """Mimics POST /v1/chat/completions; 'flaky' claims get one 429 first, 'broken' ones always 500."""
+    seen = {}
+    lock = threading.Lock()
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        prompt = body["messages"][-1]["content"]
+        with self.lock:
+            n = self.seen[prompt] = self.seen.get(prompt, 0) + 1
+        if "broken" in prompt or ("flaky" in prompt and n == 1):
+            status, payload = (500 if "broken" in prompt else 429), {"error": {"message": "stub", "type": "stub"}}
+        else:
+            content = json.dumps({"summary": "- " + prompt.split("Claim Text:\n")[1].split("\n")[0], "reply": "Hi"})
+            status, payload = 200, {
+                "id": "stub", "object": "chat.completion", "created": 0, "model": body["model"],
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": content}}],
+            }
+        raw = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(raw)))
+        self.end_headers()
+        self.wfile.write(raw)
+
+    def log_message(self, *args):
+        pass
+
+def _item(text):
+    return {"claim_text": text, "customer_name": "Ana Diaz", "product_name": "Headphones", "claim_status": "new"}
+
+def test_draft_many_async_against_stub_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _StubChatCompletions)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    texts = [f"claim {i}" for i in range(20)] + ["flaky claim", "broken claim"]
+
+    async def run():
+        # SDK-level retries off so draft_many_async's own backoff is what gets exercised
+        client = AsyncOpenAI(api_key="stub", base_url=f"http://127.0.0.1:{server.server_port}/v1", max_retries=0)
+        try:
+            return await draft_many_async(
+                [_item(t) for t in texts], concurrency=4, max_retries=2, backoff_base=0.01, client=client,
+                use_cache=False,
+            )
+        finally:
+            await client.close()
+
+    try:
+        drafts = asyncio.run(run())
+    finally:
+        server.shutdown()
+
+    assert len(drafts) == len(texts)
+    for text, (summary, reply, model) in zip(texts[:-1], drafts[:-1]):
+        assert summary == f"- {text}" and reply == "Hi" and not model.startswith("error-fallback")
+    assert drafts[-1][2] == "error-fallback: InternalServerError"
+    seen = _StubChatCompletions.seen
+    assert next(n for p, n in seen.items() if "flaky claim" in p) == 2   # one 429, then success
+    assert next(n for p, n in seen.items() if "broken claim" in p) == 3  # 1 try + 2 retries
+
+def test_response_cache_ttl_and_lru(tmp_path):
+    cache = ResponseCache(tmp_path / "cache.sqlite", ttl_s=3600, max_entries=2, memory_entries=1)
+    msgs = lambda t: [{"role": "user", "content": t}]
+    k1, k2, k3 = (ResponseCache.key("m", msgs(t)) for t in ("a", "b", "c"))
+    assert k1 != ResponseCache.key("other-model", msgs("a"))
+
+    assert cache.get(k1) is None
+    cache.put(k1, ("s1", "r1", "m"))
+    cache.put(k2, ("s2", "r2", "m"))
+    assert cache.get(k1) == ("s1", "r1", "m")  # from SQLite: memory tier only holds k2
+    cache.put(k3, ("s3", "r3", "m"))
+    cache.evict()                                # k2 is least recently used
+    assert cache.stats()["entries"] == 2
+    cache._mem.clear()
+    assert cache.get(k2) is None and cache.get(k1) is not None and cache.get(k3) is not None
+
+    cache.ttl_s = -1                             # everything expired
+    assert cache.get(k3) is None
+    assert cache.stats()["hits"] == 3 and cache.stats()["misses"] == 3
+
+def test_reuse_draft_swaps_whole_names_only():
+    from app.genai.summarizer import _reuse_draft
+    canon = ("- Al Stone reports Samsung case cracked. Also asks for refund.",
+             "Hello Al Stone, sorry about the Samsung case.", "gpt-4o-mini", 3, "new", "Al Stone")
+    summary, reply, _ = _reuse_draft(canon, "Bea Kim", 3, "new")
+    assert summary == "- Bea Kim reports Samsung case cracked. Also asks for refund."
+    assert reply == "Hello Bea Kim, sorry about the Samsung case."
+    # a first-name-only greeting can't be swapped safely: redraft instead of leaking "Al"
+    assert _reuse_draft((canon[0], "Hi Al, we are on it.", *canon[2:]), "Bea Kim", 3, "new") is None
+    assert _reuse_draft(canon, "Bea Kim", 4, "new") is None
@@ -1,11 +1,36 @@
 # app/nlp/text_models.py
 from __future__ import annotations
-from typing import List, Tuple
+import atexit
+import hashlib
+import json
+import multiprocessing
+import os
+import re
+import threading
+import time
+from bisect import bisect_right
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Dict, FrozenSet, Iterable, List, Optional, Tuple
 import numpy as np
+from joblib import dump, load
 from sklearn.feature_extraction.text import TfidfVectorizer
 from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
+from app.utils.metrics import count
 
-_analyzer = SentimentIntensityAnalyzer()
+_analyzer: Optional[SentimentIntensityAnalyzer] = None
+
+def _get_analyzer() -> SentimentIntensityAnalyzer:
+    # built on first use: loading the VADER lexicon is the costly part of importing this module
+    global _analyzer
+    if _analyzer is None:
+        _analyzer = SentimentIntensityAnalyzer()
+    return _analyzer
+
+MODELS_DIR = Path(__file__).resolve().parents[2] / "app" / "data" / "models"
+TFIDF_PATH = MODELS_DIR / "keyphrase_tfidf.joblib"
+TFIDF_MAX_AGE_S = 7 * 24 * 3600  # weekly refit; in between new claims are transform-only
 
 CATEGORIES = {
     "Audio Issue":    ["crackle", "anc", "noise", "sound", "mic", "earcup", "left side"],
@@ -16,39 +41,268 @@ CATEGORIES = {
     "Size/Fit":       ["size", "fit", "too large", "too small", "tight", "loose"],
 }
 
+# Stamp written next to NLP outputs; bump the prefix when classifier/sentiment/keyphrase logic changes.
+# Editing CATEGORIES changes the digest, so keyword-table edits invalidate stored labels automatically.
+NLP_VERSION = "nlp-1:" + hashlib.sha1(json.dumps(CATEGORIES, sort_keys=True).encode()).hexdigest()[:10]
+
 def _norm(s: str) -> str:
     return (s or "").lower()
 
+def _trie_regex(words: List[str]) -> str:
+    """Regex alternation built from a prefix trie (one branch per shared prefix, longest match first)."""
+    trie: Dict[str, dict] = {}
+    for w in words:
+        node = trie
+        for ch in w:
+            node = node.setdefault(ch, {})
+        node[""] = {}  # end-of-word marker
+
+    def _render(node: dict) -> str:
+        alts = [re.escape(ch) + _render(child) for ch, child in sorted(node.items()) if ch]
+        if not alts:
+            return ""
+        body = alts[0] if len(alts) == 1 else "(?:" + "|".join(alts) + ")"
+        if "" in node:
+            # a keyword ends here but longer ones continue: prefer the longer (greedy)
+            return "(?:" + body + ")?"
+        return body
+
+    return _render(trie)
+
+class _KeywordMatcher:
+    """
+    CATEGORIES compiled once into a single trie-shaped regex.
+    A zero-width lookahead reports the longest keyword starting at every position; all shorter
+    keywords starting there are prefixes of it, so overlapping hits are recovered from a
+    precomputed prefix table. Scores match the per-keyword substring vote exactly.
+    """
+    def __init__(self, categories: Dict[str, List[str]]):
+        self.labels = list(categories)
+        kws = sorted({_norm(k) for ks in categories.values() for k in ks if k})
+        self.pattern = re.compile("(?=(" + _trie_regex(kws) + "))") if kws else None
+        kw_labels: Dict[str, List[int]] = {k: [] for k in kws}
+        for li, label in enumerate(self.labels):
+            for k in {_norm(k) for k in categories[label] if k}:
+                kw_labels[k].append(li)
+        # keyword -> every keyword that is a prefix of it (itself included)
+        self.prefixes: Dict[str, FrozenSet[str]] = {
+            k: frozenset(p for p in kws if k.startswith(p)) for k in kws
+        }
+        self.kw_labels = {k: tuple(v) for k, v in kw_labels.items()}
+
+    def _decide(self, hits: set) -> Tuple[str, float]:
+        scores = [0] * len(self.labels)
+        for kw in hits:
+            for li in self.kw_labels[kw]:
+                scores[li] += 1
+        best_label, best_score = "Other", 0
+        for label, score in zip(self.labels, scores):
+            if score > best_score:
+                best_label, best_score = label, score
+        conf = (0.4 + 0.2 * best_score) if best_score > 0 else 0.3
+        return best_label, float(min(conf, 1.0))
+
+    def classify(self, text: str) -> Tuple[str, float]:
+        hits: set = set()
+        if self.pattern is not None:
+            for m in self.pattern.finditer(_norm(text)):
+                hits |= self.prefixes[m.group(1)]
+        return self._decide(hits)
+
+    def classify_many(self, texts: List[str]) -> List[Tuple[str, float]]:
+        # One scan over the whole batch; NUL never occurs in a keyword, so no match spans two docs.
+        docs = [_norm(t) for t in texts]
+        starts, pos = [], 0
+        for d in docs:
+            starts.append(pos)
+            pos += len(d) + 1
+        hits: List[set] = [set() for _ in docs]
+        if self.pattern is not None and docs:
+            for m in self.pattern.finditer("\0".join(docs)):
+                hits[bisect_right(starts, m.start()) - 1] |= self.prefixes[m.group(1)]
+        return [self._decide(h) for h in hits]
+
+_matcher = _KeywordMatcher(CATEGORIES)
+
 def classify_issue(text: str) -> Tuple[str, float]:
     """Simple keyword vote classifier -> (label, confidence)."""
-    t = _norm(text)
-    best_label, best_score = "Other", 0
-    for label, kws in CATEGORIES.items():
-        score = sum(1 for kw in kws if kw in t)
-        if score > best_score:
-            best_label, best_score = label, score
-    conf = (0.4 + 0.2 * best_score) if best_score > 0 else 0.3
-    return best_label, float(min(conf, 1.0))
+    return _matcher.classify(text)
+
+def classify_issues(texts: List[str]) -> List[Tuple[str, float]]:
+    """Batch version of classify_issue: one regex pass over all texts, same (label, confidence) tuples."""
+    return _matcher.classify_many(texts)
 
 def sentiment_compound(text: str) -> float:
     if not text:
         return 0.0
-    return float(_analyzer.polarity_scores(text)["compound"])
+    return float(_get_analyzer().polarity_scores(text)["compound"])
+
+# ---- Batch sentiment (dedup + memo + process pool) ----
+SENTIMENT_CACHE_SIZE = 200_000   # scores kept in the per-process LRU
+SENTIMENT_PARALLEL_MIN = 500     # fewer unique uncached texts than this are scored in-process
+_WS = re.compile(r"\s+")
+_sent_cache: "OrderedDict[bytes, float]" = OrderedDict()
+_sent_lock = threading.Lock()
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_workers = 0
+_pool_lock = threading.Lock()
+# never fork: callers (Streamlit, the stream graph's NLP threads) are multi-threaded, and a fork taken while
+# another thread holds a lock (logging, the SQLAlchemy pool, _sent_lock) can deadlock the child
+_MP_CONTEXT = multiprocessing.get_context(
+    "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+)
+if _MP_CONTEXT.get_start_method() == "forkserver":
+    # the (single-threaded) fork server imports this module once; workers fork from it warm
+    _MP_CONTEXT.set_forkserver_preload([__name__])
+
+def _sentiment_key(text: str) -> Tuple[str, bytes]:
+    # VADER tokenizes on whitespace, so collapsing runs of it never changes the score;
+    # case and punctuation carry sentiment and are kept.
+    norm = _WS.sub(" ", text or "").strip()
+    return norm, hashlib.blake2b(norm.encode("utf-8"), digest_size=16).digest()
 
-def extract_keywords_tfidf(docs: List[str], top_k: int = 5) -> List[List[str]]:
-    """Top TF-IDF unigrams/bigrams per doc."""
-    corpus = [_norm(d) for d in docs]
+def _init_sentiment_worker() -> None:
+    _get_analyzer()  # one lexicon load per worker, reused for every shard it scores
+
+def _score_shard(texts: List[str]) -> List[float]:
+    return [sentiment_compound(t) for t in texts]
+
+def _get_pool(workers: int) -> ProcessPoolExecutor:
+    global _pool, _pool_workers
+    with _pool_lock:
+        if _pool is None or _pool_workers != workers:
+            if _pool is not None:
+                _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = ProcessPoolExecutor(
+                max_workers=workers, mp_context=_MP_CONTEXT, initializer=_init_sentiment_worker,
+            )
+            _pool_workers = workers
+        return _pool
+
+@atexit.register
+def _shutdown_pool() -> None:
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+
+def sentiment_compounds(texts: Iterable[str], workers: Optional[int] = None) -> List[float]:
+    """
+    Batch sentiment_compound with identical results. Texts are deduplicated (whitespace-normalized),
+    answered from a bounded LRU keyed by text hash where possible, and the remaining unique texts
+    are sharded across a reusable process pool (one VADER analyzer per worker) when there are at
+    least SENTIMENT_PARALLEL_MIN of them. `workers` defaults to the CPU count; 1 disables the pool.
+    """
+    keys: List[bytes] = []
+    todo: Dict[bytes, str] = {}
+    out: Dict[bytes, float] = {}
+    with _sent_lock:
+        for t in texts:
+            norm, k = _sentiment_key(t)
+            keys.append(k)
+            if k in out or k in todo:
+                continue
+            hit = _sent_cache.get(k)
+            if hit is not None:
+                _sent_cache.move_to_end(k)
+                out[k] = hit
+            else:
+                todo[k] = norm
+
+    count("sentiment_texts", len(keys), result="input")
+    count("sentiment_texts", len(todo), result="scored")
+    if todo:
+        pending = list(todo.items())
+        workers = workers or os.cpu_count() or 1
+        if workers > 1 and len(pending) >= SENTIMENT_PARALLEL_MIN:
+            shard = -(-len(pending) // (workers * 4))  # ~4 shards per worker to even out stragglers
+            shards = [[t for _, t in pending[i:i + shard]] for i in range(0, len(pending), shard)]
+            scores = [x for part in _get_pool(workers).map(_score_shard, shards) for x in part]
+        else:
+            scores = _score_shard([t for _, t in pending])
+        with _sent_lock:
+            for (k, _), score in zip(pending, scores):
+                out[k] = score
+                _sent_cache[k] = score
+            while len(_sent_cache) > SENTIMENT_CACHE_SIZE:
+                _sent_cache.popitem(last=False)
+    return [out[k] for k in keys]
+
+def fit_tfidf(corpus: Iterable[str]) -> TfidfVectorizer:
+    """Fit the keyphrase vectorizer; `corpus` may be a generator streaming descriptions."""
     vec = TfidfVectorizer(stop_words="english", ngram_range=(1, 2), max_features=3000)
-    X = vec.fit_transform(corpus)
-    vocab = np.array(vec.get_feature_names_out())
+    vec.fit(_norm(d) for d in corpus)
+    return vec
+
+# ---- Persisted keyphrase vectorizer (fit once, refresh on a schedule, transform-only in between) ----
+_tfidf_cache: Dict[str, Any] = {"mtime": None, "vec": None, "vocab": None}
+
+def refresh_tfidf(corpus: Iterable[str]) -> TfidfVectorizer:
+    """Refit on `corpus` and atomically replace the persisted vectorizer."""
+    vec = fit_tfidf(corpus)
+    TFIDF_PATH.parent.mkdir(parents=True, exist_ok=True)
+    tmp = TFIDF_PATH.with_suffix(".tmp")
+    dump({"vectorizer": vec, "fitted_at": time.time()}, tmp)
+    os.replace(tmp, TFIDF_PATH)
+    _tfidf_cache.update(mtime=TFIDF_PATH.stat().st_mtime, vec=vec, vocab=np.array(vec.get_feature_names_out()))
+    return vec
+
+def load_tfidf(max_age_s: float = TFIDF_MAX_AGE_S) -> Optional[TfidfVectorizer]:
+    """Persisted vectorizer if present and younger than `max_age_s`, else None (never fits)."""
+    if not TFIDF_PATH.exists():
+        return None
+    mtime = TFIDF_PATH.stat().st_mtime
+    if time.time() - mtime > max_age_s:
+        return None
+    if _tfidf_cache["mtime"] != mtime:
+        vec = load(TFIDF_PATH)["vectorizer"]
+        _tfidf_cache.update(mtime=mtime, vec=vec, vocab=np.array(vec.get_feature_names_out()))
+    return _tfidf_cache["vec"]
+
+def load_or_fit_tfidf(
+    corpus_factory: Callable[[], Iterable[str]],
+    max_age_s: float = TFIDF_MAX_AGE_S,
+) -> TfidfVectorizer:
+    """
+    Persisted vectorizer, refitted via `corpus_factory()` only if missing or older than `max_age_s`.
+    The in-memory copy is reused until the file on disk changes.
+    """
+    vec = load_tfidf(max_age_s)
+    return vec if vec is not None else refresh_tfidf(corpus_factory())
+
+def _vocab(vec: TfidfVectorizer) -> np.ndarray:
+    if _tfidf_cache["vec"] is vec:
+        return _tfidf_cache["vocab"]
+    return np.array(vec.get_feature_names_out())
+
+def top_k_terms(X, vocab: np.ndarray, top_k: int = 5) -> List[List[str]]:
+    """Top-k terms per row of a CSR matrix, working on the data/indices/indptr arrays directly."""
+    X = X.tocsr()
+    data, indices, indptr = X.data, X.indices, X.indptr
     out: List[List[str]] = []
     for i in range(X.shape[0]):
-        row = X.getrow(i)
-        if row.nnz == 0:
+        lo, hi = indptr[i], indptr[i + 1]
+        if hi == lo:
             out.append([])
             continue
-        arr = row.toarray()[0]
-        idx = np.argsort(-arr)[:top_k]
-        terms = [vocab[j] for j in idx if arr[j] > 0]
-        out.append(terms)
+        vals = data[lo:hi]
+        if hi - lo > top_k:
+            sel = np.argpartition(-vals, top_k - 1)[:top_k]
+        else:
+            sel = np.arange(hi - lo)
+        sel = sel[np.argsort(-vals[sel], kind="stable")]
+        out.append([vocab[indices[lo + j]] for j in sel if vals[j] > 0])
     return out
+
+def extract_keywords_tfidf(
+    docs: List[str],
+    top_k: int = 5,
+    corpus: Optional[Iterable[str]] = None,
+    vectorizer: Optional[TfidfVectorizer] = None,
+) -> List[List[str]]:
+    """
+    Top TF-IDF unigrams/bigrams per doc.
+    Vocabulary/IDF come from `vectorizer` if given (transform only), else are fitted on `corpus`,
+    else on `docs` themselves.
+    """
+    vec = vectorizer if vectorizer is not None else fit_tfidf(docs if corpus is None else corpus)
+    X = vec.transform([_norm(d) for d in docs])
+    return top_k_terms(X, _vocab(vec), top_k=top_k)